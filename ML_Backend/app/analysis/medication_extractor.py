@@ -1,29 +1,48 @@
 import re
-import json
-import os
-from groq import Groq
 from dotenv import load_dotenv
 
+from app.services.clients import get_async_groq_client
+from app.services.llm_cascade import LLMCascade, validate_medications
+from app.services.rate_limiter import rate_limiter
+from app.utils.llm_json import StreamingJSONParser
+from app.utils.normalize import canonical_dosage, canonical_name, parse_strength
+from app.utils.metrics import stage
 
-load_dotenv()
 
+load_dotenv()
 
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-groq_client = Groq(api_key=GROQ_API_KEY)
 
+# Small model first, escalating when the extraction fails validation.
+# Override with LLM_CASCADE_MODELS_EXTRACTION (LLAMA_MODEL names the vision model).
+extraction_cascade = LLMCascade("extraction")
 
-# - llama3-8b-8192
-# - llama3-70b-8192
-# - llama2-70b-4096
-LLAMA_MODEL = os.getenv("LLAMA_MODEL", "llama3-8b-8192")
+def _normalize_medication(med, seen):
+    """
+    Fill in defaults and a canonical dosage ("650mg" -> "650 mg", taken from the
+    name when the model left it out). Returns None for a medicine already seen
+    with the same strength; other strengths of a brand are kept.
+    """
+    med.setdefault("brand_name", "Unknown Medication")
+    dosage = med.get("dosage")
+    if not dosage:
+        strength = parse_strength(med["brand_name"])
+        dosage = str(strength) if strength and strength.unit else None
+    med["dosage"] = canonical_dosage(dosage) if isinstance(dosage, str) else dosage
+    # "Crocin 650" and "Crocin 650mg Tab" are one medicine, Crocin 650 and Crocin 500 are two
+    strength = parse_strength(med["dosage"]) if isinstance(med["dosage"], str) else None
+    strength = strength or parse_strength(med["brand_name"])
+    key = (canonical_name(med["brand_name"]), strength.value if strength else None)
+    if key in seen:
+        return None
+    seen.add(key)
+    return med
 
-async def extract_medications_with_llm(ocr_text):
+async def stream_medications_with_llm(ocr_text, model=None):
     """
-    Use Llama via Groq to extract structured medication information from OCR text
+    Use Llama via Groq to extract structured medication information from OCR text,
+    yielding each medication as soon as the model has finished writing it
     """
-    try:
-        
-        prompt = f"""
+    prompt = f"""
         The following text was extracted from a doctor's prescription using OCR:
         
         {ocr_text}
@@ -42,60 +61,50 @@ async def extract_medications_with_llm(ocr_text):
         If information is not available for certain fields, use null.
         Only return the JSON array and nothing else.
         """
-        
-        
-        response = groq_client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[
-                {"role": "system", "content": "You are a medical assistant specialized in analyzing prescriptions."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1, 
-            max_tokens=1000
-        )
-        
-        
-        result_text = response.choices[0].message.content.strip()
-        
-        
-        try:
-            medicines = json.loads(result_text)
-            
-            
-            for med in medicines:
-                if "brand_name" not in med:
-                    med["brand_name"] = "Unknown Medication"
-            
-            return medicines
-            
-        except json.JSONDecodeError:
-            
-            print("Warning: JSONDecodeError, attempting to parse text manually")
-            
-            medicines = []
-            lines = result_text.split('\n')
-            current_med = {}
-            
-            for line in lines:
-                if "brand_name" in line.lower() or "medication" in line.lower():
-                    if current_med and "brand_name" in current_med:
-                        medicines.append(current_med)
-                    current_med = {"brand_name": line.split(":")[-1].strip().strip('",')}
-                elif "dosage" in line.lower():
-                    current_med["dosage"] = line.split(":")[-1].strip().strip('",')
-                elif "frequency" in line.lower():
-                    current_med["frequency"] = line.split(":")[-1].strip().strip('",')
-                elif "duration" in line.lower():
-                    current_med["duration"] = line.split(":")[-1].strip().strip('",')
-            
-            if current_med and "brand_name" in current_med:
-                medicines.append(current_med)
-            
-            return medicines
-            
+    
+    await rate_limiter.wait_async("groq")
+    stream = await get_async_groq_client().chat.completions.create(
+        model=model or extraction_cascade.models[0],
+        messages=[
+            {"role": "system", "content": "You are a medical assistant specialized in analyzing prescriptions."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.1, 
+        max_tokens=1000,
+        stream=True
+    )
+    
+    parser = StreamingJSONParser()
+    # Canonical names already yielded, so a medicine repeated on the prescription is listed once
+    seen = set()
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            continue
+        for med in parser.feed(delta):
+            if isinstance(med, dict) and _normalize_medication(med, seen):
+                yield med
+    
+    # The model occasionally answers with a single object instead of an array
+    if parser.emitted == 0:
+        result = parser.finish()
+        if isinstance(result, dict) and _normalize_medication(result, seen):
+            yield result
+
+async def extract_medications_with_llm(ocr_text):
+    """
+    Use Llama via Groq to extract structured medication information from OCR text
+    """
+    async def attempt(model):
+        return [med async for med in stream_medications_with_llm(ocr_text, model)]
+    
+    try:
+        with stage("llm:extract_medications"):
+            medicines, _ = await extraction_cascade.run(attempt, validate_medications(ocr_text))
     except Exception as e:
         print(f"Error in medication extraction: {str(e)}")
-        return []
+        medicines = None
+    return medicines or []
 
 def extract_medications_with_regex(ocr_text):
     """
@@ -0,0 +1,46 @@
+"""
+All three services in one process.
+
+The prescription API is served at the root, the medicine information scraper
+under /info and the price comparison under /prices, so
+
+    uvicorn app.combined:app --port 8000
+
+replaces three interpreters with one. The services then share the Groq,
+Firecrawl and HTTP clients (one connection pool per provider), the metrics
+registry, the provider rate limits and every module-level cache, and each
+service keeps its own middleware, /metrics and lifespan.
+"""
+import os
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from fastapi import FastAPI
+
+from app.main import app as prescription_app
+from info_scraper.main import app as info_app
+from price_comparison.main import app as price_app
+
+INFO_MOUNT = os.getenv("INFO_SCRAPER_MOUNT", "/info")
+PRICES_MOUNT = os.getenv("PRICE_COMPARISON_MOUNT", "/prices")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the startup and shutdown of every mounted service, which Starlette does not do for mounts"""
+    async with AsyncExitStack() as stack:
+        for service in (prescription_app, info_app, price_app):
+            await stack.enter_async_context(service.router.lifespan_context(service))
+        yield
+
+
+app = FastAPI(title="MedGenix ML Services", lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+
+app.mount(INFO_MOUNT, info_app)
+app.mount(PRICES_MOUNT, price_app)
+# Mounted last: the root mount matches every path
+app.mount("/", prescription_app)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
@@ -1,19 +1,42 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
 import uvicorn
-from PIL import Image
-import io
 from typing import List, Optional
 from pydantic import BaseModel
+from PIL import Image
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-from app.ocr import extract_text_from_image
+from app.ocr import ocr_router, engine_states, warmup_engines, warmup_targets
+from app.ocr.pages import (open_pages, close_pages, ocr_pages, merge_page_texts,
+                           UnsupportedUpload, UploadTooLarge)
+from app.services.clients import init_clients, close_clients, clients_ready
+from app.services.admission import AdmissionController, AdmissionMiddleware
+from app.services.rate_limiter import rate_limiter
 from app.analysis.medication_extractor import extract_medications_with_llm
 from app.api.endpoints import generics
+from app.services.cache_warmup import run_startup_warmup
+from app.utils.profiling import enable_profiling
+from app.utils.metrics import instrument_app, stage
+from app.utils.uploads import UploadLimitMiddleware
+
+
+# Bound concurrent OCR/LLM pipelines so a burst queues here instead of tripping provider rate limits
+prescription_admission = AdmissionController(
+    "prescription",
+    max_in_flight=int(os.getenv("PRESCRIPTION_MAX_IN_FLIGHT", "8")),
+    queue_limits={
+        "interactive": int(os.getenv("PRESCRIPTION_MAX_QUEUE", "32")),
+        "batch": int(os.getenv("PRESCRIPTION_MAX_BATCH_QUEUE", "16"))
+    },
+    queue_timeout=float(os.getenv("PRESCRIPTION_QUEUE_TIMEOUT", "30"))
+)
 
 
 class Medicine(BaseModel):
@@ -22,26 +45,68 @@ class Medicine(BaseModel):
     frequency: Optional[str] = None
     duration: Optional[str] = None
 
+class PageTiming(BaseModel):
+    page: int
+    decode_ms: float
+    ocr_ms: float
+    characters: int
+
 class PrescriptionResponse(BaseModel):
     original_text: str
     medicines: List[Medicine]
+    pages: Optional[List[PageTiming]] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create API clients and optionally warm up OCR engines and the generics cache without blocking startup"""
+    init_clients()
+    app.state.warmup = None
+    targets = warmup_targets()
+    if targets:
+        app.state.warmup = asyncio.create_task(asyncio.to_thread(warmup_engines, targets))
+    # Pre-resolve generic alternatives for popular brands in the background
+    brands_file = os.getenv("CACHE_WARMUP_BRANDS_FILE")
+    cache_warmup = None
+    if brands_file:
+        cache_warmup = asyncio.create_task(run_startup_warmup(generics.generic_service, brands_file))
+    yield
+    if cache_warmup is not None:
+        cache_warmup.cancel()
+    # Keep the lookup counts the warm-up ranks brands by
+    await asyncio.to_thread(generics.generic_service.cache.flush)
+    await close_clients()
 
 
 app = FastAPI(
     title="Prescription Analyzer API",
     description="API for analyzing prescription images and extracting medication information",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
+# Bodies over MAX_UPLOAD_BYTES are refused before they are spooled
+app.add_middleware(UploadLimitMiddleware)
+
+# Admitted before the upload is read, so a saturated queue rejects without receiving it
+app.add_middleware(AdmissionMiddleware, controller=prescription_admission, paths=["/process-prescription/"])
+
+# Added after the upload limit and admission so it wraps them: their early 413 and
+# 503 carry CORS headers, and browsers can read Retry-After
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+# Profiling sits inside the metrics middleware so profiles share the request id
+enable_profiling(app, service="prescription")
+instrument_app(app, service="prescription")
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Prescription Analyzer API"}
@@ -49,42 +114,84 @@ def read_root():
 @app.post("/process-prescription/", response_model=PrescriptionResponse)
 async def process_prescription(file: UploadFile = File(...)):
     """
-    Process a prescription image and extract medication information.
+    Process a prescription image, multi-page PDF or multi-frame TIFF and
+    extract medication information. Pages are OCR'd in parallel and the
+    response lists per-page timings.
     
     Returns structured information about medications from the prescription.
+    Requests are admitted through a bounded queue; send `X-Priority: batch`
+    for bulk uploads so interactive requests are served first. A saturated
+    queue answers 503 with a Retry-After header.
     """
+    pages = None
     try:
         
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+        # Decoded straight from the spooled upload rather than a copy in memory;
+        # documents over MAX_PRESCRIPTION_PAGES are refused here with UploadTooLarge
+        with stage("image_open"):
+            _, pages = await asyncio.to_thread(open_pages, file.file)
         
         
-        ocr_text = await extract_text_from_image(image)
+        page_results = await ocr_pages(pages)
+        ocr_text = merge_page_texts(page_results)
         
         if not ocr_text:
             raise HTTPException(status_code=422, detail="Could not extract text from the image")
         
         
+        # One extraction over every page, so a medicine repeated across pages is listed once
         medicine_info = await extract_medications_with_llm(ocr_text)
         
         return PrescriptionResponse(
             original_text=ocr_text,
-            medicines=medicine_info
+            medicines=medicine_info,
+            pages=[
+                PageTiming(page=result.page, decode_ms=round(result.decode_seconds * 1000, 1),
+                           ocr_ms=round(result.ocr_seconds * 1000, 1), characters=len(result.text))
+                for result in page_results
+            ]
         )
     
+    except HTTPException:
+        raise
+    except UnsupportedUpload as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except (UploadTooLarge, Image.DecompressionBombError) as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+    finally:
+        if pages is not None:
+            await asyncio.to_thread(close_pages, pages)
 
 
 @app.get("/health")
 async def health_check():
-    """Check if the API is running"""
-    return {"status": "healthy", "ocr_method": os.getenv("OCR_METHOD", "llama")}
-
-
-@app.on_event("startup")
-def startup_event():
-    pass
+    """Check if the API is running and report OCR routing and circuit breaker state"""
+    return {
+        "status": "healthy",
+        "ocr_method": os.getenv("OCR_METHOD", "llama"),
+        "ocr_routing": ocr_router.snapshot(),
+        "admission": prescription_admission.snapshot(),
+        "rate_limits": rate_limiter.snapshot()
+    }
+
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Report whether the OCR engines are warm. Answers 503 while a configured
+    warmup is still running; engines that were not warmed up load on first use.
+    """
+    warmup = app.state.warmup
+    engines = engine_states()
+    warming = warmup is not None and not warmup.done()
+    body = {
+        "status": "warming" if warming else ("warm" if all(s == "warm" for s in engines.values()) else "cold"),
+        "engines": engines,
+        "clients": clients_ready()
+    }
+    return JSONResponse(body, status_code=503 if warming else 200)
 
 app.include_router(generics.router, prefix="/api", tags=["medications"])
 
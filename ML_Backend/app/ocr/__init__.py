@@ -1,87 +1,215 @@
+import asyncio
+import importlib
 import os
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Import OCR functions
-from app.ocr.preprocessing import preprocess_prescription
-from app.ocr.llama_vision import extract_with_llama_vision
-from app.ocr.fallbacks import extract_with_easyocr, extract_with_gpt4_vision
+from app.ocr.encoding import payload_cache
+from app.ocr.router import LOCAL_ENGINES, OCRRouter
+from app.utils.metrics import stage
+
+# Engines are imported on first use, so a deployment that never falls back to
+# EasyOCR never loads torch. Values are "module:function".
+OCR_ENGINES = {
+    "llama": "app.ocr.llama_vision:extract_with_llama_vision",
+    "gpt4": "app.ocr.fallbacks:extract_with_gpt4_vision",
+    "easyocr": "app.ocr.fallbacks:extract_with_easyocr",
+    "onnx": "app.ocr.onnx_ocr:extract_with_onnx"
+}
+
+# Engines whose model has to be loaded before the first call, and the function that loads it
+ENGINE_WARMUP = {
+    "easyocr": "app.ocr.fallbacks:get_easy_reader",
+    "onnx": "app.ocr.onnx_ocr:get_ocr_sessions"
+}
+
+_loaded = {}
+
+# Warmup state per engine: cold, warming, warm or failed
+warm_state = {}
+
+
+def _import(target):
+    module_name, _, attribute = target.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def load_engine(engine):
+    """Import an OCR engine the first time it is needed"""
+    function = _loaded.get(engine)
+    if function is None:
+        function = _loaded[engine] = _import(OCR_ENGINES[engine])
+    return function
+
+
+def warmup_engines(engines):
+    """Import engines and load their models (blocking, run it in a thread)"""
+    # Preprocessing pulls in OpenCV, which every request needs
+    importlib.import_module("app.ocr.preprocessing")
+    for engine in engines:
+        warm_state[engine] = "warming"
+    for engine in engines:
+        try:
+            load_engine(engine)
+            if engine in ENGINE_WARMUP:
+                _import(ENGINE_WARMUP[engine])()
+            warm_state[engine] = "warm"
+        except Exception as e:
+            print(f"Warmup of {engine} failed: {str(e)}")
+            warm_state[engine] = "failed"
+
+
+def warmup_targets():
+    """
+    Engines to warm up at startup, from OCR_WARMUP: unset/false for none,
+    true for the primary engine, all for every configured engine, or a
+    comma-separated list of engine names
+    """
+    setting = os.getenv("OCR_WARMUP", "").strip().lower()
+    if setting in ("", "false", "0", "no"):
+        return []
+    ocr_method = os.getenv("OCR_METHOD", "llama").lower()
+    if ocr_method not in OCR_ENGINES:
+        ocr_method = "easyocr"
+    if setting in ("true", "1", "yes"):
+        return [ocr_method]
+    if setting == "all":
+        return _configured_engines(ocr_method, os.getenv("FALLBACK_ENABLED", "true").lower() == "true")
+    return [engine.strip() for engine in setting.split(",") if engine.strip() in OCR_ENGINES]
+
+
+def engine_states():
+    """Warm/cold state of every engine this deployment may route to"""
+    ocr_method = os.getenv("OCR_METHOD", "llama").lower()
+    fallback_enabled = os.getenv("FALLBACK_ENABLED", "true").lower() == "true"
+    engines = _configured_engines(ocr_method if ocr_method in OCR_ENGINES else "easyocr", fallback_enabled)
+    states = {}
+    for engine in engines:
+        states[engine] = warm_state.get(engine, "cold")
+    return states
+
+# Shared health tracker so every request benefits from what earlier ones learned
+ocr_router = OCRRouter(
+    window_seconds=float(os.getenv("OCR_BREAKER_WINDOW_SECONDS", "120")),
+    error_threshold=float(os.getenv("OCR_BREAKER_ERROR_RATE", "0.5")),
+    min_calls=int(os.getenv("OCR_BREAKER_MIN_CALLS", "3")),
+    cooldown_seconds=float(os.getenv("OCR_BREAKER_COOLDOWN_SECONDS", "30"))
+)
+
+def _configured_engines(ocr_method, fallback_enabled):
+    """List the engines this request may use"""
+    if not fallback_enabled:
+        return [ocr_method]
+    engines = [ocr_method]
+    if ocr_method != "gpt4" and os.getenv("OPENAI_API_KEY"):
+        engines.append("gpt4")
+    if ocr_method != "llama" and os.getenv("TOGETHER_API_KEY"):
+        engines.append("llama")
+    # The local engine is the last resort when every remote provider fails
+    local_engine = os.getenv("OCR_LOCAL_ENGINE", "easyocr").lower()
+    if local_engine not in LOCAL_ENGINES:
+        local_engine = "easyocr"
+    if ocr_method != local_engine:
+        engines.append(local_engine)
+    return engines
+
+def _is_usable(text):
+    return bool(text) and len(text.strip()) > 10
+
+async def _run_engine(engine, image):
+    """Call an OCR engine and report the outcome to the router"""
+    if not ocr_router.acquire(engine):
+        # Half-open, and another request is already making the trial call
+        return ""
+    start = time.perf_counter()
+    ok = None
+    try:
+        with stage(f"ocr:{engine}"):
+            text = await load_engine(engine)(image)
+        # A completed call has imported the engine and loaded its model
+        warm_state.setdefault(engine, "warm")
+        ok = True
+    except Exception as e:
+        # Remote engines raise when the provider call fails; an empty reading is not a failure
+        print(f"{engine} OCR error: {str(e)}")
+        text = None
+        ok = False
+    finally:
+        if ok is None:
+            # Cancelled before an outcome: free a claimed trial without deciding the breaker
+            ocr_router.release(engine)
+    ocr_router.record(engine, time.perf_counter() - start, ok=ok)
+    return text or ""
 
 async def extract_text_from_image(image):
     """
     Extract text from prescription image using the best available method
     """
+    from app.ocr.fallbacks import easyocr_detection_cache
+    # Engines falling back on the same variant reuse its encoded payload, and
+    # EasyOCR reuses the text regions it found on the first variant
+    with payload_cache(), easyocr_detection_cache():
+        return await _extract_text(image)
+
+async def _extract_text(image):
     # Get configuration from environment
     ocr_method = os.getenv("OCR_METHOD", "llama").lower()
+    if ocr_method not in OCR_ENGINES:
+        ocr_method = "easyocr"
     fallback_enabled = os.getenv("FALLBACK_ENABLED", "true").lower() == "true"
-    
+
     # Preprocess the image to get multiple versions
-    image_versions = preprocess_prescription(image)
-    
+    from app.ocr.preprocessing import preprocess_prescription
+    from app.ocr.quality import rank_variants
+    # OpenCV work runs in a worker thread so other pages keep going meanwhile
+    image_versions = await asyncio.to_thread(preprocess_prescription, image)
+    # Best-looking distinct variants first, so fewer paid calls are spent on poor ones
+    ranked_versions = await asyncio.to_thread(rank_variants, image_versions)
+
     # Track results from different methods and versions
     results = {}
-    
-    # Try with the primary method and best image version first
-    primary_version = "edge_enhanced" if "edge_enhanced" in image_versions else "original"
-    
-    if ocr_method == "llama":
-        # Try Llama Vision first
-        results["llama"] = await extract_with_llama_vision(image_versions[primary_version])
-    elif ocr_method == "gpt4":
-        # Try GPT-4 Vision
-        results["gpt4"] = await extract_with_gpt4_vision(image_versions[primary_version])
-    else:
-        # Default to EasyOCR
-        results["easyocr"] = await extract_with_easyocr(image_versions[primary_version])
-    
-    # Check if we have a result
-    primary_result = results.get(ocr_method)
-    if primary_result and len(primary_result.strip()) > 10:  # Non-empty result
-        return primary_result
-    
+
+    # Route to the fastest healthy engine, skipping engines whose breaker is open
+    engines = ocr_router.route(ocr_method, _configured_engines(ocr_method, fallback_enabled))
+    if not engines:
+        print("No healthy OCR engine available")
+        return ""
+    primary_engine = engines[0]
+
+    # Try with the primary engine and best image version first
+    primary_version = ranked_versions[0]
+    results[primary_engine] = await _run_engine(primary_engine, image_versions[primary_version])
+    if _is_usable(results[primary_engine]):
+        return results[primary_engine]
+
     # If primary method failed and fallbacks are enabled, try other methods
     if fallback_enabled:
-        print(f"Primary method ({ocr_method}) failed. Trying fallbacks...")
-        
-        # Try with other image versions first
-        for version_name, version_img in image_versions.items():
-            if version_name != primary_version:
-                if ocr_method == "llama":
-                    version_result = await extract_with_llama_vision(version_img)
-                elif ocr_method == "gpt4":
-                    version_result = await extract_with_gpt4_vision(version_img)
-                else:
-                    version_result = await extract_with_easyocr(version_img)
-                
-                if version_result and len(version_result.strip()) > 10:
-                    return version_result
-        
-        # If still no result, try other OCR methods
-        if ocr_method != "gpt4" and os.getenv("OPENAI_API_KEY"):
-            print("Trying GPT-4 Vision fallback...")
-            results["gpt4"] = await extract_with_gpt4_vision(image_versions["original"])
-            if results["gpt4"] and len(results["gpt4"].strip()) > 10:
-                return results["gpt4"]
-        
-        if ocr_method != "llama" and os.getenv("TOGETHER_API_KEY"):
-            print("Trying Llama Vision fallback...")
-            results["llama"] = await extract_with_llama_vision(image_versions["original"])
-            if results["llama"] and len(results["llama"].strip()) > 10:
-                return results["llama"]
-        
-        # Last resort: EasyOCR
-        if ocr_method != "easyocr":
-            print("Trying EasyOCR fallback...")
-            results["easyocr"] = await extract_with_easyocr(image_versions["original"])
-            if results["easyocr"] and len(results["easyocr"].strip()) > 10:
-                return results["easyocr"]
-    
+        print(f"Primary method ({primary_engine}) failed. Trying fallbacks...")
+
+        # Try the next ranked image versions, unless the engine has just been tripped
+        for version_name in ranked_versions[1:]:
+            if not ocr_router.available(primary_engine):
+                break
+            version_result = await _run_engine(primary_engine, image_versions[version_name])
+            if _is_usable(version_result):
+                return version_result
+
+        # If still no result, try the other healthy engines in routing order
+        for engine in engines[1:]:
+            if not ocr_router.available(engine):
+                continue
+            print(f"Trying {engine} fallback...")
+            results[engine] = await _run_engine(engine, image_versions["original"])
+            if _is_usable(results[engine]):
+                return results[engine]
+
     # Return the best result we have, even if it's empty
-    for method in [ocr_method, "gpt4", "llama", "easyocr"]:
-        if method in results and results[method]:
-            return results[method]
-    
+    for engine in engines:
+        if results.get(engine):
+            return results[engine]
+
     # If everything failed, return empty string
-    return "" 
\ No newline at end of file
+    return ""
@@ -0,0 +1,128 @@
+"""
+Encoding of images for remote vision engines.
+
+A variant that falls through to a second engine is the same PIL image, so its
+encoded payload is cached for the duration of one ``extract_text_from_image``
+call and shared by every engine that asks for the same format. Images that
+carry no colour are encoded as single-channel data, black-and-white variants
+as 1-bit PNG, and the format and quality are configurable per engine for
+providers that accept WebP or PNG.
+"""
+import base64
+import io
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.utils.metrics import record_cache_lookup, registry, stage
+
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+# RGB images whose channels never differ by more than this are encoded as grayscale
+GRAY_TOLERANCE = 8
+
+ENCODE_SECONDS = registry.histogram(
+    "medgenix_ocr_encode_seconds", "Time spent encoding images for vision engines", ["format"])
+PAYLOAD_BYTES = registry.counter(
+    "medgenix_ocr_payload_bytes_total", "Base64 image bytes sent to vision engines", ["engine", "format"])
+
+# id(image) -> (image, {(format, quality): payload}) for the current OCR call
+_payloads: ContextVar[Optional[Dict[int, Tuple[Image.Image, dict]]]] = ContextVar("ocr_payloads", default=None)
+
+
+class EncodedImage(NamedTuple):
+    format: str
+    base64: str
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES[self.format]
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+
+def encoding_settings(engine: str) -> Tuple[str, int]:
+    """
+    Format and quality for an engine: OCR_IMAGE_FORMAT_<ENGINE> / OCR_IMAGE_FORMAT
+    (jpeg, webp or png) and OCR_JPEG_QUALITY, which also applies to WebP.
+    """
+    image_format = (os.getenv(f"OCR_IMAGE_FORMAT_{engine.upper()}") or os.getenv("OCR_IMAGE_FORMAT", "jpeg")).lower()
+    if image_format not in MIME_TYPES:
+        image_format = "jpeg"
+    return image_format, int(os.getenv("OCR_JPEG_QUALITY", "75"))
+
+
+def _is_gray(image: Image.Image) -> bool:
+    pixels = np.asarray(image.reduce(4) if min(image.size) >= 64 else image, dtype=np.int16)
+    return int(np.abs(pixels - pixels.mean(axis=2, keepdims=True)).max()) <= GRAY_TOLERANCE
+
+
+def _encodable(image: Image.Image) -> Image.Image:
+    """Single channel for images without colour, RGB for everything else."""
+    if image.mode == "L":
+        return image
+    if image.mode in ("1", "I", "I;16", "F"):
+        return image.convert("L")
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image.convert("L") if _is_gray(image) else image
+
+
+def _is_bilevel(image: Image.Image) -> bool:
+    pixels = np.asarray(image)
+    return not np.any((pixels != 0) & (pixels != 255))
+
+
+def _encode(image: Image.Image, image_format: str, quality: int) -> EncodedImage:
+    started = time.perf_counter()
+    with stage("ocr:encode"):
+        buffered = io.BytesIO()
+        image = _encodable(image)
+        if image.mode == "L" and _is_bilevel(image):
+            # Thresholded variants are lossless and several times smaller as 1-bit PNG
+            image_format = "png"
+            image.convert("1").save(buffered, format="PNG", optimize=True)
+        elif image_format == "jpeg":
+            image.save(buffered, format="JPEG", quality=quality, optimize=True)
+        elif image_format == "webp":
+            image.save(buffered, format="WEBP", quality=quality, method=4)
+        else:
+            image.save(buffered, format="PNG", optimize=True)
+        encoded = EncodedImage(image_format, base64.b64encode(buffered.getvalue()).decode("utf-8"))
+    ENCODE_SECONDS.observe(time.perf_counter() - started, format=image_format)
+    return encoded
+
+
+def encode_image(image: Image.Image, engine: str) -> EncodedImage:
+    """Encoded payload of an image for an engine, reused within the current OCR call."""
+    image_format, quality = encoding_settings(engine)
+    key = (image_format, quality if image_format != "png" else None)
+    cache = _payloads.get()
+    if cache is None:
+        encoded = _encode(image, image_format, quality)
+    else:
+        # The image is kept alongside its payloads so its id cannot be reused during the call
+        entry = cache.setdefault(id(image), (image, {}))
+        encoded = entry[1].get(key)
+        record_cache_lookup("ocr_payload", encoded is not None)
+        if encoded is None:
+            encoded = entry[1][key] = _encode(image, image_format, quality)
+    PAYLOAD_BYTES.inc(len(encoded.base64), engine=engine, format=encoded.format)
+    return encoded
+
+
+@contextmanager
+def payload_cache():
+    """Share encoded payloads between the engines called inside this block."""
+    token = _payloads.set({})
+    try:
+        yield
+    finally:
+        _payloads.reset(token)
@@ -1,48 +1,96 @@
+import asyncio
 import os
-import io
-import base64
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
 import numpy as np
-import easyocr
-import openai
-from PIL import Image
 from dotenv import load_dotenv
 
+from app.ocr.encoding import encode_image
+from app.utils.metrics import record_cache_lookup, stage
+
 # Load environment variables
 load_dotenv()
 
 # Get API keys from environment
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Seconds a vision provider may take before the call fails (and counts against its breaker)
+OCR_PROVIDER_TIMEOUT_SECONDS = float(os.getenv("OCR_PROVIDER_TIMEOUT_SECONDS", "60"))
 
 # Initialize EasyOCR reader
 easy_reader = None
+# One image at a time; torch already spreads each call over the cores
+_easy_reader_lock = threading.Lock()
+
+# Text regions detected during the current OCR call, keyed by image size, with
+# the most confident reading of each region across the variants recognised so far
+_detections: ContextVar[Optional[dict]] = ContextVar("easyocr_detections", default=None)
 
 def get_easy_reader():
     """Initialize EasyOCR reader if not already initialized"""
     global easy_reader
     if easy_reader is None:
+        # Imported here so torch is only loaded when EasyOCR is actually used
+        import easyocr
         print("Initializing EasyOCR...")
         easy_reader = easyocr.Reader(['en'])
     return easy_reader
 
+@contextmanager
+def easyocr_detection_cache():
+    """
+    Detect text regions once for all the variants of an image read inside this
+    block; later variants only re-run the recogniser on those regions.
+    """
+    token = _detections.set({})
+    try:
+        yield
+    finally:
+        _detections.reset(token)
+
+def _read_with_easyocr(image):
+    from easyocr.utils import reformat_input
+
+    ocr_reader = get_easy_reader()
+
+    # Convert PIL image to numpy array
+    image_np = np.array(image)
+    if len(image_np.shape) == 2:  # If grayscale, convert to RGB
+        image_np = np.stack((image_np,)*3, axis=-1)
+    img, img_cv_grey = reformat_input(image_np)
+
+    cache = _detections.get()
+    regions = cache.get(img_cv_grey.shape) if cache is not None else None
+    record_cache_lookup("easyocr_detection", regions is not None)
+    with _easy_reader_lock:
+        if regions is None:
+            # Variants share the geometry of the image, so the first (best ranked) one is detected
+            with stage("easyocr:detect"):
+                horizontal_list, free_list = ocr_reader.detect(img)
+            regions = {"horizontal": horizontal_list[0], "free": free_list[0], "best": {}}
+            if cache is not None:
+                cache[img_cv_grey.shape] = regions
+        with stage("easyocr:recognize"):
+            results = ocr_reader.recognize(img_cv_grey, horizontal_list=regions["horizontal"],
+                                           free_list=regions["free"], reformat=False)
+
+    # Keep the most confident reading of every region, in reading order
+    best = regions["best"]
+    for box, text, confidence in results:
+        key = tuple(int(v) for point in box for v in point)
+        if key not in best or confidence > best[key][1]:
+            best[key] = (text, confidence)
+    return " ".join(text for text, _ in best.values())
+
 async def extract_with_easyocr(image):
     """
-    Extract text using EasyOCR (fallback method)
+    Extract text using EasyOCR (fallback method). Within an OCR call, text is
+    detected once and each further variant improves the regions it reads better.
     """
     try:
-        # Get or initialize the OCR reader
-        ocr_reader = get_easy_reader()
-        
-        # Convert PIL image to numpy array
-        image_np = np.array(image)
-        if len(image_np.shape) == 2:  # If grayscale, convert to RGB
-            image_np = np.stack((image_np,)*3, axis=-1)
-        
-        # Perform OCR
-        results = ocr_reader.readtext(image_np)
-        
-        # Extract text
-        full_text = " ".join([text for _, text, _ in results])
-        return full_text
+        return await asyncio.to_thread(_read_with_easyocr, image)
         
     except Exception as e:
         print(f"EasyOCR Error: {str(e)}")
@@ -52,18 +100,20 @@ async def extract_with_gpt4_vision(image):
     """
     Extract text using GPT-4 Vision (high-quality fallback)
     """
+    # The openai 0.x client blocks, so the call runs in a worker thread
+    return await asyncio.to_thread(_call_gpt4_vision, image)
+
+def _call_gpt4_vision(image):
     try:
         if not OPENAI_API_KEY:
-            print("OpenAI API key not set. Skipping GPT-4 Vision.")
-            return ""
+            raise ValueError("OPENAI_API_KEY not set in environment variables")
         
         # Set up OpenAI client
+        import openai
         openai.api_key = OPENAI_API_KEY
         
-        # Convert PIL image to base64
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        # Encode once per OCR call; a variant already sent to another engine reuses its payload
+        encoded_image = encode_image(image, "gpt4")
         
         # Call the OpenAI API
         response = openai.ChatCompletion.create(
@@ -83,13 +133,14 @@ async def extract_with_gpt4_vision(image):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
+                                "url": encoded_image.data_url
                             }
                         }
                     ]
                 }
             ],
-            max_tokens=1000
+            max_tokens=1000,
+            request_timeout=OCR_PROVIDER_TIMEOUT_SECONDS
         )
         
         # Extract text from response
@@ -99,4 +150,5 @@ async def extract_with_gpt4_vision(image):
         
     except Exception as e:
         print(f"GPT-4 Vision Error: {str(e)}")
-        return "" 
\ No newline at end of file
+        # Raised so the router counts the provider failure
+        raise
@@ -1,22 +1,19 @@
+import asyncio
 import os
-import base64
-import io
-import requests
-from PIL import Image
 from dotenv import load_dotenv
 
+from app.ocr.encoding import encode_image
+from app.services.clients import get_http_session
+from app.services.rate_limiter import rate_limiter
+
 load_dotenv()
 
 
 TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
-print(TOGETHER_API_KEY)
 LLAMA_MODEL = os.getenv("LLAMA_MODEL", "meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo")
-
-def encode_image_base64(image):
-    """Convert PIL Image to base64 string"""
-    buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+TOGETHER_API_BASE = os.getenv("TOGETHER_API_BASE", "https://api.together.xyz/v1")
+# Seconds a vision provider may take before the call fails (and counts against its breaker)
+OCR_PROVIDER_TIMEOUT_SECONDS = float(os.getenv("OCR_PROVIDER_TIMEOUT_SECONDS", "60"))
 
 async def extract_with_llama_vision(image, model=None):
     """
@@ -32,14 +29,17 @@ async def extract_with_llama_vision(image, model=None):
     if not TOGETHER_API_KEY:
         raise ValueError("TOGETHER_API_KEY not set in environment variables")
     
-   
-    model_name = model or LLAMA_MODEL
+    await rate_limiter.wait_async("together")
+    # Encoding and the HTTP call block, so they run in a worker thread and pages OCR in parallel
+    return await asyncio.to_thread(_call_llama_vision, image, model or LLAMA_MODEL)
+
+def _call_llama_vision(image, model_name):
     
     
-    base64_image = encode_image_base64(image)
+    encoded_image = encode_image(image, "llama")
     
    
-    url = "https://api.together.xyz/v1/chat/completions"
+    url = f"{TOGETHER_API_BASE}/chat/completions"
     
     
     headers = {
@@ -74,7 +74,7 @@ async def extract_with_llama_vision(image, model=None):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
+                            "url": encoded_image.data_url
                         }
                     }
                 ]
@@ -85,8 +85,7 @@ async def extract_with_llama_vision(image, model=None):
     }
     
     try:
-       
-        response = requests.post(url, headers=headers, json=payload)
+        response = get_http_session().post(url, headers=headers, json=payload, timeout=OCR_PROVIDER_TIMEOUT_SECONDS)
         response.raise_for_status()
         
         
@@ -100,4 +99,5 @@ async def extract_with_llama_vision(image, model=None):
         
         if hasattr(e, 'response') and hasattr(e.response, 'text'):
             print(f"Response: {e.response.text}")
-        return "" 
\ No newline at end of file
+        # Raised so the router counts the provider failure
+        raise
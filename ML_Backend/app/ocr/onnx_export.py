@@ -0,0 +1,136 @@
+"""
+Export EasyOCR's detector and recogniser to ONNX and quantise them to int8.
+
+Needs torch and easyocr, which the ONNX engine itself does not. The recogniser
+is quantised dynamically (its LSTM and linear layers); the convolutional
+detector is quantised statically from calibration images when a directory of
+them is given, and dynamically otherwise.
+
+    python -m app.ocr.onnx_export --out models/onnx_ocr
+    python -m app.ocr.onnx_export --out models/onnx_ocr --calibration-dir benchmarks/corpus
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from app.ocr import onnx_ocr
+
+CALIBRATION_SUFFIXES = {".jpg", ".jpeg", ".png", ".tif", ".tiff"}
+
+
+def export_models(out_dir: str, language: str = "en", opset: int = 17) -> None:
+    """Write detector.onnx, recognizer.onnx and charset.json to ``out_dir``."""
+    import easyocr
+    import torch
+
+    class MeanOverLastDim(torch.nn.Module):
+        """AdaptiveAvgPool2d((None, 1)) does not export; averaging the last axis is the same operation."""
+
+        def forward(self, x):
+            return x.mean(dim=3, keepdim=True)
+
+    class Recognizer(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, image):
+            # The text argument is only used in training
+            return self.model(image, None)
+
+    os.makedirs(out_dir, exist_ok=True)
+    # EasyOCR quantises the recogniser in torch on CPU by default; export the float model instead
+    reader = easyocr.Reader([language], gpu=False, quantize=False)
+
+    detector = reader.detector.eval()
+    torch.onnx.export(
+        detector, torch.randn(1, 3, 736, 1280), os.path.join(out_dir, "detector.onnx"),
+        input_names=["image"], output_names=["scores", "features"], opset_version=opset,
+        dynamic_axes={"image": {2: "height", 3: "width"}, "scores": {1: "map_height", 2: "map_width"}}
+    )
+
+    model = reader.recognizer.eval()
+    if hasattr(model, "AdaptiveAvgPool"):
+        model.AdaptiveAvgPool = MeanOverLastDim()
+    torch.onnx.export(
+        Recognizer(model), torch.randn(1, 1, onnx_ocr.RECOGNIZER_HEIGHT, 256),
+        os.path.join(out_dir, "recognizer.onnx"),
+        input_names=["image"], output_names=["logits"], opset_version=opset,
+        dynamic_axes={"image": {0: "batch", 3: "width"}, "logits": {0: "batch", 1: "steps"}}
+    )
+
+    with open(os.path.join(out_dir, "charset.json"), "w") as f:
+        json.dump({"characters": reader.character, "language": language}, f)
+
+
+def _calibration_reader(paths, input_name: str, limit: int):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class DetectorCalibration(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(paths[:limit])
+
+        def get_next(self):
+            path = next(self.paths, None)
+            if path is None:
+                return None
+            detector_input, _ = onnx_ocr._detector_input(np.array(Image.open(path).convert("RGB")))
+            return {input_name: detector_input}
+
+    return DetectorCalibration()
+
+
+def quantize_models(out_dir: str, calibration_dir: str = None, calibration_count: int = 32) -> None:
+    """Write detector.int8.onnx and recognizer.int8.onnx next to the float models."""
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    def prepared(name):
+        # Shape inference and graph folding let the quantiser cover more of the graph
+        path = os.path.join(out_dir, f"{name}.prep.onnx")
+        quant_pre_process(os.path.join(out_dir, f"{name}.onnx"), path)
+        return path
+
+    recognizer_path = prepared("recognizer")
+    quantize_dynamic(recognizer_path, os.path.join(out_dir, "recognizer.int8.onnx"), weight_type=QuantType.QInt8)
+    os.remove(recognizer_path)
+
+    detector_path = prepared("detector")
+    quantized_path = os.path.join(out_dir, "detector.int8.onnx")
+    paths = sorted(str(p) for p in Path(calibration_dir).iterdir()
+                   if p.suffix.lower() in CALIBRATION_SUFFIXES) if calibration_dir else []
+    if not paths:
+        print("No calibration images; quantising the detector dynamically")
+        quantize_dynamic(detector_path, quantized_path, weight_type=QuantType.QUInt8)
+    else:
+        input_name = ort.InferenceSession(detector_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+        quantize_static(detector_path, quantized_path, _calibration_reader(paths, input_name, calibration_count),
+                        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8, per_channel=True)
+    os.remove(detector_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and quantise EasyOCR models for the ONNX OCR engine")
+    parser.add_argument("--out", default=onnx_ocr.ONNX_OCR_MODEL_DIR)
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--calibration-dir", help="Prescription images used to calibrate the detector")
+    parser.add_argument("--calibration-count", type=int, default=32)
+    parser.add_argument("--skip-export", action="store_true", help="Only quantise models already in --out")
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        export_models(args.out, args.language, args.opset)
+    quantize_models(args.out, args.calibration_dir, args.calibration_count)
+    for name in sorted(os.listdir(args.out)):
+        print(f"{name:<24}{os.path.getsize(os.path.join(args.out, name)) / 1e6:>8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
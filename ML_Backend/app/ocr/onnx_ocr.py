@@ -0,0 +1,250 @@
+"""
+Local OCR on ONNX Runtime.
+
+Runs EasyOCR's CRAFT detector and CRNN recogniser, exported to ONNX and
+quantised to int8 by ``python -m app.ocr.onnx_export``, without torch. The
+pre- and post-processing follow EasyOCR's defaults so results stay comparable:
+the detector's region and affinity maps are turned into word boxes, boxes on
+the same line are merged, and each line is recognised with greedy CTC decoding.
+"""
+import asyncio
+import json
+import math
+import os
+import threading
+from typing import List, NamedTuple, Tuple
+
+import cv2
+import numpy as np
+
+ONNX_OCR_MODEL_DIR = os.getenv("ONNX_OCR_MODEL_DIR", "models/onnx_ocr")
+# int8 models are used when present; fp32 is the unquantised export
+ONNX_OCR_PRECISION = os.getenv("ONNX_OCR_PRECISION", "int8").lower()
+# 0 lets ONNX Runtime use one thread per physical core
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+# Images recognised at the same time; each already uses every intra-op thread
+ONNX_OCR_CONCURRENCY = int(os.getenv("ONNX_OCR_CONCURRENCY", "1"))
+ONNX_DETECT_MAX_SIDE = int(os.getenv("ONNX_DETECT_MAX_SIDE", "1280"))
+
+# CRAFT thresholds, as EasyOCR's readtext defaults
+TEXT_THRESHOLD = 0.7
+LOW_TEXT = 0.4
+LINK_THRESHOLD = 0.4
+MIN_COMPONENT_SIZE = 10
+# Boxes whose vertical centres are within this share of their height are on one line
+LINE_CENTER_THS = 0.5
+# Gaps narrower than this share of the line height join two boxes into one
+MERGE_WIDTH_THS = 0.5
+BOX_MARGIN = 0.1
+RECOGNIZER_HEIGHT = 64
+RECOGNIZER_BATCH = 16
+MIN_CONFIDENCE = 0.1
+
+DETECTOR_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32) * 255
+DETECTOR_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32) * 255
+
+_sessions = None
+_sessions_lock = threading.Lock()
+_inference_slots = threading.BoundedSemaphore(max(1, ONNX_OCR_CONCURRENCY))
+
+
+class OCRSessions(NamedTuple):
+    detector: object
+    recognizer: object
+    characters: List[str]
+
+
+class TextLine(NamedTuple):
+    box: Tuple[int, int, int, int]  # x0, y0, x1, y1
+    text: str
+    confidence: float
+
+
+def _model_path(name: str) -> str:
+    quantized = os.path.join(ONNX_OCR_MODEL_DIR, f"{name}.int8.onnx")
+    if ONNX_OCR_PRECISION == "int8" and os.path.exists(quantized):
+        return quantized
+    return os.path.join(ONNX_OCR_MODEL_DIR, f"{name}.onnx")
+
+
+def _session_options():
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+    options.inter_op_num_threads = 1
+    # Idle worker threads would otherwise spin and take CPU from the event loop between requests
+    options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    return options
+
+
+def get_ocr_sessions() -> OCRSessions:
+    """Load the detector and recogniser sessions once (blocking)."""
+    global _sessions
+    if _sessions is None:
+        with _sessions_lock:
+            if _sessions is None:
+                # Imported here so deployments that never use this engine do not load ONNX Runtime
+                import onnxruntime as ort
+                options = _session_options()
+                providers = ["CPUExecutionProvider"]
+                with open(os.path.join(ONNX_OCR_MODEL_DIR, "charset.json"), "r") as f:
+                    characters = ["[blank]"] + list(json.load(f)["characters"])
+                detector_path, recognizer_path = _model_path("detector"), _model_path("recognizer")
+                print(f"Loading ONNX OCR models {detector_path} and {recognizer_path}")
+                _sessions = OCRSessions(
+                    ort.InferenceSession(detector_path, options, providers=providers),
+                    ort.InferenceSession(recognizer_path, options, providers=providers),
+                    characters
+                )
+    return _sessions
+
+
+def _detector_input(rgb: np.ndarray) -> Tuple[np.ndarray, float]:
+    height, width = rgb.shape[:2]
+    ratio = min(1.0, ONNX_DETECT_MAX_SIDE / max(height, width))
+    target_h, target_w = max(32, int(height * ratio)), max(32, int(width * ratio))
+    resized = cv2.resize(rgb, (target_w, target_h), interpolation=cv2.INTER_LINEAR)
+    # CRAFT downsamples by 32, so the canvas is padded to a multiple of it
+    canvas = np.zeros((target_h + (-target_h % 32), target_w + (-target_w % 32), 3), dtype=np.float32)
+    canvas[:target_h, :target_w] = resized
+    canvas = (canvas - DETECTOR_MEAN) / DETECTOR_STD
+    return canvas.transpose(2, 0, 1)[np.newaxis], target_w / width
+
+
+def detect_boxes(scores: np.ndarray, ratio: float) -> List[Tuple[int, int, int, int]]:
+    """Word boxes from CRAFT's region and affinity maps, in original image coordinates."""
+    region, affinity = scores[..., 0], scores[..., 1]
+    text_map = region > LOW_TEXT
+    combined = (text_map | (affinity > LINK_THRESHOLD)).astype(np.uint8)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(combined, connectivity=4)
+    map_h, map_w = region.shape
+    # The score maps are half the detector input size
+    scale = 2 / ratio
+    boxes = []
+    for k in range(1, count):
+        x, y, w, h, size = stats[k]
+        if size < MIN_COMPONENT_SIZE:
+            continue
+        component = labels[y:y + h, x:x + w] == k
+        if region[y:y + h, x:x + w][component].max() < TEXT_THRESHOLD:
+            continue
+        # Same padding EasyOCR dilates each component by
+        pad = int(math.sqrt(size * min(w, h) / (w * h)) * 2)
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(map_w, x + w + pad + 1), min(map_h, y + h + pad + 1)
+        boxes.append((int(x0 * scale), int(y0 * scale), int(x1 * scale), int(y1 * scale)))
+    return boxes
+
+
+def merge_lines(boxes: List[Tuple[int, int, int, int]]) -> List[List[Tuple[int, int, int, int]]]:
+    """Group boxes into lines, top to bottom, and join neighbours that belong to one phrase."""
+    lines = []
+    for box in sorted(boxes, key=lambda b: (b[1] + b[3]) / 2):
+        center, height = (box[1] + box[3]) / 2, box[3] - box[1]
+        if lines:
+            line = lines[-1]
+            line_center = sum((b[1] + b[3]) / 2 for b in line) / len(line)
+            line_height = sum(b[3] - b[1] for b in line) / len(line)
+            if abs(center - line_center) < LINE_CENTER_THS * max(height, line_height):
+                line.append(box)
+                continue
+        lines.append([box])
+
+    merged = []
+    for line in lines:
+        line.sort(key=lambda b: b[0])
+        phrases = [list(line[0])]
+        for x0, y0, x1, y1 in line[1:]:
+            current = phrases[-1]
+            if x0 - current[2] < MERGE_WIDTH_THS * (current[3] - current[1]):
+                current[1], current[2], current[3] = min(current[1], y0), max(current[2], x1), max(current[3], y1)
+            else:
+                phrases.append([x0, y0, x1, y1])
+        merged.append([tuple(phrase) for phrase in phrases])
+    return merged
+
+
+def _add_margin(box, shape):
+    x0, y0, x1, y1 = box
+    margin = int(BOX_MARGIN * (y1 - y0))
+    x0, y0 = min(shape[1] - 1, max(0, x0 - margin)), min(shape[0] - 1, max(0, y0 - margin))
+    return x0, y0, max(x0 + 1, min(shape[1], x1 + margin)), max(y0 + 1, min(shape[0], y1 + margin))
+
+
+def _recognizer_batch(gray: np.ndarray, boxes) -> np.ndarray:
+    crops = []
+    for x0, y0, x1, y1 in boxes:
+        crop = gray[y0:y1, x0:x1]
+        width = max(1, math.ceil(RECOGNIZER_HEIGHT * crop.shape[1] / max(1, crop.shape[0])))
+        crops.append(cv2.resize(crop, (width, RECOGNIZER_HEIGHT), interpolation=cv2.INTER_CUBIC))
+    max_width = max(crop.shape[1] for crop in crops)
+    batch = np.empty((len(crops), 1, RECOGNIZER_HEIGHT, max_width), dtype=np.float32)
+    for i, crop in enumerate(crops):
+        # Pad on the right by repeating the last column, as EasyOCR's NormalizePAD does
+        batch[i, 0] = np.pad(crop, ((0, 0), (0, max_width - crop.shape[1])), mode="edge")
+    return (batch / 255.0 - 0.5) / 0.5
+
+
+def decode_ctc(logits: np.ndarray, characters: List[str]) -> List[Tuple[str, float]]:
+    """Greedy CTC decoding of a [batch, steps, classes] output into text and confidence."""
+    exp = np.exp(logits - logits.max(axis=2, keepdims=True))
+    probs = exp / exp.sum(axis=2, keepdims=True)
+    best = probs.argmax(axis=2)
+    best_prob = probs.max(axis=2)
+    results = []
+    for indices, prob in zip(best, best_prob):
+        # Keep the first of each run of repeated classes, then drop blanks
+        keep = np.ones(len(indices), dtype=bool)
+        keep[1:] = indices[1:] != indices[:-1]
+        keep &= indices != 0
+        text = "".join(characters[i] for i in indices[keep])
+        kept = prob[keep]
+        # EasyOCR's confidence: the product of the character probabilities, softened by length
+        confidence = float(kept.prod() ** (2.0 / math.sqrt(len(kept)))) if len(kept) else 0.0
+        results.append((text, confidence))
+    return results
+
+
+def read_text(image) -> List[List[TextLine]]:
+    """Detect and recognise text in a PIL image (blocking). Returns lines of phrases, top to bottom."""
+    sessions = get_ocr_sessions()
+    rgb = np.array(image.convert("RGB"))
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    with _inference_slots:
+        detector_input, ratio = _detector_input(rgb)
+        scores = sessions.detector.run(None, {sessions.detector.get_inputs()[0].name: detector_input})[0][0]
+        lines = [[_add_margin(box, gray.shape) for box in line] for line in merge_lines(detect_boxes(scores, ratio))]
+        boxes = [box for line in lines for box in line]
+        recognized = []
+        for start in range(0, len(boxes), RECOGNIZER_BATCH):
+            chunk = boxes[start:start + RECOGNIZER_BATCH]
+            batch = _recognizer_batch(gray, chunk)
+            logits = sessions.recognizer.run(None, {sessions.recognizer.get_inputs()[0].name: batch})[0]
+            recognized += decode_ctc(logits, sessions.characters)
+
+    results = iter(recognized)
+    text_lines = []
+    for line in lines:
+        phrases = []
+        for box in line:
+            text, confidence = next(results)
+            if text.strip() and confidence >= MIN_CONFIDENCE:
+                phrases.append(TextLine(box, text, confidence))
+        if phrases:
+            text_lines.append(phrases)
+    return text_lines
+
+
+async def extract_with_onnx(image):
+    """
+    Extract text with the quantised ONNX models. Runs in a worker thread so the
+    event loop keeps serving other requests.
+    """
+    try:
+        lines = await asyncio.to_thread(read_text, image)
+        return "\n".join(" ".join(phrase.text for phrase in line) for line in lines)
+    except Exception as e:
+        print(f"ONNX OCR Error: {str(e)}")
+        return ""
@@ -0,0 +1,266 @@
+"""
+Multi-page prescriptions: PDFs and multi-frame TIFFs.
+
+Pages are decoded one at a time and only when an OCR slot is free, so at most
+PAGE_OCR_CONCURRENCY pages are held in memory however long the document is.
+Each page goes through ``extract_text_from_image`` like a single upload, and
+the page texts are merged in order for a single medication extraction.
+
+Uploads are read straight from the spooled request file. The type is taken
+from the magic bytes rather than the client's content type, and images whose
+header declares more than MAX_IMAGE_PIXELS pixels are refused before decoding.
+"""
+import asyncio
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+from app.ocr import extract_text_from_image
+from app.utils.metrics import stage
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+PDF_MAGIC = b"%PDF-"
+
+# Leading bytes of every accepted image type, mapped to the PIL decoder that reads it
+IMAGE_MAGIC = [
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+    (b"BM", "BMP"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+]
+
+PAGE_OCR_CONCURRENCY = int(os.getenv("PAGE_OCR_CONCURRENCY", "3"))
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "200"))
+MAX_PRESCRIPTION_PAGES = int(os.getenv("MAX_PRESCRIPTION_PAGES", "20"))
+# Largest page decoded, in pixels; 0 disables the check. 50 MP is an 8660x5770 image,
+# well above any phone camera, and decodes to about 150 MB of RGB.
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+
+# PIL's own decompression-bomb check, which also covers images opened elsewhere
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS or None
+
+# Repeated lines shorter than this are kept, they are often parts of a table row
+MIN_REPEATED_LINE = 8
+
+# PDFium is not thread-safe, and pages are rendered in worker threads
+_pdfium_lock = threading.Lock()
+
+
+class UnsupportedUpload(ValueError):
+    """The upload is not an image or PDF this service can read."""
+
+
+class UploadTooLarge(ValueError):
+    """The upload would decode to more pixels than MAX_IMAGE_PIXELS, or has more than MAX_PRESCRIPTION_PAGES pages."""
+
+
+class PageResult(NamedTuple):
+    page: int
+    text: str
+    decode_seconds: float
+    ocr_seconds: float
+
+
+def is_pdf(contents: bytes) -> bool:
+    # The header may follow a few bytes of junk, which readers tolerate
+    return PDF_MAGIC in contents[:1024]
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """"PDF" or the PIL format named by an upload's first bytes, None when unsupported."""
+    if is_pdf(head):
+        return "PDF"
+    for magic, image_format in IMAGE_MAGIC:
+        if head.startswith(magic):
+            return image_format
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def _check_pixels(width: float, height: float) -> None:
+    if MAX_IMAGE_PIXELS and width * height > MAX_IMAGE_PIXELS:
+        raise UploadTooLarge(f"Image of {int(width)}x{int(height)} pixels exceeds the limit of {MAX_IMAGE_PIXELS} pixels")
+
+
+def _check_pages(count: int) -> None:
+    if count > MAX_PRESCRIPTION_PAGES:
+        raise UploadTooLarge(f"Documents are limited to {MAX_PRESCRIPTION_PAGES} pages")
+
+
+def open_pages(file: BinaryIO) -> Tuple[int, Iterator[Image.Image]]:
+    """
+    Page count of an upload and an iterator that decodes its pages one at a time,
+    reading from ``file``, which must stay open until the pages are consumed.
+    Anything other than a PDF or TIFF is a single page. Blocking; pages are only
+    decoded by the iterator, but PDFs parse their page tree here. Pass the
+    iterator to ``close_pages`` when done, consumed or not.
+    """
+    file.seek(0)
+    image_format = sniff_format(file.read(1024))
+    file.seek(0)
+    if image_format is None:
+        raise UnsupportedUpload("Upload is not a supported image or PDF")
+
+    if image_format == "PDF":
+        if pdfium is None:
+            raise ValueError("PDF uploads require pypdfium2")
+        # PDFium reads through readinto(), which SpooledTemporaryFile only has from
+        # Python 3.11; older versions read from a copy in a real temporary file
+        copy = None
+        if not hasattr(file, "readinto"):
+            copy = tempfile.TemporaryFile()
+            shutil.copyfileobj(file, copy)
+            copy.seek(0)
+        pages = _PdfPages(copy)
+        try:
+            with _pdfium_lock:
+                pages.document = pdfium.PdfDocument(copy or file)
+                pages.count = len(pages.document)
+            _check_pages(pages.count)
+        except BaseException:
+            pages.close()
+            raise
+        return pages.count, pages
+
+    # Only the header is read here; restricting the decoder skips probing every other format
+    image = Image.open(file, formats=[image_format])
+    _check_pixels(*image.size)
+    # Other multi-frame formats are not documents: GIF frames are animation and
+    # phone-camera MPO files carry a depth map as a second frame
+    count = getattr(image, "n_frames", 1) if image.format == "TIFF" else 1
+    _check_pages(count)
+    return count, _decode_frames(image, count)
+
+
+def close_pages(pages: Iterator[Image.Image]) -> None:
+    """Release the PDFium document behind a PDF's pages; other uploads hold nothing to release."""
+    if isinstance(pages, _PdfPages):
+        pages.close()
+
+
+class _PdfPages:
+    """
+    Renders a PDF's pages one at a time. Unlike a generator, ``close`` also
+    releases a document whose pages were never started, and does it under the
+    PDFium lock rather than leaving it to garbage collection in any thread.
+    """
+
+    def __init__(self, copy=None):
+        self.document = None
+        self.count = 0
+        self.index = 0
+        self.copy = copy
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Image.Image:
+        with _pdfium_lock:
+            if self.document is None or self.index >= self.count:
+                image = None
+            else:
+                page = self.document[self.index]
+                try:
+                    scale = PDF_RENDER_DPI / 72
+                    width, height = page.get_size()
+                    if MAX_IMAGE_PIXELS and width * height * scale * scale > MAX_IMAGE_PIXELS:
+                        # Oversized pages are rendered at a lower resolution rather than refused
+                        scale = math.sqrt(MAX_IMAGE_PIXELS / (width * height))
+                    image = page.render(scale=scale).to_pil()
+                finally:
+                    page.close()
+                self.index += 1
+        if image is None:
+            self.close()
+            raise StopIteration
+        return image
+
+    def close(self) -> None:
+        with _pdfium_lock:
+            if self.document is not None:
+                self.document.close()
+                self.document = None
+        if self.copy is not None:
+            self.copy.close()
+            self.copy = None
+
+
+def _decode_frames(image: Image.Image, count: int) -> Iterator[Image.Image]:
+    if count == 1:
+        image.load()
+        yield image
+        return
+    for index in range(count):
+        image.seek(index)
+        _check_pixels(*image.size)
+        # Frames share one decoder; copy so a page survives the next seek
+        yield image.copy()
+
+
+def merge_page_texts(results: List[PageResult]) -> str:
+    """
+    Join page texts in page order. Lines already seen on an earlier page, such as
+    letterheads, patient details and footers, are dropped; medicines listed on
+    several pages are deduplicated by the extraction anyway.
+    """
+    seen = set()
+    parts = []
+    for result in results:
+        lines = []
+        page_keys = set()
+        for line in result.text.splitlines():
+            key = " ".join(line.split()).lower()
+            if len(key) >= MIN_REPEATED_LINE:
+                if key in seen:
+                    continue
+                page_keys.add(key)
+            lines.append(line)
+        seen |= page_keys
+        text = "\n".join(lines).strip()
+        if text:
+            parts.append(text)
+    return "\n\n".join(parts)
+
+
+async def ocr_pages(pages: Iterator[Image.Image], concurrency: int = PAGE_OCR_CONCURRENCY) -> List[PageResult]:
+    """OCR pages in parallel, decoding the next page only once a slot is free."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks = []
+
+    async def run(number, image, decode_seconds):
+        try:
+            started = time.perf_counter()
+            text = await extract_text_from_image(image)
+            return PageResult(number, text or "", decode_seconds, time.perf_counter() - started)
+        finally:
+            semaphore.release()
+
+    try:
+        while True:
+            await semaphore.acquire()
+            started = time.perf_counter()
+            with stage("image_decode"):
+                image = await asyncio.to_thread(next, pages, None)
+            if image is None:
+                semaphore.release()
+                break
+            tasks.append(asyncio.create_task(run(len(tasks) + 1, image, time.perf_counter() - started)))
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -1,7 +1,128 @@
+import os
+
 import cv2
 import numpy as np
 from PIL import Image, ImageEnhance, ImageFilter
 
+from app.ocr.quality import text_mask
+from app.utils.metrics import stage
+
+OCR_CROP_DOCUMENT = os.getenv("OCR_CROP_DOCUMENT", "true").lower() == "true"
+
+# Documents and text are located on a copy this size; the crop is applied at full resolution
+CROP_DETECT_SIDE = 1000
+# A paper outline must cover this share of the photo to count as the document
+MIN_DOCUMENT_AREA = 0.2
+# Padding around the text block, as a share of its longer side
+CROP_MARGIN = 0.03
+# Text components smaller than this share of the image are specks, grain or noise
+MIN_TEXT_COMPONENT = 0.0002
+# Crops that would keep more than this share of an already straight image are skipped
+MAX_CROP_AREA = 0.9
+MIN_DESKEW_DEGREES = 0.5
+
+
+def _order_corners(points):
+    """Corners as top-left, top-right, bottom-right, bottom-left."""
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([points[np.argmin(sums)], points[np.argmin(diffs)],
+                     points[np.argmax(sums)], points[np.argmax(diffs)]], dtype=np.float32)
+
+
+def find_document_quad(gray):
+    """Corners of the paper in a photo, or None when no large four-sided outline is found."""
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < MIN_DOCUMENT_AREA * gray.size:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return _order_corners(approx.reshape(4, 2).astype(np.float32))
+    return None
+
+
+def _warp_document(pixels, corners):
+    top_left, top_right, bottom_right, bottom_left = corners
+    width = int(max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left)))
+    height = int(max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right)))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(pixels, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+
+
+def text_region(gray):
+    """
+    Rotated rectangle ((cx, cy), (w, h), angle) around the text of an image, or
+    None. Strokes are merged into lines so isolated specks can be dropped, and
+    lines touching the image border (table edges, shadows) are ignored.
+    """
+    mask = text_mask(gray)
+    lines = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 5)))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(lines)
+    height, width = gray.shape
+    left, top = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+    right, bottom = left + stats[:, cv2.CC_STAT_WIDTH], top + stats[:, cv2.CC_STAT_HEIGHT]
+    keep = (stats[:, cv2.CC_STAT_AREA] >= MIN_TEXT_COMPONENT * gray.size) \
+        & (left > 0) & (top > 0) & (right < width) & (bottom < height)
+    keep[0] = False  # background
+    if not keep.any():
+        return None
+    points = cv2.findNonZero(np.where(keep[labels], mask, 0).astype(np.uint8))
+    if points is None or len(points) < 50:
+        return None
+    return cv2.minAreaRect(points)
+
+
+def crop_to_document(image):
+    """
+    Crop a photo to its text: warp the paper flat when its outline is found,
+    then cut out the rotated rectangle around the text, which also deskews it.
+    Returns the image unchanged when no text is found or the crop would not help.
+    """
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    pixels = np.array(image)
+    gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+    scale = min(1.0, CROP_DETECT_SIDE / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+
+    corners = find_document_quad(small)
+    if corners is not None:
+        pixels = _warp_document(pixels, corners / scale)
+        gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+        scale = min(1.0, CROP_DETECT_SIDE / max(gray.shape))
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+
+    region = text_region(small)
+    if region is None:
+        return Image.fromarray(pixels) if corners is not None else image
+    (center_x, center_y), (width, height), angle = region
+    # Normalise to the smallest rotation, swapping sides when OpenCV measured from the other edge
+    if angle > 45:
+        angle -= 90
+        width, height = height, width
+    elif angle < -45:
+        angle += 90
+        width, height = height, width
+    if abs(angle) < MIN_DESKEW_DEGREES:
+        angle = 0.0
+    center_x, center_y, width, height = center_x / scale, center_y / scale, width / scale, height / scale
+    margin = CROP_MARGIN * max(width, height)
+    out_width, out_height = int(width + 2 * margin), int(height + 2 * margin)
+    if corners is None and angle == 0.0 and out_width * out_height > MAX_CROP_AREA * gray.size:
+        return image
+
+    # Rotate about the text centre and move it to the centre of the output
+    matrix = cv2.getRotationMatrix2D((center_x, center_y), angle, 1.0)
+    matrix[0, 2] += out_width / 2 - center_x
+    matrix[1, 2] += out_height / 2 - center_y
+    cropped = cv2.warpAffine(pixels, matrix, (out_width, out_height),
+                             flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return Image.fromarray(cropped)
+
 def preprocess_prescription(image):
     """
     Create multiple enhanced versions of the prescription image
@@ -15,57 +136,68 @@ def preprocess_prescription(image):
             raise TypeError("Image must be PIL Image or numpy array")
     
     
+    # Drop the table, hands and margins before anything else is computed or uploaded
+    if OCR_CROP_DOCUMENT:
+        with stage("preprocess:crop"):
+            image = crop_to_document(image)
+
     versions = {"original": image}
     
     
-    img_cv = np.array(image)
-    if len(img_cv.shape) == 3:
-        img_cv = cv2.cvtColor(img_cv, cv2.COLOR_RGB2BGR)
-    
-    
-    if len(img_cv.shape) == 3:
-        gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = img_cv
-    versions["grayscale"] = Image.fromarray(gray)
-    
-    
-    enhanced_cv = cv2.convertScaleAbs(gray, alpha=1.5, beta=0)
-    versions["contrast"] = Image.fromarray(enhanced_cv)
-    
-    
-    try:
-        thresh = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 21, 10
-        )
-        versions["threshold"] = Image.fromarray(thresh)
-    except Exception as e:
-        print(f"Thresholding error: {e}")
-    
-    
-    try:
-        denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
-        versions["denoised"] = Image.fromarray(denoised)
-    except Exception as e:
-        print(f"Denoising error: {e}")
-    
-    
-    try:
-        edges = cv2.Canny(gray, 50, 150)
-        edge_enhanced = cv2.addWeighted(gray, 0.8, edges, 0.2, 0)
-        versions["edge_enhanced"] = Image.fromarray(edge_enhanced)
-    except Exception as e:
-        print(f"Edge enhancement error: {e}")
-    
-    
-    try:
-        pil_gray = versions["grayscale"]
-        enhancer = ImageEnhance.Sharpness(pil_gray)
-        sharpened = enhancer.enhance(2.0)
-        versions["sharpened"] = sharpened
-    except Exception as e:
-        print(f"Sharpening error: {e}")
+    with stage("preprocess:grayscale"):
+        img_cv = np.array(image)
+        if len(img_cv.shape) == 3:
+            img_cv = cv2.cvtColor(img_cv, cv2.COLOR_RGB2BGR)
+        
+        
+        if len(img_cv.shape) == 3:
+            gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = img_cv
+        versions["grayscale"] = Image.fromarray(gray)
+    
+    
+    with stage("preprocess:contrast"):
+        enhanced_cv = cv2.convertScaleAbs(gray, alpha=1.5, beta=0)
+        versions["contrast"] = Image.fromarray(enhanced_cv)
+    
+    
+    with stage("preprocess:threshold"):
+        try:
+            thresh = cv2.adaptiveThreshold(
+                gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                cv2.THRESH_BINARY, 21, 10
+            )
+            versions["threshold"] = Image.fromarray(thresh)
+        except Exception as e:
+            print(f"Thresholding error: {e}")
+    
+    
+    with stage("preprocess:denoised"):
+        try:
+            denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
+            versions["denoised"] = Image.fromarray(denoised)
+        except Exception as e:
+            print(f"Denoising error: {e}")
+    
+    
+    with stage("preprocess:edge_enhanced"):
+        try:
+            edges = cv2.Canny(gray, 50, 150)
+            edge_enhanced = cv2.addWeighted(gray, 0.8, edges, 0.2, 0)
+            versions["edge_enhanced"] = Image.fromarray(edge_enhanced)
+        except Exception as e:
+            print(f"Edge enhancement error: {e}")
+    
+    
+    with stage("preprocess:sharpened"):
+        try:
+            pil_gray = versions["grayscale"]
+            enhancer = ImageEnhance.Sharpness(pil_gray)
+            sharpened = enhancer.enhance(2.0)
+            versions["sharpened"] = sharpened
+        except Exception as e:
+            print(f"Sharpening error: {e}")
     
     
     return versions 
\ No newline at end of file
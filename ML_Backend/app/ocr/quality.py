@@ -0,0 +1,124 @@
+"""
+Cheap local quality scores for preprocessed variants.
+
+Every variant sent to a remote vision engine is a paid call, so variants are
+scored locally first and tried best first. The score combines sharpness
+(variance of the Laplacian), RMS contrast, text-pixel density and a skew
+penalty, all computed on a downsampled grayscale copy. Variants that are
+near-duplicates of a better one (highly correlated text masks) are dropped,
+and at most OCR_MAX_VARIANTS are kept.
+"""
+import os
+from typing import Dict, List, NamedTuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.utils.metrics import registry, stage
+
+OCR_MAX_VARIANTS = int(os.getenv("OCR_MAX_VARIANTS", "3"))
+OCR_VARIANT_DUPLICATE_CORR = float(os.getenv("OCR_VARIANT_DUPLICATE_CORR", "0.97"))
+
+# Scores are computed at this size; larger images do not rank differently
+SCORE_MAX_SIDE = 1024
+THUMBNAIL_SIZE = (64, 64)
+# Share of text pixels on a typical prescription; far more usually means noise, far less faded ink
+TARGET_TEXT_DENSITY = 0.08
+
+VARIANT_RANK = registry.counter(
+    "medgenix_ocr_variant_rank_total", "Preprocessed variants by the rank they were given",
+    ["variant", "rank"])
+
+
+class QualityScore(NamedTuple):
+    sharpness: float
+    contrast: float
+    text_density: float
+    skew_degrees: float
+    score: float
+
+
+def _gray(image: Image.Image) -> np.ndarray:
+    gray = np.asarray(image.convert("L"))
+    height, width = gray.shape
+    scale = SCORE_MAX_SIDE / max(height, width)
+    if scale < 1:
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def text_mask(gray: np.ndarray) -> np.ndarray:
+    """Pixels darker than their neighbourhood: pen and print strokes, not shadows or a dark background."""
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 15)
+
+
+def estimate_skew(mask: np.ndarray) -> float:
+    """Skew of the text block in degrees, from the minimum-area rectangle around text pixels."""
+    points = cv2.findNonZero(mask)
+    if points is None or len(points) < 50:
+        return 0.0
+    angle = cv2.minAreaRect(points)[-1]
+    # OpenCV reports the angle in [0, 90) or [-90, 0) depending on the version
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    return float(angle)
+
+
+def score_gray(gray: np.ndarray, mask: np.ndarray = None) -> QualityScore:
+    """Score one grayscale image; higher is more likely to OCR well."""
+    if mask is None:
+        mask = text_mask(gray)
+    _, deviation = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+    sharpness = float(deviation[0][0]) ** 2
+    contrast = float(gray.std())
+    density = float(np.count_nonzero(mask)) / mask.size
+    skew = estimate_skew(mask)
+
+    # Each term is mapped to [0, 1]; sharpness is log-scaled because binarisation and noise inflate it
+    sharpness_term = min(1.0, float(np.log1p(sharpness) / np.log1p(1500.0)))
+    contrast_term = min(1.0, contrast / 64.0)
+    density_term = max(0.0, 1.0 - abs(density - TARGET_TEXT_DENSITY) / TARGET_TEXT_DENSITY)
+    skew_penalty = min(abs(skew), 45.0) / 45.0
+    score = 0.35 * sharpness_term + 0.3 * contrast_term + 0.35 * density_term - 0.2 * skew_penalty
+    return QualityScore(round(sharpness, 1), round(contrast, 1), round(density, 4), round(skew, 2), round(score, 4))
+
+
+def rank_variants(versions: Dict[str, Image.Image], max_variants: int = OCR_MAX_VARIANTS,
+                  duplicate_corr: float = OCR_VARIANT_DUPLICATE_CORR) -> List[str]:
+    """
+    Variant names to try, best first. A variant is dropped when its text mask,
+    downsampled to a thumbnail, correlates above ``duplicate_corr`` with the mask
+    of a variant already kept: both would show the engine the same strokes.
+    """
+    with stage("ocr:quality"):
+        names = list(versions)
+        grays = [_gray(versions[name]) for name in names]
+        masks = [text_mask(gray) for gray in grays]
+        scores = [score_gray(gray, mask).score for gray, mask in zip(grays, masks)]
+        thumbnails = np.stack([
+            cv2.resize(mask, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).ravel() for mask in masks
+        ]).astype(np.float32)
+        # A blank mask has no variance; treat it as uncorrelated
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = np.nan_to_num(np.corrcoef(thumbnails))
+
+        kept = []
+        # Ties keep the preprocessing order, so the original beats an identical copy
+        for index in sorted(range(len(names)), key=lambda i: -scores[i]):
+            if len(kept) >= max(1, max_variants):
+                break
+            if any(correlation[index, other] > duplicate_corr for other in kept):
+                continue
+            kept.append(index)
+
+    for rank, index in enumerate(kept, 1):
+        VARIANT_RANK.inc(variant=names[index], rank=str(rank))
+    return [names[index] for index in kept]
+
+
+def score_variants(versions: Dict[str, Image.Image]) -> Dict[str, QualityScore]:
+    """Scores of every variant, for diagnostics and benchmarks."""
+    return {name: score_gray(_gray(image)) for name, image in versions.items()}
@@ -0,0 +1,161 @@
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+# Engines that run locally and therefore never need a breaker or latency ranking
+LOCAL_ENGINES = {"easyocr", "onnx"}
+
+
+class EngineHealth:
+    """Sliding-window health and circuit breaker state for one OCR engine."""
+
+    def __init__(self, name: str, window_seconds: float, error_threshold: float,
+                 min_calls: int, cooldown_seconds: float):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.cooldown_seconds = cooldown_seconds
+        self.samples = deque()  # (timestamp, latency, ok)
+        self.state = "closed"
+        self.opened_at: Optional[float] = None
+        # Set while the single half-open trial call is running
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        while self.samples and now - self.samples[0][0] > self.window_seconds:
+            self.samples.popleft()
+
+    def record(self, latency: float, ok: bool) -> None:
+        """Record the outcome of a call and update the breaker."""
+        now = time.monotonic()
+        with self._lock:
+            self.samples.append((now, latency, ok))
+            self._trim(now)
+
+            if self.state == "half_open":
+                # The trial call decides whether the engine is back
+                self.trial_in_flight = False
+                self._set_state("closed" if ok else "open", now)
+            elif self.state == "closed" and len(self.samples) >= self.min_calls \
+                    and self.error_rate() >= self.error_threshold:
+                self._set_state("open", now)
+
+    def _set_state(self, state: str, now: float) -> None:
+        if state != self.state:
+            print(f"OCR circuit breaker for {self.name}: {self.state} -> {state}")
+        self.state = state
+        self.opened_at = now if state == "open" else None
+
+    def _refresh(self) -> None:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            self._set_state("half_open", time.monotonic())
+
+    def available(self) -> bool:
+        """Check whether calls may be sent, moving to half-open once the cooldown expires."""
+        with self._lock:
+            self._refresh()
+            return self.state == "closed" or (self.state == "half_open" and not self.trial_in_flight)
+
+    def acquire(self) -> bool:
+        """Claim a call; while half-open only the caller that claims the trial gets True."""
+        with self._lock:
+            self._refresh()
+            if self.state == "half_open":
+                if self.trial_in_flight:
+                    return False
+                self.trial_in_flight = True
+            return self.state != "open"
+
+    def release(self) -> None:
+        """Give back a claimed call that ended without an outcome, e.g. when it was cancelled."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, _, ok in self.samples if not ok) / len(self.samples)
+
+    def latency(self) -> Optional[float]:
+        """Median latency of successful calls in the window."""
+        self._trim(time.monotonic())
+        latencies = [latency for _, latency, ok in self.samples if ok]
+        return statistics.median(latencies) if latencies else None
+
+    def snapshot(self) -> Dict:
+        latency = self.latency()
+        return {
+            "state": self.state,
+            "calls": len(self.samples),
+            "error_rate": round(self.error_rate(), 3),
+            "median_latency_ms": round(latency * 1000, 1) if latency is not None else None
+        }
+
+
+class OCRRouter:
+    """
+    Route OCR calls to the fastest healthy engine.
+
+    Each engine gets a circuit breaker that opens when its error rate over the
+    sliding window crosses the threshold. Open engines are skipped until the
+    cooldown expires, then a single trial call decides whether they recover.
+    """
+
+    def __init__(self, window_seconds: float = 120, error_threshold: float = 0.5,
+                 min_calls: int = 3, cooldown_seconds: float = 30):
+        self.config = dict(window_seconds=window_seconds, error_threshold=error_threshold,
+                           min_calls=min_calls, cooldown_seconds=cooldown_seconds)
+        self.engines: Dict[str, EngineHealth] = {}
+        self.last_route: List[str] = []
+
+    def health(self, name: str) -> EngineHealth:
+        if name not in self.engines:
+            self.engines[name] = EngineHealth(name, **self.config)
+        return self.engines[name]
+
+    def available(self, name: str) -> bool:
+        return name in LOCAL_ENGINES or self.health(name).available()
+
+    def acquire(self, name: str) -> bool:
+        return name in LOCAL_ENGINES or self.health(name).acquire()
+
+    def release(self, name: str) -> None:
+        if name not in LOCAL_ENGINES:
+            self.health(name).release()
+
+    def record(self, name: str, latency: float, ok: bool) -> None:
+        self.health(name).record(latency, ok)
+
+    def route(self, preferred: str, candidates: List[str]) -> List[str]:
+        """
+        Order the candidate engines for a new request.
+
+        Healthy remote engines come first, fastest median latency first; engines
+        without recent successes keep their preference order after them. Local
+        engines are the last resort unless explicitly preferred.
+        """
+        order = [preferred] + [name for name in candidates if name != preferred]
+        remote = [name for name in order if name not in LOCAL_ENGINES and self.available(name)]
+
+        def sort_key(name):
+            latency = self.health(name).latency()
+            return (latency is None, latency or 0.0, order.index(name))
+
+        route = sorted(remote, key=sort_key)
+        local = [name for name in order if name in LOCAL_ENGINES]
+        if preferred in LOCAL_ENGINES:
+            route = [preferred] + route + [name for name in local if name != preferred]
+        else:
+            route = route + local
+        self.last_route = route
+        return route
+
+    def snapshot(self) -> Dict:
+        return {
+            "route": self.last_route,
+            "engines": {name: health.snapshot() for name, health in self.engines.items()}
+        }
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from app.utils.metrics import app_path, registry, stage
+
+LANES = ("interactive", "batch")
+
+QUEUE_WAIT = registry.histogram(
+    "medgenix_admission_queue_wait_seconds", "Time requests spent queued before admission", ["queue", "lane"])
+QUEUE_DEPTH = registry.gauge(
+    "medgenix_admission_queue_depth", "Requests waiting for admission", ["queue", "lane"])
+ADMISSION_IN_FLIGHT = registry.gauge(
+    "medgenix_admission_in_flight", "Requests admitted and still running", ["queue"])
+REJECTIONS = registry.counter(
+    "medgenix_admission_rejections_total", "Requests rejected by admission control", ["queue", "lane", "reason"])
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; ``retry_after`` is a hint in seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Server busy ({reason}), retry in {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded admission queue with priority lanes.
+
+    At most ``max_in_flight`` requests run at once. Others wait in a FIFO per
+    lane. Freed slots go to the interactive lane before the batch lane. A
+    request is rejected straight away when its lane is full, or after waiting
+    ``queue_timeout`` seconds. Everything runs on the event loop, so no locking
+    is needed.
+    """
+
+    def __init__(self, name: str, max_in_flight: int, queue_limits: Dict[str, int], queue_timeout: float = 30):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue_limits = queue_limits
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queues = {lane: deque() for lane in queue_limits}
+        # Moving average of how long an admitted request holds its slot, for Retry-After
+        self.service_time = 1.0
+
+    def _has_waiters(self) -> bool:
+        return any(self.queues.values())
+
+    def retry_after(self) -> int:
+        waiting = sum(len(queue) for queue in self.queues.values())
+        return max(1, math.ceil(self.service_time * (waiting + 1) / self.max_in_flight))
+
+    def _reject(self, lane: str, reason: str):
+        REJECTIONS.inc(queue=self.name, lane=lane, reason=reason)
+        return AdmissionRejected(reason, self.retry_after())
+
+    def _grant_next(self) -> None:
+        """Hand free slots to waiting requests, interactive first"""
+        while self.in_flight < self.max_in_flight:
+            for lane in LANES:
+                queue = self.queues.get(lane)
+                while queue and queue[0].done():
+                    queue.popleft()
+                if queue:
+                    self.in_flight += 1
+                    queue.popleft().set_result(None)
+                    QUEUE_DEPTH.set(len(queue), queue=self.name, lane=lane)
+                    break
+            else:
+                return
+
+    async def _acquire(self, lane: str) -> None:
+        if self.in_flight < self.max_in_flight and not self._has_waiters():
+            self.in_flight += 1
+            return
+        queue = self.queues[lane]
+        if len(queue) >= self.queue_limits[lane]:
+            raise self._reject(lane, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        QUEUE_DEPTH.set(len(queue), queue=self.name, lane=lane)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as we gave up; pass it on
+                self.in_flight -= 1
+                self._grant_next()
+            else:
+                waiter.cancel()
+                if waiter in queue:
+                    queue.remove(waiter)
+                QUEUE_DEPTH.set(len(queue), queue=self.name, lane=lane)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(lane, "queue_timeout")
+            raise
+
+    def _release(self, held: float) -> None:
+        self.in_flight -= 1
+        self.service_time = 0.8 * self.service_time + 0.2 * held
+        self._grant_next()
+
+    @asynccontextmanager
+    async def admit(self, lane: str = "interactive"):
+        """Wait for a slot in ``lane``; raises AdmissionRejected when saturated"""
+        if lane not in self.queues:
+            lane = "interactive"
+        queued = time.perf_counter()
+        with stage(f"admission:{self.name}"):
+            await self._acquire(lane)
+        started = time.perf_counter()
+        QUEUE_WAIT.observe(started - queued, queue=self.name, lane=lane)
+        ADMISSION_IN_FLIGHT.set(self.in_flight, queue=self.name)
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - started)
+            ADMISSION_IN_FLIGHT.set(self.in_flight, queue=self.name)
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": {lane: len(queue) for lane, queue in self.queues.items()},
+            "queue_limits": dict(self.queue_limits),
+            "avg_service_seconds": round(self.service_time, 3)
+        }
+
+
+def request_lane(request) -> str:
+    """Priority lane from the X-Priority header or the priority query parameter"""
+    lane = request.headers.get("x-priority") or request.query_params.get("priority") or "interactive"
+    lane = lane.lower()
+    return lane if lane in LANES else "interactive"
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting requests to ``paths`` through ``controller``.
+
+    Admission happens before the endpoint runs, and so before FastAPI reads and
+    spools a multipart body: a saturated queue answers 503 with Retry-After
+    without receiving the upload.
+    """
+
+    def __init__(self, app, controller: AdmissionController, paths):
+        self.app = app
+        self.controller = controller
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or app_path(scope) not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        from starlette.requests import Request
+        admitted = False
+        try:
+            async with self.controller.admit(request_lane(Request(scope))):
+                admitted = True
+                await self.app(scope, receive, send)
+        except AdmissionRejected as e:
+            if admitted:
+                raise
+            await self._reject(send, e)
+
+    async def _reject(self, send, error: AdmissionRejected):
+        body = json.dumps({"detail": str(error)}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            # The unread body is not drained, so the connection cannot be reused
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(error.retry_after).encode()), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
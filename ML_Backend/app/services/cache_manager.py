@@ -1,43 +1,216 @@
+import gzip
 import json
 import os
-from datetime import datetime
-from typing import Dict, Any
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from app.utils.metrics import record_cache_lookup, stage
+from app.utils.normalize import medicine_key
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CACHE_FORMAT_VERSION = 2
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _dumps(data: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(raw: bytes) -> Dict[str, Any]:
+    if raw[:2] == GZIP_MAGIC:
+        raw = gzip.decompress(raw)
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
 
 class CacheManager:
-    def __init__(self, cache_file: str = "generics_cache.json"):
+    """
+    Persistent cache of generic alternatives.
+
+    RxNorm results are stored normalised: a concept table keyed by RXCUI holds
+    each generic's name and properties once, and every brand keeps only the
+    list of RXCUIs it resolved to. Brands sharing an ingredient therefore share
+    their concepts, and a concept's properties are fetched once for all of them.
+    LLM results, which have no RXCUIs, are stored per brand as before.
+
+    The file is written with orjson when installed (json otherwise) and
+    gzip-compressed when ``compress`` is set; either format is read back.
+
+    How often each brand was looked up is kept alongside the entries, so the
+    cache warm-up can rank brands by demand.
+    """
+
+    def __init__(self, cache_file: str = "generics_cache.json", ttl_days: Optional[float] = None,
+                 compress: bool = False):
         self.cache_file = cache_file
-        self.cache = self._load_cache()
-        
-    def _load_cache(self) -> Dict[str, Any]:
-        """Load cache from file if it exists."""
-        if os.path.exists(self.cache_file):
-            try:
-                with open(self.cache_file, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading cache: {e}")
-                return {}
-        return {}
-    
+        self.compress = compress
+        # Entries never expire unless a TTL is configured
+        self.ttl = timedelta(days=ttl_days) if ttl_days else None
+        self._lock = threading.Lock()
+        self.concepts: Dict[str, Dict[str, Any]] = {}
+        self.cache: Dict[str, Dict[str, Any]] = {}
+        # Medicine key -> {"name": first spelling seen, "count": lookups}
+        self.lookups: Dict[str, Dict[str, Any]] = {}
+        self._lookups_dirty = False
+        self._load_cache()
+
+    def _load_cache(self) -> None:
+        """Load cache from file if it exists, migrating older layouts."""
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'rb') as f:
+                data = _loads(f.read())
+        except Exception as e:
+            print(f"Error loading cache: {e}")
+            return
+        if data.get("version") == CACHE_FORMAT_VERSION:
+            self.concepts = data.get("concepts", {})
+            brands = data.get("brands", {})
+            self.lookups = data.get("lookups", {})
+        else:
+            # Version 1 was a flat {brand: {"data", "source", "timestamp"}} map
+            brands = {name: self._split_entry(entry) for name, entry in data.items()}
+        self.cache = self._rekey(brands)
+
+    @staticmethod
+    def _rekey(cache: Dict[str, Any]) -> Dict[str, Any]:
+        """Re-key entries written under older keys, keeping the newest entry per key."""
+        rekeyed = {}
+        for name, entry in cache.items():
+            key = medicine_key(name) or name
+            current = rekeyed.get(key)
+            if current is None or str(entry.get("timestamp", "")) > str(current.get("timestamp", "")):
+                rekeyed[key] = entry
+        return rekeyed
+
+    def _split_entry(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Move the RxNorm concepts of an expanded entry into the concept table."""
+        data = entry.get("data")
+        timestamp = entry.get("timestamp", datetime.now().isoformat())
+        if entry.get("source") != "rxnorm" or not isinstance(data, list):
+            return entry
+        rxcuis = []
+        for alternative in data:
+            rxcui = str(alternative.get("rxcui") or alternative.get("generic_name"))
+            concept = {"generic_name": alternative.get("generic_name"),
+                       "details": alternative.get("details", {}), "timestamp": timestamp}
+            current = self.concepts.get(rxcui)
+            # Details served from the concept table come back unchanged; keep their
+            # original timestamp so shared concepts still age out and get refreshed
+            if current is None or self.is_expired(current) or current.get("details") != concept["details"] \
+                    or current.get("generic_name") != concept["generic_name"]:
+                self.concepts[rxcui] = concept
+            rxcuis.append(rxcui)
+        return {"source": "rxnorm", "rxcuis": rxcuis, "timestamp": timestamp}
+
+    def _expand(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Rebuild the {"data", "source", "timestamp"} shape callers expect."""
+        if "rxcuis" not in entry:
+            return entry
+        data = []
+        for rxcui in entry["rxcuis"]:
+            concept = self.concepts.get(rxcui)
+            if concept is not None:
+                data.append({"generic_name": concept["generic_name"], "rxcui": rxcui, "details": concept["details"]})
+        return {"data": data, "source": entry["source"], "timestamp": entry["timestamp"]}
+
     def _save_cache(self) -> None:
-        """Save cache to file."""
+        """Save cache to file, replacing it atomically."""
+        # Drop concepts no brand refers to any more
+        referenced = {rxcui for entry in self.cache.values() for rxcui in entry.get("rxcuis", ())}
+        self.concepts = {rxcui: concept for rxcui, concept in self.concepts.items() if rxcui in referenced}
+        raw = _dumps({"version": CACHE_FORMAT_VERSION, "concepts": self.concepts, "brands": self.cache,
+                      "lookups": self.lookups})
+        self._lookups_dirty = False
+        if self.compress:
+            raw = gzip.compress(raw, compresslevel=6)
+        tmp_file = f"{self.cache_file}.tmp"
         try:
-            with open(self.cache_file, 'w') as f:
-                json.dump(self.cache, f)
+            with open(tmp_file, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_file, self.cache_file)
         except Exception as e:
             print(f"Error saving cache: {e}")
-    
+
+    def _expires_at(self, entry: Dict[str, Any]) -> Optional[datetime]:
+        if self.ttl is None:
+            return None
+        try:
+            return datetime.fromisoformat(entry["timestamp"]) + self.ttl
+        except (KeyError, TypeError, ValueError):
+            return datetime.min
+
+    def is_expired(self, entry: Dict[str, Any], within: timedelta = timedelta(0)) -> bool:
+        """Whether an entry has expired, or will within the given window."""
+        expires_at = self._expires_at(entry)
+        return expires_at is not None and expires_at <= datetime.now() + within
+
     def get(self, medicine_name: str) -> Dict[str, Any]:
         """Get cached generic alternatives for a medicine."""
-        normalized_name = medicine_name.lower().strip()
-        return self.cache.get(normalized_name)
-    
+        with stage("cache:generics"):
+            normalized_name = medicine_key(medicine_name)
+            entry = self.cache.get(normalized_name)
+            if entry is not None and self.is_expired(entry):
+                entry = None
+            if entry is not None:
+                entry = self._expand(entry)
+        record_cache_lookup("generics", entry is not None)
+        return entry
+
+    def record_lookup(self, medicine_name: str) -> None:
+        """Count a lookup of a medicine; saved with the next write or flush."""
+        key = medicine_key(medicine_name)
+        if not key:
+            return
+        with self._lock:
+            entry = self.lookups.setdefault(key, {"name": medicine_name.strip(), "count": 0})
+            entry["count"] += 1
+            self._lookups_dirty = True
+
+    def top_lookups(self, limit: Optional[int] = None) -> List[str]:
+        """Medicine names ranked by how often they were looked up."""
+        with self._lock:
+            ranked = sorted(self.lookups.values(), key=lambda entry: entry["count"], reverse=True)
+        return [entry["name"] for entry in ranked[:limit]]
+
+    def flush(self) -> None:
+        """Write lookup counts that changed since the last save."""
+        with self._lock:
+            if self._lookups_dirty:
+                self._save_cache()
+
+    def get_concept_details(self, rxcui: str) -> Optional[Dict[str, Any]]:
+        """Cached RxNorm properties of a concept, shared by every brand that maps to it."""
+        concept = self.concepts.get(str(rxcui))
+        if concept is None or self.is_expired(concept):
+            record_cache_lookup("rxnorm_concepts", False)
+            return None
+        record_cache_lookup("rxnorm_concepts", True)
+        return concept["details"]
+
+    def contains(self, medicine_name: str, within: timedelta = timedelta(0)) -> bool:
+        """Whether a medicine is cached and stays fresh for the given window, without counting a lookup."""
+        entry = self.cache.get(medicine_key(medicine_name))
+        return entry is not None and not self.is_expired(entry, within)
+
+    def expiring(self, within: timedelta) -> List[str]:
+        """Cached medicine names that expire within the given window."""
+        return [name for name, entry in list(self.cache.items()) if self.is_expired(entry, within)]
+
     def set(self, medicine_name: str, data: Dict[str, Any], source: str) -> None:
         """Set generic alternatives for a medicine in the cache."""
-        normalized_name = medicine_name.lower().strip()
-        self.cache[normalized_name] = {
-            "data": data,
-            "source": source,
-            "timestamp": datetime.now().isoformat()
-        }
-        self._save_cache()
+        normalized_name = medicine_key(medicine_name)
+        with self._lock:
+            self.cache[normalized_name] = self._split_entry({
+                "data": data,
+                "source": source,
+                "timestamp": datetime.now().isoformat()
+            })
+            self._save_cache()
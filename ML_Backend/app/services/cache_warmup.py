@@ -0,0 +1,133 @@
+"""
+Pre-resolve generic alternatives for the most prescribed brands.
+
+Brands come from a ranked text file (one per line, ``#`` starts a comment) and/or
+from the lookup counts the generics cache keeps, most looked up first. Each brand
+that is missing from the cache, or about to expire, is resolved through
+``GenericAlternativesService`` with bounded concurrency.
+
+    python -m app.services.cache_warmup --brands data/top_brands.txt
+    python -m app.services.cache_warmup --from-lookups --top 200 --concurrency 8
+    python -m app.services.cache_warmup --refresh-expiring --refresh-ahead-hours 48
+"""
+import argparse
+import asyncio
+import os
+from collections import Counter
+from datetime import timedelta
+from typing import Iterable, List
+
+from app.services.generic_alternatives import GenericAlternativesService
+from app.utils.normalize import medicine_key
+
+WARMUP_CONCURRENCY = int(os.getenv("CACHE_WARMUP_CONCURRENCY", "4"))
+REFRESH_AHEAD_HOURS = float(os.getenv("GENERICS_CACHE_REFRESH_AHEAD_HOURS", "24"))
+REFRESH_INTERVAL_SECONDS = int(os.getenv("CACHE_WARMUP_REFRESH_INTERVAL", "3600"))
+
+
+def load_brands(path: str) -> List[str]:
+    """Read a ranked brand list, one name per line."""
+    brands = []
+    with open(path, "r") as f:
+        for line in f:
+            name = line.split("#", 1)[0].strip()
+            if name:
+                brands.append(name)
+    return brands
+
+
+def _dedupe(brands: Iterable[str]) -> List[str]:
+    """One spelling per medicine key, the key the generics cache uses."""
+    seen = {}
+    for brand in brands:
+        seen.setdefault(medicine_key(brand) or brand.strip(), brand.strip())
+    return list(seen.values())
+
+
+async def warm_cache(service: GenericAlternativesService, brands: List[str],
+                     concurrency: int = WARMUP_CONCURRENCY,
+                     refresh_ahead: timedelta = timedelta(hours=REFRESH_AHEAD_HOURS)) -> dict:
+    """
+    Resolve every brand that is not cached or expires within ``refresh_ahead``.
+    Returns counts of brands skipped, resolved per source, and failed.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    summary = Counter()
+
+    async def warm(brand):
+        if service.cache.contains(brand, within=refresh_ahead):
+            summary["cached"] += 1
+            return
+        async with semaphore:
+            try:
+                summary[await service.prefetch(brand)] += 1
+            except Exception as e:
+                print(f"Cache warm-up failed for {brand}: {str(e)}")
+                summary["failed"] += 1
+
+    await asyncio.gather(*(warm(brand) for brand in _dedupe(brands)))
+    return dict(summary)
+
+
+async def refresh_expiring(service: GenericAlternativesService, concurrency: int = WARMUP_CONCURRENCY,
+                           refresh_ahead: timedelta = timedelta(hours=REFRESH_AHEAD_HOURS)) -> dict:
+    """Re-resolve cached entries before their TTL runs out."""
+    return await warm_cache(service, service.cache.expiring(refresh_ahead), concurrency, refresh_ahead)
+
+
+async def run_startup_warmup(service: GenericAlternativesService, brands_file: str) -> None:
+    """
+    Background task started by the app: warm the configured brands once, then
+    periodically refresh entries that are about to expire (only when a TTL is set).
+    """
+    try:
+        brands = load_brands(brands_file)
+        summary = await warm_cache(service, brands)
+        print(f"Generics cache warm-up of {len(brands)} brands finished: {summary}")
+    except Exception as e:
+        print(f"Generics cache warm-up failed: {str(e)}")
+
+    if service.cache.ttl is None or REFRESH_INTERVAL_SECONDS <= 0:
+        return
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL_SECONDS)
+        summary = await refresh_expiring(service)
+        # Lookup counts are otherwise only written along with new entries
+        await asyncio.to_thread(service.cache.flush)
+        if summary:
+            print(f"Generics cache refresh: {summary}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-resolve generic alternatives into the cache")
+    parser.add_argument("--brands", help="Ranked brand list, one name per line")
+    parser.add_argument("--from-lookups", action="store_true",
+                        help="Add the brands looked up most often, from the lookup counts in the cache")
+    parser.add_argument("--top", type=int, help="Only warm the first N brands")
+    parser.add_argument("--concurrency", type=int, default=WARMUP_CONCURRENCY)
+    parser.add_argument("--refresh-ahead-hours", type=float, default=REFRESH_AHEAD_HOURS,
+                        help="Also re-resolve brands whose entry expires within this many hours")
+    parser.add_argument("--refresh-expiring", action="store_true",
+                        help="Re-resolve every cached entry that is about to expire")
+    args = parser.parse_args()
+
+    service = GenericAlternativesService()
+    brands = []
+    if args.brands:
+        brands += load_brands(args.brands)
+    if args.from_lookups:
+        brands += service.cache.top_lookups()
+    brands = _dedupe(brands)[:args.top] if args.top else _dedupe(brands)
+
+    refresh_ahead = timedelta(hours=args.refresh_ahead_hours)
+    if args.refresh_expiring:
+        brands += service.cache.expiring(refresh_ahead)
+    if not brands:
+        parser.error("no brands given; use --brands, --from-lookups or --refresh-expiring")
+
+    summary = asyncio.run(warm_cache(service, brands, args.concurrency, refresh_ahead))
+    print(f"Warmed {len(_dedupe(brands))} brands: {summary}")
+
+
+if __name__ == "__main__":
+    main()
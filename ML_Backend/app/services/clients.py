@@ -0,0 +1,106 @@
+import asyncio
+import os
+import threading
+
+# Clients are created once per process, normally from the FastAPI lifespan handler.
+# The getters also create them on first use so scripts and CLIs work without an app.
+# Services mounted in one process (app.combined) share these clients and their pools.
+_clients = {}
+_lock = threading.Lock()
+# Async clients hold connections bound to an event loop: name -> (loop, client)
+_async_clients = {}
+
+# Connections kept open per host by the shared HTTP session
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+
+
+def get_groq_client():
+    """Shared Groq client"""
+    client = _clients.get("groq")
+    if client is None:
+        with _lock:
+            client = _clients.get("groq")
+            if client is None:
+                from groq import Groq
+                client = _clients["groq"] = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    return client
+
+
+def get_async_groq_client():
+    """Shared async Groq client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get("groq")
+    if entry is None or entry[0] is not loop:
+        from groq import AsyncGroq
+        entry = _async_clients["groq"] = (loop, AsyncGroq(api_key=os.getenv("GROQ_API_KEY")))
+    return entry[1]
+
+
+def get_firecrawl_client():
+    """Shared Firecrawl client"""
+    client = _clients.get("firecrawl")
+    if client is None:
+        with _lock:
+            client = _clients.get("firecrawl")
+            if client is None:
+                from firecrawl import FirecrawlApp
+                client = _clients["firecrawl"] = FirecrawlApp(api_key=os.getenv("FIRECRAWL_API_KEY"))
+    return client
+
+
+def get_http_session():
+    """Shared requests session, so plain HTTP calls reuse pooled keep-alive connections"""
+    session = _clients.get("http")
+    if session is None:
+        with _lock:
+            session = _clients.get("http")
+            if session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _clients["http"] = session
+    return session
+
+
+def init_clients():
+    """
+    Create the API clients up front so the first request does not pay for it.
+    A client whose key is missing is left to fail on first use, so the services
+    that do not need it still start.
+    """
+    if os.getenv("GROQ_API_KEY"):
+        get_groq_client()
+    else:
+        print("GROQ_API_KEY is not set; LLM calls will fail until it is")
+    get_http_session()
+
+
+async def close_clients():
+    """Close pooled connections held by the clients"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    async_clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception as e:
+                print(f"Error closing client: {str(e)}")
+    loop = asyncio.get_running_loop()
+    for client_loop, client in async_clients:
+        # Clients of other loops cannot be closed from this one and go with their loop
+        if client_loop is loop:
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"Error closing client: {str(e)}")
+
+
+def clients_ready():
+    return {name: name in _clients for name in ("groq", "firecrawl", "http")}
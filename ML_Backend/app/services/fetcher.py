@@ -0,0 +1,210 @@
+"""
+Page fetching for the scrapers.
+
+The direct backend fetches pages itself over a pooled aiohttp session, with
+compressed transfers and conditional requests: the ETag and Last-Modified of
+every page are remembered, and a 304 reuses the body fetched before. HTML is
+parsed with lxml into the same markdown-like text Firecrawl returns, so the
+scrapers do not care which backend served a page. Pages the direct fetch cannot
+use (an error status, a network failure, too little text without running
+JavaScript, or missing the content the caller expects, such as prices on a
+listing) are fetched through Firecrawl instead.
+
+SCRAPER_FETCH_BACKEND=firecrawl sends every page through Firecrawl as before.
+"""
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Pattern
+
+from app.services.clients import get_firecrawl_client
+from app.services.rate_limiter import rate_limiter
+from app.utils.metrics import record_cache_lookup, registry, stage
+
+try:
+    from lxml import etree
+    import lxml.html
+except ImportError:
+    lxml = None
+
+SCRAPER_FETCH_BACKEND = os.getenv("SCRAPER_FETCH_BACKEND", "direct").lower()
+FETCH_TIMEOUT_SECONDS = float(os.getenv("FETCH_TIMEOUT_SECONDS", "15"))
+# Open connections in total and per host
+FETCH_POOL_SIZE = int(os.getenv("FETCH_POOL_SIZE", "50"))
+FETCH_POOL_PER_HOST = int(os.getenv("FETCH_POOL_PER_HOST", "10"))
+# Pages with less visible text than this are taken to be rendered by JavaScript
+FETCH_MIN_TEXT_CHARS = int(os.getenv("FETCH_MIN_TEXT_CHARS", "200"))
+# Pages whose validators and body are kept for conditional requests
+FETCH_CONDITIONAL_CACHE_SIZE = int(os.getenv("FETCH_CONDITIONAL_CACHE_SIZE", "256"))
+FETCH_USER_AGENT = os.getenv(
+    "FETCH_USER_AGENT",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36")
+
+DROPPED_TAGS = ("script", "style", "noscript", "template", "svg", "iframe", "head")
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "header", "footer", "nav", "aside", "ul", "ol", "li", "dl",
+    "dt", "dd", "table", "tr", "td", "th", "blockquote", "pre", "form", "figure", "figcaption", "h1", "h2",
+    "h3", "h4", "h5", "h6"
+}
+IMAGE_LINE = re.compile(r"^!\[[^\]]*\]\([^)]*\)$")
+
+FETCH_SECONDS = registry.histogram(
+    "medgenix_fetch_seconds", "Page fetch latency by backend and outcome", ["backend", "outcome"])
+FETCH_FALLBACKS = registry.counter(
+    "medgenix_fetch_fallbacks_total", "Pages sent to Firecrawl after the direct fetch could not be used", ["reason"])
+
+
+class FetchedPage(NamedTuple):
+    url: str
+    markdown: str
+    html: str
+    backend: str
+
+
+def html_to_markdown(html: str) -> str:
+    """
+    Visible text of an HTML page, one block per line, with headings as markdown
+    headings, list items as "- " lines and images as markdown images.
+    """
+    root = lxml.html.fromstring(html)
+    etree.strip_elements(root, etree.Comment, *DROPPED_TAGS, with_tail=False)
+    parts = []
+
+    def walk(element):
+        tag = element.tag if isinstance(element.tag, str) else ""
+        if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            parts.append(f"\n{'#' * int(tag[1])} {' '.join(element.text_content().split())}\n")
+        elif tag == "img":
+            parts.append(f"\n![{element.get('alt', '')}]({element.get('src', '')})\n")
+        elif tag == "br":
+            parts.append("\n")
+        else:
+            block = tag in BLOCK_TAGS
+            if block:
+                parts.append("\n- " if tag == "li" else "\n")
+            if element.text:
+                parts.append(element.text)
+            for child in element:
+                walk(child)
+            if block:
+                parts.append("\n")
+        if element.tail:
+            parts.append(element.tail)
+
+    walk(root)
+    lines = (" ".join(line.split()) for line in "".join(parts).split("\n"))
+    return "\n".join(line for line in lines if line and line != "-")
+
+
+def visible_text_length(markdown: str) -> int:
+    return sum(len(line) for line in markdown.splitlines() if not IMAGE_LINE.match(line))
+
+
+class PageFetcher:
+    """Fetches pages with the configured backend; one instance is shared by the process."""
+
+    def __init__(self, backend: str = SCRAPER_FETCH_BACKEND):
+        self.backend = backend if backend in ("direct", "firecrawl") else "direct"
+        self._session = None
+        self._loop = None
+        # url -> (etag, last modified, html, markdown), least recently used first
+        self._validators: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _get_session(self):
+        loop = asyncio.get_running_loop()
+        # A session belongs to the loop it was created on; scripts may run several loops
+        if self._session is None or self._session.closed or self._loop is not loop:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=FETCH_POOL_SIZE, limit_per_host=FETCH_POOL_PER_HOST,
+                                             ttl_dns_cache=300)
+            # aiohttp asks for gzip and deflate (and br when brotli is installed) and decompresses
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT_SECONDS),
+                headers={"User-Agent": FETCH_USER_AGENT, "Accept": "text/html,application/xhtml+xml"})
+            self._loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def fetch(self, url: str, expect: Optional[Pattern] = None) -> FetchedPage:
+        """
+        Fetch a page, directly when possible and through Firecrawl otherwise.
+        ``expect`` matches content the page must contain; a direct fetch without it
+        is taken to be a shell rendered by JavaScript (an SPA's navigation and
+        footer alone can pass the text length check).
+        """
+        if self.backend == "direct" and lxml is not None:
+            page, reason = await self._fetch_direct(url, expect)
+            if page is not None:
+                return page
+            FETCH_FALLBACKS.inc(reason=reason)
+        return await self._fetch_firecrawl(url)
+
+    async def _fetch_direct(self, url: str, expect: Optional[Pattern] = None):
+        """The page, or None and the reason it has to be fetched through Firecrawl."""
+        started = time.perf_counter()
+        cached = self._validators.get(url)
+        headers = {}
+        if cached:
+            if cached[0]:
+                headers["If-None-Match"] = cached[0]
+            if cached[1]:
+                headers["If-Modified-Since"] = cached[1]
+        try:
+            with stage("fetch:direct"):
+                async with self._get_session().get(url, headers=headers) as response:
+                    if response.status == 304 and cached:
+                        record_cache_lookup("fetch_conditional", True)
+                        self._validators.move_to_end(url)
+                        FETCH_SECONDS.observe(time.perf_counter() - started, backend="direct", outcome="not_modified")
+                        return FetchedPage(url, cached[3], cached[2], "direct"), None
+                    if response.status != 200:
+                        FETCH_SECONDS.observe(time.perf_counter() - started, backend="direct", outcome="error")
+                        return None, "status"
+                    html = await response.text(errors="replace")
+                    etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        except Exception as e:
+            print(f"Direct fetch of {url} failed: {str(e)}")
+            FETCH_SECONDS.observe(time.perf_counter() - started, backend="direct", outcome="error")
+            return None, "error"
+        if cached:
+            record_cache_lookup("fetch_conditional", False)
+
+        with stage("fetch:parse"):
+            markdown = await asyncio.to_thread(html_to_markdown, html) if html.strip() else ""
+        if visible_text_length(markdown) < FETCH_MIN_TEXT_CHARS:
+            FETCH_SECONDS.observe(time.perf_counter() - started, backend="direct", outcome="needs_render")
+            return None, "needs_render"
+        if expect is not None and not expect.search(markdown):
+            FETCH_SECONDS.observe(time.perf_counter() - started, backend="direct", outcome="needs_render")
+            return None, "missing_content"
+
+        if (etag or last_modified) and FETCH_CONDITIONAL_CACHE_SIZE > 0:
+            self._validators[url] = (etag, last_modified, html, markdown)
+            self._validators.move_to_end(url)
+            while len(self._validators) > FETCH_CONDITIONAL_CACHE_SIZE:
+                self._validators.popitem(last=False)
+        FETCH_SECONDS.observe(time.perf_counter() - started, backend="direct", outcome="ok")
+        return FetchedPage(url, markdown, html, "direct"), None
+
+    async def _fetch_firecrawl(self, url: str) -> FetchedPage:
+        started = time.perf_counter()
+        await rate_limiter.wait_async("firecrawl")
+        try:
+            with stage("fetch:firecrawl"):
+                result = await asyncio.to_thread(
+                    get_firecrawl_client().scrape_url, url, params={"formats": ["markdown", "html"]})
+        except Exception:
+            FETCH_SECONDS.observe(time.perf_counter() - started, backend="firecrawl", outcome="error")
+            raise
+        FETCH_SECONDS.observe(time.perf_counter() - started, backend="firecrawl", outcome="ok")
+        return FetchedPage(url, result.get("markdown", "") or "", result.get("html", "") or "", "firecrawl")
+
+
+# One fetcher per process, so the scrapers share its connection pool and validators
+page_fetcher = PageFetcher()
@@ -1,58 +1,109 @@
 import os
+import asyncio
 import requests
 import json
 from typing import List, Dict, Any, Optional
-import time
-from groq import Groq
 
 from app.models.medicine import Medicine, GenericAlternative, MedicineWithAlternatives
 from app.services.cache_manager import CacheManager
+from app.services.clients import get_http_session
+from app.services.llm_cascade import LLMCascade, validate_alternatives
+from app.services.rate_limiter import rate_limiter
+from app.utils.metrics import registry, stage
+from app.utils.normalize import canonical_name, medicine_key
+
+RXNAV_BASE_URL = os.getenv("RXNAV_BASE_URL", "https://rxnav.nlm.nih.gov/REST")
+
+# Concurrent misses for the same brand share one resolution instead of each calling RxNorm and the LLM
+SINGLE_FLIGHT = registry.counter(
+    "medgenix_singleflight_total", "Generic alternative lookups that resolved a brand or joined one in flight",
+    ["role"])
+
+alternatives_cascade = LLMCascade("alternatives")
 
 class GenericAlternativesService:
     def __init__(self):
-        self.cache = CacheManager()
-        self.groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+        ttl_days = os.getenv("GENERICS_CACHE_TTL_DAYS")
+        self.cache = CacheManager(os.getenv("GENERICS_CACHE_FILE", "generics_cache.json"),
+                                  ttl_days=float(ttl_days) if ttl_days else None,
+                                  compress=os.getenv("GENERICS_CACHE_COMPRESS", "false").lower() == "true")
+        # Medicine key -> task resolving it
+        self._in_flight: Dict[str, asyncio.Task] = {}
         
     async def get_alternatives(self, medicines: List[Medicine]) -> List[MedicineWithAlternatives]:
         """
         Get generic alternatives for a list of medicines using the hybrid approach.
         """
-        results = []
-        
+        # Spellings of the same medicine ("Crocin 650", "CROCIN Tab") are looked up once
+        unique = {}
         for medicine in medicines:
-            brand_name = medicine.brand_name
-            
-            
-            cached_result = self.cache.get(brand_name)
-            if cached_result:
-                alternatives = self._parse_cached_alternatives(cached_result, medicine)
-                alternatives.source = "cache"
-                results.append(alternatives)
-                continue
-                
-            
-            rxnorm_result = await self._get_rxnorm_alternatives(brand_name)
-            
-            if rxnorm_result and len(rxnorm_result) > 0:
-                
-                alternatives = self._format_rxnorm_alternatives(rxnorm_result, medicine)
-                
-                self.cache.set(brand_name, rxnorm_result, "rxnorm")
-                alternatives.source = "rxnorm"
-                results.append(alternatives)
-            else:
-                
-                llm_result = await self._get_llm_alternatives(medicine)
-                
-                self.cache.set(brand_name, llm_result, "llm")
-                
-                alternatives = self._format_llm_alternatives(llm_result, medicine)
-                alternatives.source = "llm"
-                results.append(alternatives)
+            unique.setdefault(medicine_key(medicine.brand_name), medicine)
+        resolved = await asyncio.gather(*(self._lookup(medicine) for medicine in unique.values()))
+        by_name = dict(zip(unique, resolved))
+        return [self._format_alternatives(*by_name[medicine_key(medicine.brand_name)], medicine)
+                for medicine in medicines]
+    
+    async def _lookup(self, medicine: Medicine):
+        """Return (source, data) for a medicine from the cache, or resolve it."""
+        # Ranks brands for app.services.cache_warmup
+        self.cache.record_lookup(medicine.brand_name)
+        cached_result = self.cache.get(medicine.brand_name)
+        if cached_result:
+            return "cache", cached_result
+        return await self._resolve_once(medicine)
+    
+    def _format_alternatives(self, source: str, data, medicine: Medicine) -> MedicineWithAlternatives:
+        if source == "cache":
+            alternatives = self._parse_cached_alternatives(data, medicine)
+        elif source == "rxnorm":
+            alternatives = self._format_rxnorm_alternatives(data, medicine)
+        else:
+            alternatives = self._format_llm_alternatives(data, medicine)
+        alternatives.source = source
+        return alternatives
+    
+    async def prefetch(self, brand_name: str) -> str:
+        """Resolve a brand into the cache, bypassing any cached entry. Returns the source used."""
+        source, _ = await self._resolve_once(Medicine(brand_name=brand_name))
+        return source
+    
+    async def _resolve_once(self, medicine: Medicine):
+        """
+        Resolve a brand, or wait for the resolution already running for it.
+        The resolution runs as its own task, so a cancelled caller does not
+        cancel it for the others.
+        """
+        key = medicine_key(medicine.brand_name)
+        task = self._in_flight.get(key)
+        if task is None:
+            SINGLE_FLIGHT.inc(role="leader")
+            task = self._in_flight[key] = asyncio.ensure_future(self._resolve(medicine))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            SINGLE_FLIGHT.inc(role="coalesced")
+        return await asyncio.shield(task)
+    
+    async def _resolve(self, medicine: Medicine):
+        """Look a brand up in RxNorm, falling back to the LLM, and cache the result."""
+        brand_name = medicine.brand_name
+        
+        # Search RxNorm without strength and form words, which make the name lookup miss
+        rxnorm_result = await self._get_rxnorm_alternatives(canonical_name(brand_name) or brand_name)
+        
+        if rxnorm_result and len(rxnorm_result) > 0:
+            await asyncio.to_thread(self.cache.set, brand_name, rxnorm_result, "rxnorm")
+            return "rxnorm", rxnorm_result
         
-        return results
+        llm_result = await self._get_llm_alternatives(medicine)
+        
+        await asyncio.to_thread(self.cache.set, brand_name, llm_result, "llm")
+        return "llm", llm_result
     
     async def _get_rxnorm_alternatives(self, brand_name: str) -> List[Dict[str, Any]]:
+        """Get generic alternatives from RxNorm without blocking the event loop."""
+        return await asyncio.to_thread(self._fetch_rxnorm_alternatives, brand_name)
+    
+    def _fetch_rxnorm_alternatives(self, brand_name: str) -> List[Dict[str, Any]]:
         """
         Get generic alternatives using RxNorm API.
         Steps:
@@ -62,8 +113,10 @@ class GenericAlternativesService:
         """
         try:
             
-            search_url = f"https://rxnav.nlm.nih.gov/REST/rxcui.json?name={brand_name}&search=1"
-            response = requests.get(search_url, timeout=10)
+            search_url = f"{RXNAV_BASE_URL}/rxcui.json?name={brand_name}&search=1"
+            rate_limiter.wait("rxnav")
+            with stage("rxnorm:search"):
+                response = get_http_session().get(search_url, timeout=10)
             response.raise_for_status()
             data = response.json()
             
@@ -77,8 +130,10 @@ class GenericAlternativesService:
             # SBD = Semantic Branded Drug (brand)
             # GPCK = Generic Pack
             # BPCK = Brand Pack
-            related_url = f"https://rxnav.nlm.nih.gov/REST/rxcui/{rxcui}/allrelated.json"
-            related_response = requests.get(related_url, timeout=10)
+            related_url = f"{RXNAV_BASE_URL}/rxcui/{rxcui}/allrelated.json"
+            rate_limiter.wait("rxnav")
+            with stage("rxnorm:allrelated"):
+                related_response = get_http_session().get(related_url, timeout=10)
             related_response.raise_for_status()
             related_data = related_response.json()
             
@@ -118,10 +173,16 @@ class GenericAlternativesService:
     
     def _get_medication_details(self, rxcui: str) -> Dict[str, Any]:
         """Get detailed information about a medication from RxNorm."""
+        # Brands sharing an ingredient share its concepts, so the properties are often cached already
+        cached_details = self.cache.get_concept_details(rxcui)
+        if cached_details is not None:
+            return cached_details
         try:
             
-            props_url = f"https://rxnav.nlm.nih.gov/REST/rxcui/{rxcui}/allProperties.json?prop=all"
-            props_response = requests.get(props_url, timeout=10)
+            props_url = f"{RXNAV_BASE_URL}/rxcui/{rxcui}/allProperties.json?prop=all"
+            rate_limiter.wait("rxnav")
+            with stage("rxnorm:properties"):
+                props_response = get_http_session().get(props_url, timeout=10)
             props_response.raise_for_status()
             props_data = props_response.json()
             
@@ -177,18 +238,20 @@ class GenericAlternativesService:
         
         try:
             
-            time.sleep(0.5)
-            
-            response = self.groq_client.chat.completions.create(
-                model="llama3-70b-8192",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1,
-                max_tokens=800,
-                response_format={"type": "json_object"}
-            )
+            await asyncio.sleep(0.5)
             
-            result_text = response.choices[0].message.content
-            alternatives = json.loads(result_text)
+            # Small model first; escalate only when its answer fails validation
+            with stage("llm:alternatives"):
+                alternatives, _ = await asyncio.to_thread(
+                    alternatives_cascade.complete,
+                    [{"role": "user", "content": prompt}],
+                    validate_alternatives(medicine.brand_name),
+                    temperature=0.1,
+                    max_tokens=800,
+                    response_format={"type": "json_object"}
+                )
+            if not isinstance(alternatives, dict):
+                return {"alternatives": []}
             return alternatives
             
         except Exception as e:
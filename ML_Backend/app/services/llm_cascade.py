@@ -0,0 +1,163 @@
+import os
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from app.services.clients import get_groq_client
+from app.services.rate_limiter import rate_limiter
+from app.utils.llm_json import parse_llm_json
+from app.utils.metrics import registry, stage
+from app.utils.normalize import canonical_name, parse_strength
+
+DEFAULT_CASCADE = "llama3-8b-8192,llama3-70b-8192"
+
+CASCADE_ATTEMPTS = registry.counter(
+    "medgenix_llm_cascade_attempts_total", "LLM cascade attempts by task, model and outcome",
+    ["task", "model", "outcome"])
+CASCADE_LATENCY = registry.histogram(
+    "medgenix_llm_cascade_latency_seconds", "Latency of each LLM cascade attempt", ["task", "model"])
+
+# A validator returns None when the output is acceptable, or the reason it is not
+Validator = Callable[[Any], Optional[str]]
+
+
+def cascade_models(task: str) -> List[str]:
+    """
+    Models to try for a task, smallest first: LLM_CASCADE_MODELS_<TASK> if set,
+    otherwise LLM_CASCADE_MODELS. A single model disables escalation.
+    """
+    setting = os.getenv(f"LLM_CASCADE_MODELS_{task.upper()}") or os.getenv("LLM_CASCADE_MODELS", DEFAULT_CASCADE)
+    return [model.strip() for model in setting.split(",") if model.strip()]
+
+
+class LLMCascade:
+    """
+    Try the fast model first and escalate to the next one only when its output
+    fails validation (or the call errors). Each attempt is counted per model as
+    accepted, rejected or error, and timed, so the tier hit rate and the latency
+    saved can be read from /metrics.
+    """
+
+    def __init__(self, task: str, models: Optional[List[str]] = None, client_factory=get_groq_client,
+                 provider: str = "groq"):
+        self.task = task
+        self.models = models or cascade_models(task)
+        self.client_factory = client_factory
+        # Rate limit bucket the calls draw from
+        self.provider = provider
+
+    def _record(self, model: str, outcome: str, started: float) -> None:
+        CASCADE_ATTEMPTS.inc(task=self.task, model=model, outcome=outcome)
+        CASCADE_LATENCY.observe(time.perf_counter() - started, task=self.task, model=model)
+
+    def _judge(self, model: str, result: Any, validate: Validator, started: float) -> bool:
+        reason = validate(result)
+        if reason is None:
+            self._record(model, "accepted", started)
+            return True
+        self._record(model, "rejected", started)
+        print(f"{self.task}: {model} output rejected ({reason})")
+        return False
+
+    def complete(self, messages: list, validate: Validator, **kwargs) -> Tuple[Any, Optional[str]]:
+        """
+        Run a chat completion through the cascade and parse it as JSON.
+        Returns (parsed result, model that produced it). When every tier fails
+        validation, the last parsed result is returned so callers can still
+        salvage it; (None, None) if no tier produced anything.
+        """
+        fallback, fallback_model = None, None
+        for model in self.models:
+            started = time.perf_counter()
+            try:
+                rate_limiter.wait(self.provider)
+                with stage(f"llm:{self.task}:{model}"):
+                    response = self.client_factory().chat.completions.create(
+                        model=model, messages=messages, **kwargs)
+                result = parse_llm_json(response.choices[0].message.content or "")
+            except Exception as e:
+                self._record(model, "error", started)
+                print(f"{self.task}: {model} call failed: {str(e)}")
+                continue
+            if self._judge(model, result, validate, started):
+                return result, model
+            if result is not None:
+                fallback, fallback_model = result, model
+        return fallback, fallback_model
+
+    async def run(self, attempt: Callable[[str], Awaitable[Any]], validate: Validator) -> Tuple[Any, Optional[str]]:
+        """
+        Async variant for callers that drive the model themselves, e.g. to stream:
+        ``attempt(model)`` produces the result for one tier.
+        """
+        fallback, fallback_model = None, None
+        for model in self.models:
+            started = time.perf_counter()
+            try:
+                with stage(f"llm:{self.task}:{model}"):
+                    result = await attempt(model)
+            except Exception as e:
+                self._record(model, "error", started)
+                print(f"{self.task}: {model} call failed: {str(e)}")
+                continue
+            if self._judge(model, result, validate, started):
+                return result, model
+            if result:
+                fallback, fallback_model = result, model
+        return fallback, fallback_model
+
+
+def validate_medications(ocr_text: str) -> Validator:
+    """Extracted medicines must be well formed and actually appear in the OCR text."""
+    text = canonical_name(ocr_text)
+
+    def validate(medicines):
+        if not isinstance(medicines, list):
+            return "not a list"
+        if not medicines:
+            # A prescription listing strengths almost certainly names medicines
+            return "no medicines in text that lists strengths" if parse_strength(ocr_text) else None
+        names = [canonical_name(m.get("brand_name")) for m in medicines if isinstance(m, dict)]
+        if len(names) != len(medicines) or not all(names) or "unknown medication" in names:
+            return "missing medicine names"
+        found = sum(1 for name in names if name.split()[0] in text)
+        if found * 2 < len(names):
+            return f"only {found} of {len(names)} names appear in the OCR text"
+        return None
+
+    return validate
+
+
+def validate_alternatives(brand_name: str) -> Validator:
+    """Generic alternatives must be a non-empty list of named generics other than the brand itself."""
+    brand = canonical_name(brand_name)
+
+    def validate(result):
+        if not isinstance(result, dict) or not isinstance(result.get("alternatives"), list):
+            return "missing alternatives list"
+        alternatives = result["alternatives"]
+        if not alternatives:
+            return "no alternatives"
+        for alternative in alternatives:
+            if not isinstance(alternative, dict) or not str(alternative.get("generic_name") or "").strip():
+                return "alternative without a generic name"
+            if canonical_name(alternative["generic_name"]) == brand:
+                return "brand listed as its own generic"
+        return None
+
+    return validate
+
+
+def validate_medicine_info(result) -> Optional[str]:
+    """Medicine information must have every field with the right type and the core fields filled in."""
+    if not isinstance(result, dict):
+        return "not an object"
+    expected = {"medicine_name": str, "uses": list, "how_it_works": str, "common_side_effects": list,
+                "content_details": dict, "expert_advice": list, "faqs": list}
+    for key, kind in expected.items():
+        if not isinstance(result.get(key), kind):
+            return f"{key} missing or not a {kind.__name__}"
+    if not result["uses"] or not result["how_it_works"].strip():
+        return "uses or how_it_works empty"
+    if any(not isinstance(faq, dict) or "question" not in faq or "answer" not in faq for faq in result["faqs"]):
+        return "malformed faqs"
+    return None
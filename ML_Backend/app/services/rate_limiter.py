@@ -0,0 +1,81 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from app.utils.metrics import registry
+
+RATE_LIMIT_WAIT = registry.histogram(
+    "medgenix_rate_limit_wait_seconds", "Time calls waited for a provider rate limit token", ["provider"],
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+
+def provider_limit(provider: str) -> Optional[Tuple[float, float]]:
+    """
+    (requests per second, burst) for a provider from RATE_LIMIT_<PROVIDER>_PER_MINUTE
+    and RATE_LIMIT_<PROVIDER>_BURST, or None when the provider is not limited.
+    The burst defaults to six seconds' worth of requests.
+    """
+    per_minute = float(os.getenv(f"RATE_LIMIT_{provider.upper()}_PER_MINUTE", "0"))
+    if per_minute <= 0:
+        return None
+    burst = float(os.getenv(f"RATE_LIMIT_{provider.upper()}_BURST", "0")) or per_minute / 10
+    return per_minute / 60, max(1.0, burst)
+
+
+class RateLimiter:
+    """
+    Token bucket per provider, shared by every service and thread in the process.
+
+    A caller reserves the next token under a lock and then sleeps until it is
+    due, so waiting callers are served in order and no lock is held while
+    sleeping. Threads call ``wait``; code on the event loop calls ``wait_async``.
+    Limits are read from the environment the first time a provider is used.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # provider -> [tokens, last refill time, rate, burst], or None when unlimited
+        self._buckets: Dict[str, Optional[list]] = {}
+
+    def _reserve(self, provider: str) -> float:
+        """Take a token and return how long to wait before using it."""
+        with self._lock:
+            if provider not in self._buckets:
+                limit = provider_limit(provider)
+                self._buckets[provider] = [limit[1], time.monotonic(), *limit] if limit else None
+            bucket = self._buckets[provider]
+            if bucket is None:
+                return 0.0
+            tokens, last, rate, burst = bucket
+            now = time.monotonic()
+            # Tokens go negative while callers are queued; each one waits for its own token
+            tokens = min(burst, tokens + (now - last) * rate) - 1
+            bucket[0], bucket[1] = tokens, now
+            return -tokens / rate if tokens < 0 else 0.0
+
+    def wait(self, provider: str) -> None:
+        """Block until a call to ``provider`` is allowed."""
+        delay = self._reserve(provider)
+        RATE_LIMIT_WAIT.observe(delay, provider=provider)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, provider: str) -> None:
+        """Wait, without blocking the event loop, until a call to ``provider`` is allowed."""
+        delay = self._reserve(provider)
+        RATE_LIMIT_WAIT.observe(delay, provider=provider)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                provider: {"tokens": round(bucket[0], 2), "per_minute": bucket[2] * 60, "burst": bucket[3]}
+                for provider, bucket in self._buckets.items() if bucket is not None
+            }
+
+
+# One limiter per process, so services mounted together share each provider's budget
+rate_limiter = RateLimiter()
@@ -0,0 +1,243 @@
+import json
+import re
+from typing import Any, List, Optional
+
+CODE_FENCE = re.compile(r"```[a-zA-Z]*")
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSERS = {"{": "}", "[": "]"}
+STRING_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def _strip_trailing_comma(out: List[str]) -> None:
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def _close(out: List[str], stack: List[str]) -> str:
+    closed = list(out)
+    for opener in reversed(stack):
+        _strip_trailing_comma(closed)
+        closed.append(CLOSERS[opener])
+    return "".join(closed)
+
+
+def _literal_at(text: str, i: int) -> Optional[str]:
+    for literal in PYTHON_LITERALS:
+        end = i + len(literal)
+        if text.startswith(literal, i) and (end == len(text) or not text[end].isalnum()):
+            return literal
+    return None
+
+
+def _repair_value(text: str, start: int) -> tuple:
+    """
+    Repair the JSON value starting at ``start``.
+
+    Returns:
+        Tuple of (repaired JSON text or None, index just past the value)
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    # Positions where the value can be cut and closed if the tail is unusable
+    cut_points: List[tuple] = []
+    in_string = escape = False
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+                out.append(ch)
+            elif ch == "\\":
+                escape = True
+                out.append(ch)
+            elif ch == '"':
+                in_string = False
+                out.append(ch)
+            else:
+                out.append(STRING_ESCAPES.get(ch, ch))
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in CLOSERS:
+            stack.append(ch)
+            out.append(ch)
+            cut_points.append((len(out), list(stack)))
+        elif ch in "}]":
+            if stack and CLOSERS[stack[-1]] == ch:
+                _strip_trailing_comma(out)
+                stack.pop()
+                out.append(ch)
+                if not stack:
+                    return "".join(out), i + 1
+            # Unbalanced closers are dropped
+        elif ch == ",":
+            cut_points.append((len(out), list(stack)))
+            out.append(ch)
+        else:
+            literal = _literal_at(text, i) if ch in "TFN" else None
+            if literal:
+                out.append(PYTHON_LITERALS[literal])
+                i += len(literal)
+                continue
+            out.append(ch)
+        i += 1
+
+    # Truncated completion: close what is open, backing off to earlier cut points if needed
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    candidates = [(len(out), stack)] + list(reversed(cut_points))
+    for position, open_stack in candidates:
+        candidate = _close(out[:position], open_stack)
+        try:
+            json.loads(candidate)
+            return candidate, len(text)
+        except json.JSONDecodeError:
+            continue
+    return None, len(text)
+
+
+def repair_json(text: str) -> Optional[str]:
+    """
+    Repair the common defects of LLM-produced JSON.
+
+    Handles markdown code fences, prose around the payload, trailing commas,
+    Python literals, raw newlines inside strings, truncated output and
+    several objects emitted back to back without an enclosing array.
+    """
+    text = CODE_FENCE.sub("", text)
+    values = []
+    i = 0
+    while True:
+        starts = [pos for pos in (text.find("{", i), text.find("[", i)) if pos != -1]
+        if not starts:
+            break
+        repaired, i = _repair_value(text, min(starts))
+        if repaired is not None:
+            values.append(repaired)
+    if not values:
+        return None
+    if len(values) > 1 and all(value.startswith("{") for value in values):
+        return "[" + ",".join(values) + "]"
+    return values[0]
+
+
+def parse_llm_json(text: str, default: Any = None) -> Any:
+    """
+    Parse JSON from an LLM completion, repairing it if necessary.
+
+    Args:
+        text: Raw completion text
+        default: Value returned when nothing parseable is found
+
+    Returns:
+        The parsed JSON value, or ``default``
+    """
+    if not text:
+        return default
+    try:
+        return json.loads(CODE_FENCE.sub("", text).strip())
+    except json.JSONDecodeError:
+        pass
+    repaired = repair_json(text)
+    if repaired is None:
+        return default
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError:
+        return default
+
+
+class StreamingJSONParser:
+    """
+    Incremental parser for streamed LLM completions.
+
+    ``feed`` accepts text deltas as they arrive and returns every element of
+    the first JSON array in the completion as soon as that element closes,
+    so callers can act on the first medicine before generation finishes.
+    ``finish`` parses the whole buffered completion with repair.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._array_depth: Optional[int] = None
+        self._array_closed = False
+        self._element_start: Optional[int] = None
+        self.emitted = 0
+
+    def _in_array(self) -> bool:
+        return not self._array_closed and self._array_depth is not None and len(self._stack) == self._array_depth
+
+    def _emit(self, end: int, items: List[Any]) -> None:
+        element_text = self.buffer[self._element_start:end].strip()
+        self._element_start = None
+        if not element_text:
+            return
+        element = parse_llm_json(element_text)
+        if element is None and element_text != "null":
+            return
+        items.append(element)
+        self.emitted += 1
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Consume a text delta and return the array elements it completed."""
+        self.buffer += chunk
+        items: List[Any] = []
+        while self._pos < len(self.buffer):
+            pos = self._pos
+            ch = self.buffer[pos]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                if self._in_array() and self._element_start is None:
+                    self._element_start = pos
+                self._in_string = True
+            elif ch in CLOSERS:
+                if self._in_array() and self._element_start is None:
+                    self._element_start = pos
+                self._stack.append(ch)
+                if ch == "[" and self._array_depth is None:
+                    self._array_depth = len(self._stack)
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if self._array_closed or self._array_depth is None:
+                    continue
+                if len(self._stack) == self._array_depth and self._element_start is not None:
+                    # A nested object or array element just closed
+                    self._emit(pos + 1, items)
+                elif len(self._stack) < self._array_depth:
+                    if self._element_start is not None:
+                        self._emit(pos, items)
+                    self._array_closed = True
+            elif ch == "," and self._in_array():
+                if self._element_start is not None:
+                    self._emit(pos, items)
+            elif not ch.isspace() and self._in_array() and self._element_start is None:
+                self._element_start = pos
+        return items
+
+    def finish(self, default: Any = None) -> Any:
+        """Parse the complete buffered completion."""
+        return parse_llm_json(self.buffer, default)
@@ -0,0 +1,353 @@
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Client-supplied X-Request-ID values that are kept; anything else gets a generated id
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_value(self, key, state) -> List[str]:
+        lines = []
+        for bound, count in zip(self.buckets, state["buckets"]):
+            labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {state['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide collection of metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: "OrderedDict[str, _Metric]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        _update_cache_hit_ratios()
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    "medgenix_stage_duration_seconds", "Duration of individual pipeline stages", ["stage"])
+REQUEST_DURATION = registry.histogram(
+    "medgenix_http_request_duration_seconds", "HTTP request latency", ["service", "method", "route", "status"])
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "medgenix_http_requests_in_flight", "HTTP requests currently being served", ["service"])
+CACHE_LOOKUPS = registry.counter(
+    "medgenix_cache_lookups_total", "Cache lookups by outcome", ["cache", "result"])
+CACHE_HIT_RATIO = registry.gauge(
+    "medgenix_cache_hit_ratio", "Share of cache lookups that were hits since startup", ["cache"])
+
+
+def _update_cache_hit_ratios() -> None:
+    caches = {key[0] for key in list(CACHE_LOOKUPS._values)}
+    for cache in caches:
+        hits = CACHE_LOOKUPS.value(cache=cache, result="hit")
+        total = hits + CACHE_LOOKUPS.value(cache=cache, result="miss")
+        CACHE_HIT_RATIO.set(hits / total if total else 0.0, cache=cache)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """Count a cache hit or miss."""
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class Trace:
+    """Per-request breakdown of the stages a request went through."""
+
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.duration: Optional[float] = None
+        self.status: Optional[int] = None
+        self.spans: List[dict] = []
+
+    def add_span(self, stage_name: str, start: float, duration: float) -> None:
+        self.spans.append({
+            "stage": stage_name,
+            "start_ms": round((start - self.started) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2)
+        })
+
+    def to_dict(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "spans": list(self.spans)
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("medgenix_trace", default=None)
+
+
+class TraceStore:
+    """Bounded store of the most recent request traces."""
+
+    def __init__(self, max_traces: int = 200):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        # Ids of requests still running, so a reused id cannot replace their trace either
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def claim(self, request_id: str) -> bool:
+        """Reserve an id for a new request; False when a stored or running request already has it."""
+        with self._lock:
+            if request_id in self._traces or request_id in self._pending:
+                return False
+            self._pending.add(request_id)
+            return True
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._pending.discard(trace.request_id)
+            self._traces[trace.request_id] = trace
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def get(self, request_id: str) -> Optional[Trace]:
+        return self._traces.get(request_id)
+
+    def recent(self, limit: int = 50) -> List[Trace]:
+        with self._lock:
+            return list(self._traces.values())[-limit:][::-1]
+
+
+trace_store = TraceStore()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a pipeline stage.
+
+    The duration is recorded in the stage histogram and, when the code runs
+    inside an instrumented request, appended to that request's trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_DURATION.observe(duration, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, start, duration)
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+def app_path(scope) -> str:
+    """Request path within the app, without the prefix it is mounted under (app.combined)."""
+    path, root_path = scope["path"], scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):] or "/"
+    return path
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency, in-flight counts and a trace per request.
+
+    Every response carries an ``X-Request-ID`` header whose trace can be fetched
+    from ``/metrics/traces/{request_id}``. A client's own X-Request-ID is kept
+    when it is up to 64 letters, digits, "-" or "_" and no other stored or
+    running request has it; otherwise one is generated. Sending ``X-Trace: 1``
+    also returns the stage breakdown inline as a ``Server-Timing`` header.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or app_path(scope).startswith("/metrics"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+        if not REQUEST_ID_PATTERN.fullmatch(request_id) or not trace_store.claim(request_id):
+            request_id = uuid.uuid4().hex[:16]
+            trace_store.claim(request_id)
+        wants_timing = headers.get(b"x-trace", b"").decode().lower() in ("1", "true")
+        trace = Trace(request_id, scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+        REQUESTS_IN_FLIGHT.inc(service=self.service)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                extra = [(b"x-request-id", request_id.encode())]
+                if wants_timing:
+                    timing = ", ".join(
+                        f'{span["stage"].replace(":", "-")};dur={span["duration_ms"]}' for span in trace.spans)
+                    extra.append((b"server-timing", timing.encode()))
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            trace.duration = time.perf_counter() - trace.started
+            REQUESTS_IN_FLIGHT.dec(service=self.service)
+            # Label by route template rather than raw path to keep cardinality bounded
+            matched = scope.get("route")
+            route_label = getattr(matched, "path", None) or "unmatched"
+            REQUEST_DURATION.observe(trace.duration, service=self.service, method=scope["method"],
+                                     route=route_label, status=trace.status or 500)
+            trace_store.add(trace)
+            _current_trace.reset(token)
+
+
+def instrument_app(app, service: str) -> None:
+    """
+    Add request instrumentation and the /metrics endpoints to a FastAPI app. Traces
+    show every recent request's path, so they need the profiling admin token.
+    """
+    from fastapi import Header, HTTPException, Query
+    from fastapi.responses import PlainTextResponse
+    # Imported here: app.utils.profiling imports this module
+    from app.utils.profiling import require_admin
+
+    app.add_middleware(MetricsMiddleware, service=service)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Prometheus metrics"""
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/metrics/traces", include_in_schema=False)
+    async def recent_traces(limit: int = 50, x_profile_token: Optional[str] = Header(None),
+                            profile_token: Optional[str] = Query(None)):
+        """Most recent per-request stage breakdowns"""
+        require_admin(x_profile_token, profile_token, "Reading traces")
+        return [trace.to_dict() for trace in trace_store.recent(limit)]
+
+    @app.get("/metrics/traces/{request_id}", include_in_schema=False)
+    async def get_trace(request_id: str, x_profile_token: Optional[str] = Header(None),
+                        profile_token: Optional[str] = Query(None)):
+        """Stage breakdown of one request"""
+        require_admin(x_profile_token, profile_token, "Reading traces")
+        trace = trace_store.get(request_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail=f"No trace for request {request_id}")
+        return trace.to_dict()
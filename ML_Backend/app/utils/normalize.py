@@ -0,0 +1,159 @@
+"""
+Canonical forms of medicine names and strengths.
+
+Prescriptions, OCR output and API callers spell the same product many ways:
+"Crocin 650", "CROCIN-650mg Tab" and "crocin" all mean Crocin. Caches and
+lookups key on ``medicine_key``, the canonical name plus the strength value, so
+those share one entry while "Vitamin B 12" and "Vitamin B 6" do not. Dosages are
+parsed into a value and a unit so "650mg", "650 MG" and "0.65 g" compare equal.
+"""
+import re
+from typing import Iterable, List, NamedTuple, Optional
+
+# Dosage form words that do not change which product is meant. Release modifiers
+# (SR, ER, XR, CR, MR, DT) are kept because they name different products.
+FORM_WORDS = {
+    "tab", "tabs", "tablet", "tablets", "cap", "caps", "capsule", "capsules",
+    "syp", "syr", "syrup", "susp", "suspension", "inj", "injection", "drop", "drops",
+    "cream", "gel", "oint", "ointment", "lotion", "sachet", "sachets", "powder",
+    "soln", "solution", "strip", "strips", "oral", "film", "coated", "chewable", "kid", "kids"
+}
+
+# Units and the canonical unit they map to with a multiplier
+UNITS = {
+    "mg": ("mg", 1), "milligram": ("mg", 1), "milligrams": ("mg", 1),
+    "g": ("mg", 1000), "gm": ("mg", 1000), "gram": ("mg", 1000), "grams": ("mg", 1000),
+    "mcg": ("mcg", 1), "ug": ("mcg", 1), "µg": ("mcg", 1), "microgram": ("mcg", 1), "micrograms": ("mcg", 1),
+    "ml": ("ml", 1), "l": ("ml", 1000),
+    "iu": ("iu", 1), "units": ("iu", 1), "unit": ("iu", 1),
+    "%": ("%", 1),
+}
+
+_NUMBER = r"\d+(?:\.\d+)?"
+# "650mg", "650 mg", "500/125 mg", "0.5g", "2.5%"; optionally "per 5 ml"
+STRENGTH_PATTERN = re.compile(
+    rf"(?<![\w.])({_NUMBER}(?:\s*/\s*{_NUMBER})*)\s*({'|'.join(sorted(map(re.escape, UNITS), key=len, reverse=True))})"
+    rf"(?:\s*/\s*({_NUMBER})?\s*(ml))?(?![\w])",
+    re.IGNORECASE
+)
+# A bare number trailing a brand, as in "Dolo 650"
+TRAILING_NUMBER = re.compile(rf"[\s\-_]({_NUMBER}(?:/{_NUMBER})*)$")
+_SEPARATORS = re.compile(r"[\s\-_.,()+]+")
+
+
+class Strength(NamedTuple):
+    value: str
+    unit: Optional[str] = None
+    per: Optional[str] = None
+
+    def __str__(self) -> str:
+        text = f"{self.value} {self.unit}" if self.unit else self.value
+        return f"{text}/{self.per}" if self.per else text
+
+
+class NormalizedMedicine(NamedTuple):
+    name: str
+    strength: Optional[Strength]
+
+
+def _format_number(value: float) -> str:
+    return f"{value:.4f}".rstrip("0").rstrip(".")
+
+
+def _scale(value: str, multiplier: float) -> str:
+    return "/".join(_format_number(float(part) * multiplier) for part in re.split(r"\s*/\s*", value))
+
+
+def parse_strength(text: Optional[str]) -> Optional[Strength]:
+    """
+    Parse the first strength in a string into a canonical value and unit,
+    e.g. "650mg" -> 650 mg, "0.5 g" -> 500 mg, "250mg/5ml" -> 250 mg/5 ml.
+    A bare trailing number ("Dolo 650") is returned without a unit.
+    """
+    if not text:
+        return None
+    match = STRENGTH_PATTERN.search(text)
+    if match:
+        unit, multiplier = UNITS[match.group(2).lower()]
+        per = None
+        if match.group(4):
+            per = f"{_format_number(float(match.group(3) or 1))} ml"
+        return Strength(_scale(match.group(1), multiplier), unit, per)
+    match = TRAILING_NUMBER.search(" " + text.strip())
+    if match:
+        return Strength(_scale(match.group(1), 1))
+    return None
+
+
+def _name_words(name: str):
+    """Words of a name without unit-bearing strengths and form words, and how many strengths were removed."""
+    text, strengths = STRENGTH_PATTERN.subn(" ", name.lower())
+    return [word for word in _SEPARATORS.split(text) if word and word not in FORM_WORDS], strengths
+
+
+def canonical_name(name: Optional[str]) -> str:
+    """
+    Canonical medicine name used as a cache and lookup key: lower case, strength
+    and dosage-form words removed, punctuation collapsed to single spaces.
+    """
+    if not name:
+        return ""
+    words, strengths = _name_words(name)
+    # A trailing bare number is the strength ("dolo 650") only when the name has no
+    # strength with a unit; in "vitamin b 12 1500mcg" it is part of the name.
+    # Names that are only a number are kept.
+    while not strengths and len(words) > 1 and re.fullmatch(rf"{_NUMBER}(?:/{_NUMBER})*", words[-1]):
+        words.pop()
+    return " ".join(words)
+
+
+def medicine_key(name: Optional[str], dosage: Optional[str] = None) -> str:
+    """
+    Cache key for a medicine: the canonical name plus the strength value, e.g.
+    "CROCIN-650mg Tab" and "Crocin 650" -> "crocin 650", "Vitamin B 12" -> "vitamin b 12".
+    """
+    medicine = normalize_medicine(name or "", dosage)
+    strength = medicine.strength
+    if strength is None and name:
+        # A bare strength followed by a form word, as in "Dolo 650 Tab"
+        strength = parse_strength(" ".join(_name_words(name)[0]))
+    if strength is None or not medicine.name or medicine.name.split()[-1] == strength.value:
+        return medicine.name
+    return f"{medicine.name} {strength.value}"
+
+
+def normalize_medicine(name: str, dosage: Optional[str] = None) -> NormalizedMedicine:
+    """Canonical name plus the strength from ``dosage``, or from the name when no dosage is given."""
+    return NormalizedMedicine(canonical_name(name), parse_strength(dosage) or parse_strength(name))
+
+
+def canonical_dosage(dosage: Optional[str]) -> Optional[str]:
+    """Rewrite a dosage as "<value> <unit>" when it parses, otherwise return it trimmed."""
+    if dosage is None:
+        return None
+    strength = parse_strength(dosage)
+    if strength is None or strength.unit is None:
+        return dosage.strip() or None
+    return str(strength)
+
+
+def search_term(name: str) -> str:
+    """Name plus compact strength for pharmacy search boxes, e.g. "CROCIN-650mg Tab" -> "crocin 650mg"."""
+    strength = parse_strength(name)
+    base = canonical_name(name)
+    if strength is None:
+        return base
+    return f"{base} {strength.value}{strength.unit or ''}"
+
+
+def dedupe_by_name(items: Iterable, get_name) -> List:
+    """Keep the first item for each canonical name, preserving order."""
+    seen = set()
+    unique = []
+    for item in items:
+        key = canonical_name(get_name(item))
+        if key and key in seen:
+            continue
+        seen.add(key)
+        unique.append(item)
+    return unique
@@ -0,0 +1,283 @@
+import asyncio
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from app.utils.metrics import app_path, current_request_id
+
+# Profiling is disabled unless an admin token is configured
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+
+MAX_STACK_DEPTH = 128
+
+# Innermost Python frames that mean a thread is blocked rather than running code. Blocking
+# C calls made directly from application code are counted as running.
+WAITING_FUNCTIONS = {
+    "select", "poll", "epoll", "kqueue", "control", "wait", "acquire", "sleep",
+    "recv", "recv_into", "read", "readinto", "accept", "connect", "getaddrinfo", "_worker"
+}
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if "site-packages" in filename:
+        filename = filename.split("site-packages", 1)[1].lstrip("/\\")
+    else:
+        try:
+            filename = os.path.relpath(filename)
+        except ValueError:
+            pass
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Pure-Python sampling profiler.
+
+    A background thread snapshots the stack of every other thread at a fixed
+    interval and aggregates them into collapsed stacks (one ``frame;frame;frame
+    count`` line per unique stack), which flamegraph.pl and speedscope read
+    directly. Each stack is prefixed with its thread name so work done in
+    ``asyncio.to_thread`` workers is visible next to the event loop.
+
+    Every thread in the process is sampled, so the profile of one request also
+    contains whatever concurrent requests were doing while it ran.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.running_samples = 0
+        self.waiting_samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._labels: Dict[object, str] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            innermost = frame.f_code.co_name
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            if innermost in WAITING_FUNCTIONS:
+                self.waiting_samples += 1
+            else:
+                self.running_samples += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """Keeps the most recent profiles on disk, deleting the oldest beyond ``max_files``."""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.directory = Path(directory)
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def _path(self, request_id: str, suffix: str) -> Path:
+        # Request ids can come from a client header, so never let them pick the path
+        safe_id = "".join(c for c in request_id if c.isalnum() or c in "-_")[:64]
+        return self.directory / f"{safe_id}{suffix}"
+
+    def save(self, request_id: str, summary: dict, collapsed: str) -> None:
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._path(request_id, ".collapsed").write_text(collapsed)
+            self._path(request_id, ".json").write_text(json.dumps(summary, indent=2))
+            summaries = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+            for old in summaries[:max(0, len(summaries) - self.max_files)]:
+                old.unlink(missing_ok=True)
+                old.with_suffix(".collapsed").unlink(missing_ok=True)
+
+    def summary(self, request_id: str) -> Optional[dict]:
+        path = self._path(request_id, ".json")
+        return json.loads(path.read_text()) if path.exists() else None
+
+    def collapsed(self, request_id: str) -> Optional[str]:
+        path = self._path(request_id, ".collapsed")
+        return path.read_text() if path.exists() else None
+
+    def list(self) -> List[dict]:
+        if not self.directory.exists():
+            return []
+        paths = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        summaries = []
+        for path in paths:
+            try:
+                summary = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            summary.pop("top_stacks", None)
+            summaries.append(summary)
+        return summaries
+
+
+profile_store = ProfileStore()
+
+
+def is_admin(token: Optional[str]) -> bool:
+    # Compared as bytes: compare_digest rejects non-ASCII str
+    return bool(PROFILING_ADMIN_TOKEN) and bool(token) and \
+        hmac.compare_digest(token.encode("utf-8"), PROFILING_ADMIN_TOKEN.encode("utf-8"))
+
+
+def require_admin(header_token: Optional[str], query_token: Optional[str], what: str = "Profiling") -> None:
+    """Raise 403 unless the X-Profile-Token header or profile_token parameter carries the admin token."""
+    from fastapi import HTTPException
+
+    if not is_admin(header_token or query_token):
+        raise HTTPException(status_code=403, detail=f"{what} requires the admin token")
+
+
+def _requested_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers") or []:
+        if name == b"x-profile-token":
+            return value.decode("utf-8", errors="replace")
+    values = parse_qs(scope.get("query_string", b"").decode()).get("profile_token")
+    return values[0] if values else None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware running admin-flagged requests under the sampling profiler.
+
+    A request is profiled when it carries the admin token in an
+    ``X-Profile-Token`` header or a ``profile_token`` query parameter. The
+    response then includes an ``X-Profile-ID`` header naming the stored profile.
+    Requests without the flag go straight through. The sampler sees every
+    thread, so requests running at the same time show up in the profile too.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILING_ADMIN_TOKEN or app_path(scope).startswith("/profiles"):
+            await self.app(scope, receive, send)
+            return
+        if not is_admin(_requested_token(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = current_request_id() or uuid.uuid4().hex[:16]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        profiler = SamplingProfiler()
+        status = None
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+            status = "completed"
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            profiler.stop()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            summary = {
+                "request_id": profile_id,
+                "service": self.service,
+                "method": scope["method"],
+                "path": scope["path"],
+                "outcome": status,
+                "started_at": time.time() - wall,
+                "wall_ms": round(wall * 1000, 2),
+                # Process CPU time, so concurrent requests are included in it
+                "cpu_ms": round(cpu * 1000, 2),
+                "cpu_share": round(cpu / wall, 3) if wall else None,
+                "samples": profiler.samples,
+                "running_samples": profiler.running_samples,
+                "waiting_samples": profiler.waiting_samples,
+                "sample_interval_ms": profiler.interval * 1000,
+                "top_stacks": [{"stack": stack, "samples": count}
+                               for stack, count in profiler.stacks.most_common(20)]
+            }
+            try:
+                await asyncio.to_thread(profile_store.save, profile_id, summary, profiler.collapsed())
+            except OSError as e:
+                print(f"Could not store profile {profile_id}: {str(e)}")
+
+
+def enable_profiling(app, service: str) -> None:
+    """Add the opt-in profiling middleware and the admin-only /profiles endpoints to a FastAPI app."""
+    from fastapi import Header, HTTPException, Query
+    from fastapi.responses import PlainTextResponse
+
+    app.add_middleware(ProfilingMiddleware, service=service)
+
+    @app.get("/profiles", include_in_schema=False)
+    async def list_profiles(x_profile_token: Optional[str] = Header(None),
+                            profile_token: Optional[str] = Query(None)):
+        """Stored profiles, newest first"""
+        require_admin(x_profile_token, profile_token)
+        return await asyncio.to_thread(profile_store.list)
+
+    @app.get("/profiles/{request_id}", include_in_schema=False)
+    async def get_profile(request_id: str, x_profile_token: Optional[str] = Header(None),
+                          profile_token: Optional[str] = Query(None)):
+        """Wall/CPU split and hottest stacks of one profiled request"""
+        require_admin(x_profile_token, profile_token)
+        summary = await asyncio.to_thread(profile_store.summary, request_id)
+        if summary is None:
+            raise HTTPException(status_code=404, detail=f"No profile for request {request_id}")
+        return summary
+
+    @app.get("/profiles/{request_id}/collapsed", include_in_schema=False)
+    async def download_profile(request_id: str, x_profile_token: Optional[str] = Header(None),
+                               profile_token: Optional[str] = Query(None)):
+        """Collapsed stacks for flamegraph.pl or speedscope"""
+        require_admin(x_profile_token, profile_token)
+        collapsed = await asyncio.to_thread(profile_store.collapsed, request_id)
+        if collapsed is None:
+            raise HTTPException(status_code=404, detail=f"No profile for request {request_id}")
+        return PlainTextResponse(collapsed, headers={
+            "Content-Disposition": f'attachment; filename="{request_id}.collapsed"'})
@@ -0,0 +1,66 @@
+import json
+import os
+
+from app.utils.metrics import registry
+
+# Largest request body accepted, in bytes. Multipart uploads are spooled to disk
+# past 1 MB, so this bounds disk use; memory is bounded by the spool size.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+UPLOADS_REJECTED = registry.counter(
+    "medgenix_uploads_rejected_total", "Request bodies refused for exceeding MAX_UPLOAD_BYTES", ["reason"])
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that caps request bodies at ``max_bytes``.
+
+    A declared Content-Length over the limit is answered with 413 before any of
+    the body is read. Chunked or understated bodies are counted as they stream
+    in, and the read that crosses the limit raises a 413 to the endpoint.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length", b"").decode()
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            UPLOADS_REJECTED.inc(reason="content_length")
+            await self._reject(send)
+            return
+
+        from fastapi import HTTPException
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    UPLOADS_REJECTED.inc(reason="streamed")
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    def _detail(self) -> str:
+        return f"Uploads are limited to {self.max_bytes} bytes"
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": self._detail()}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            # The unread body is not drained, so the connection cannot be reused
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,128 @@
+"""
+Synthetic prescription image corpus.
+
+Images are rendered deterministically from a seed so the corpus does not have
+to be checked in: a paper-coloured prescription with a letterhead, patient
+details and a list of medicines, slightly rotated and photographed on a
+darker table surface with sensor noise. Each sample carries its ground-truth
+text so OCR accuracy can be scored.
+
+    python -m benchmarks.corpus --out benchmarks/corpus --count 20
+"""
+import argparse
+import io
+import random
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+MEDICINES = [
+    ("Crocin", "650mg"), ("Pan-D", "40mg"), ("Azithral", "500mg"), ("Augmentin", "625mg"),
+    ("Dolo", "650mg"), ("Allegra", "120mg"), ("Montair LC", "10mg"), ("Lipitor", "20mg"),
+    ("Norvasc", "5mg"), ("Glycomet", "500mg"), ("Telma", "40mg"), ("Shelcal", "500mg"),
+    ("Zerodol SP", "100mg"), ("Rantac", "150mg"), ("Cetzine", "10mg"), ("Combiflam", "400mg")
+]
+FORMS = ["Tab.", "Cap.", "Tab", "Syp."]
+FREQUENCIES = ["once daily", "twice daily", "1-0-1", "three times daily", "BD after food", "at bedtime"]
+DURATIONS = ["3 days", "5 days", "7 days", "14 days", "1 month"]
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+
+
+@dataclass
+class Sample:
+    name: str
+    image: Image.Image
+    text: str
+    medicines: List[str]
+
+    def jpeg_bytes(self, quality: int = 90) -> bytes:
+        buffered = io.BytesIO()
+        self.image.save(buffered, format="JPEG", quality=quality)
+        return buffered.getvalue()
+
+
+def _font(size: int):
+    for path in FONT_CANDIDATES:
+        if Path(path).exists():
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default()
+
+
+def generate_prescription(seed: int, width: int = 1600, height: int = 1200) -> Sample:
+    """Render one synthetic prescription photo."""
+    rng = random.Random(seed)
+    medicines = rng.sample(MEDICINES, rng.randint(2, 5))
+
+    lines = [
+        f"Dr. {rng.choice(['A. Sharma', 'R. Mehta', 'S. Iyer', 'P. Khan'])}, MBBS MD",
+        f"Patient: {rng.choice(['R. Kumar', 'A. Singh', 'M. Das', 'J. Thomas'])}   Age: {rng.randint(18, 80)}",
+        f"Date: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025",
+        "",
+        "Rx",
+    ]
+    for i, (name, strength) in enumerate(medicines, 1):
+        lines.append(f"{i}. {rng.choice(FORMS)} {name} {strength} - {rng.choice(FREQUENCIES)} x {rng.choice(DURATIONS)}")
+    text = "\n".join(lines)
+
+    # Paper
+    paper_w, paper_h = int(width * rng.uniform(0.55, 0.7)), int(height * rng.uniform(0.7, 0.85))
+    paper = Image.new("RGB", (paper_w, paper_h), (250, 248, 240))
+    draw = ImageDraw.Draw(paper)
+    draw.rectangle([0, 0, paper_w, 70], fill=(40, 90, 160))
+    draw.text((30, 18), "CITY CARE CLINIC", fill=(255, 255, 255), font=_font(34))
+    font = _font(26)
+    y = 110
+    for line in lines:
+        draw.text((40 + rng.randint(-4, 4), y), line, fill=(20, 20, 60), font=font)
+        y += 44
+
+    # Table surface with the paper placed off-centre and slightly rotated
+    table = np.full((height, width, 3), (96, 72, 52), dtype=np.uint8)
+    grain = np.random.default_rng(seed).normal(0, 12, (height, width, 1))
+    photo = Image.fromarray(np.clip(table + grain, 0, 255).astype(np.uint8))
+    angle = rng.uniform(-6, 6)
+    rotated = paper.rotate(angle, expand=True, fillcolor=(0, 0, 0))
+    mask = Image.new("L", paper.size, 255).rotate(angle, expand=True, fillcolor=0)
+    x = rng.randint(0, max(0, width - rotated.width))
+    y = rng.randint(0, max(0, height - rotated.height))
+    photo.paste(rotated, (x, y), mask)
+
+    # Camera softness and sensor noise
+    photo = photo.filter(ImageFilter.GaussianBlur(rng.uniform(0.3, 1.0)))
+    noise = np.random.default_rng(seed + 1).normal(0, 4, (height, width, 3))
+    photo = Image.fromarray(np.clip(np.asarray(photo, dtype=np.float32) + noise, 0, 255).astype(np.uint8))
+
+    return Sample(name=f"prescription_{seed:03d}", image=photo, text=text,
+                  medicines=[name for name, _ in medicines])
+
+
+def load_corpus(count: int = 10, seed: int = 0) -> List[Sample]:
+    """Generate ``count`` samples starting at ``seed``."""
+    return [generate_prescription(seed + i) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the synthetic prescription corpus to disk")
+    parser.add_argument("--out", default="benchmarks/corpus")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    for sample in load_corpus(args.count, args.seed):
+        (out / f"{sample.name}.jpg").write_bytes(sample.jpeg_bytes())
+        (out / f"{sample.name}.txt").write_text(sample.text)
+    print(f"Wrote {args.count} samples to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Effect of cropping photos to the document before preprocessing.
+
+For each corpus photo, runs ``preprocess_prescription`` with and without
+``crop_to_document`` and compares the pixels per variant, the base64 payload
+the primary engine receives for the original variant (from ``encode_image``),
+and the OpenCV time spent preprocessing, crop included. Remote vision latency
+grows with payload size, so the byte reduction is a proxy for it.
+
+    python -m benchmarks.crop_reduction
+    python -m benchmarks.crop_reduction --count 20 --save-crops benchmarks/results/crops
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+from benchmarks.corpus import load_corpus
+from app.ocr import preprocessing
+from app.ocr.encoding import encode_image
+
+
+def measure(image, crop: bool) -> dict:
+    preprocessing.OCR_CROP_DOCUMENT = crop
+    started = time.perf_counter()
+    versions = preprocessing.preprocess_prescription(image)
+    elapsed = time.perf_counter() - started
+    original = versions["original"]
+    return {
+        "pixels": original.width * original.height,
+        "payload": len(encode_image(original, "llama").base64),
+        "seconds": elapsed,
+        "image": original,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure payload and preprocessing savings of document cropping")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-crops", help="Directory to write the cropped originals to, for inspection")
+    args = parser.parse_args()
+
+    rows = []
+    for sample in load_corpus(args.count, args.seed):
+        full = measure(sample.image, crop=False)
+        cropped = measure(sample.image, crop=True)
+        rows.append((sample.name, full, cropped))
+        if args.save_crops:
+            out = Path(args.save_crops)
+            out.mkdir(parents=True, exist_ok=True)
+            cropped["image"].save(out / f"{sample.name}.jpg", quality=90)
+
+    print(f"{'sample':<20}{'pixels':>18}{'payload KB':>18}{'preprocess ms':>18}")
+    for name, full, cropped in rows:
+        print(f"{name:<20}"
+              f"{full['pixels'] / 1e6:>8.2f}M -> {cropped['pixels'] / 1e6:.2f}M"
+              f"{full['payload'] / 1024:>9.0f} -> {cropped['payload'] / 1024:<6.0f}"
+              f"{full['seconds'] * 1000:>9.0f} -> {cropped['seconds'] * 1000:.0f}")
+
+    def reduction(key):
+        return statistics.mean(1 - cropped[key] / full[key] for _, full, cropped in rows)
+
+    print(f"\nMean reduction: pixels {reduction('pixels'):.0%}, payload bytes {reduction('payload'):.0%}, "
+          f"preprocessing time {reduction('seconds'):.0%}")
+
+
+if __name__ == "__main__":
+    main()
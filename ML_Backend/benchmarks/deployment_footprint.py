@@ -0,0 +1,194 @@
+"""
+Memory and connection footprint of the separate and combined deployments.
+
+Runs the three services as separate uvicorn processes, then all of them in one
+process (``app.combined``), against the local provider mocks. Each deployment
+gets the same mixed workload, after which the benchmark reports per process
+the resident memory, threads, and TCP connections held open to the providers.
+Linux only, since everything is read from /proc.
+
+    python -m benchmarks.deployment_footprint
+    python -m benchmarks.deployment_footprint --requests 60 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+from benchmarks.mock_providers import provider_env
+from benchmarks.run import RESULTS_DIR, SERVICES, start_process, wait_until_up
+
+COMBINED_PORT = 8104
+# Where each service lives inside app.combined
+COMBINED_PREFIXES = {"prescription": "", "info": "/info", "prices": "/prices"}
+# Medicines listed in the mock sitemap
+MEDICINES = ["paracetamol", "ibuprofen", "atorvastatin", "amlodipine", "pantoprazole", "azithromycin"]
+
+
+def workload(sitemap_url: str, count: int):
+    """(service, method, path, request kwargs) for a mix of generics, medicine info and price lookups"""
+    requests = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            requests.append(("prescription", "POST", "/api/generic-alternatives/",
+                             {"json": [{"brand_name": f"footprint{i % 10}", "dosage": "20mg"}]}))
+        elif kind == 1:
+            requests.append(("info", "POST", "/medicine_info",
+                             {"json": {"name": MEDICINES[i % len(MEDICINES)], "sitemap_url": sitemap_url}}))
+        else:
+            requests.append(("prices", "GET", f"/get_prices/{['dolo 650', 'crocin', 'calpol'][i % 3]}", {}))
+    return requests
+
+
+def process_stats(pid: int, provider_port: int) -> dict:
+    status = {}
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        key, _, value = line.partition(":")
+        status[key] = value.split()
+    sockets = set()
+    for fd in Path(f"/proc/{pid}/fd").iterdir():
+        try:
+            target = os.readlink(fd)
+        except OSError:
+            continue
+        if target.startswith("socket:["):
+            sockets.add(target[8:-1])
+    # Established connections from this process to the mock providers
+    connections = 0
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        if not os.path.exists(table):
+            continue
+        for line in Path(table).read_text().splitlines()[1:]:
+            fields = line.split()
+            if fields[3] == "01" and int(fields[2].rsplit(":", 1)[1], 16) == provider_port and fields[9] in sockets:
+                connections += 1
+    return {"rss_mb": int(status["VmRSS"][0]) / 1024, "peak_rss_mb": int(status["VmHWM"][0]) / 1024,
+            "threads": int(status["Threads"][0]), "provider_connections": connections}
+
+
+async def drive(session, base_urls: dict, requests, concurrency: int) -> int:
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            service, method, path, kwargs = queue.get_nowait()
+            try:
+                async with session.request(method, base_urls[service] + path, **kwargs) as response:
+                    await response.read()
+                    errors += response.status >= 400
+            except aiohttp.ClientError:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return errors
+
+
+async def measure(deployment: str, env: dict, args, session, requests) -> dict:
+    if deployment == "separate":
+        processes = {name: start_process([service["module"], "--host", "127.0.0.1", "--port",
+                                          str(service["port"]), "--log-level", "warning"], env)
+                     for name, service in SERVICES.items()}
+        base_urls = {name: f"http://127.0.0.1:{service['port']}" for name, service in SERVICES.items()}
+    else:
+        processes = {"combined": start_process(["app.combined:app", "--host", "127.0.0.1", "--port",
+                                                str(COMBINED_PORT), "--log-level", "warning"], env)}
+        base_urls = {name: f"http://127.0.0.1:{COMBINED_PORT}{prefix}" for name, prefix in COMBINED_PREFIXES.items()}
+    try:
+        for name, process in processes.items():
+            await wait_until_up(session, (base_urls.get(name) or base_urls["prescription"]) + "/", process)
+        idle = {name: process_stats(process.pid, args.mock_port) for name, process in processes.items()}
+        started = time.perf_counter()
+        errors = await drive(session, base_urls, requests, args.concurrency)
+        elapsed = time.perf_counter() - started
+        loaded = {name: process_stats(process.pid, args.mock_port) for name, process in processes.items()}
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def total(stats, key):
+        return round(sum(s[key] for s in stats.values()), 1)
+
+    return {
+        "deployment": deployment,
+        "processes": len(processes),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "idle_rss_mb": total(idle, "rss_mb"),
+        "rss_mb": total(loaded, "rss_mb"),
+        "peak_rss_mb": total(loaded, "peak_rss_mb"),
+        "threads": total(loaded, "threads"),
+        "provider_connections": total(loaded, "provider_connections"),
+        "per_process": loaded,
+    }
+
+
+async def main_async(args):
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    workdir = Path(tempfile.mkdtemp(prefix="medgenix-footprint-"))
+    env = {**os.environ, **provider_env(mock_url),
+           "MOCK_LATENCY_MS": str(args.latency_ms),
+           "GENERICS_CACHE_FILE": str(workdir / "generics_cache.json"),
+           "MEDICINE_INFO_CACHE_FILE": str(workdir / "medicine_info_cache.json"),
+           "PRICE_INDEX_FILE": str(workdir / "price_index.sqlite3"),
+           "PYTHONPATH": str(Path(__file__).resolve().parent.parent)}
+    requests = workload(f"{mock_url}/sitemap.xml", args.requests)
+
+    mock = start_process(["benchmarks.mock_providers:app", "--host", "127.0.0.1",
+                          "--port", str(args.mock_port), "--log-level", "warning"], env)
+    results = []
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+            await wait_until_up(session, f"{mock_url}/_stats", mock)
+            for deployment in ("separate", "combined"):
+                print(f"Measuring the {deployment} deployment")
+                # Each deployment starts from empty caches
+                for cache in workdir.iterdir():
+                    cache.unlink()
+                results.append(await measure(deployment, env, args, session, requests))
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+    columns = ["processes", "errors", "idle_rss_mb", "rss_mb", "peak_rss_mb", "threads", "provider_connections"]
+    print(f"\n{'deployment':<12}" + "".join(f"{c:>{len(c) + 2}}" for c in columns))
+    for result in results:
+        print(f"{result['deployment']:<12}" + "".join(f"{result[c]:>{len(c) + 2}}" for c in columns))
+    separate, combined = results
+    if separate["rss_mb"]:
+        print(f"\nCombined uses {1 - combined['rss_mb'] / separate['rss_mb']:.0%} less memory and "
+              f"{separate['provider_connections'] - combined['provider_connections']} fewer provider connections")
+
+    output = RESULTS_DIR / f"footprint-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({"requests": args.requests, "concurrency": args.concurrency,
+                                  "latency_ms": args.latency_ms, "results": results}, indent=2))
+    print(f"\nResults written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory and connections of separate and combined deployments")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=6)
+    parser.add_argument("--latency-ms", type=float, default=20, help="Mean latency added by every mock provider")
+    parser.add_argument("--mock-port", type=int, default=8900)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Local stand-ins for every external provider used by the ML backend.
+
+A single FastAPI app replays canned responses from ``benchmarks/fixtures`` for
+Together, OpenAI, Groq, RxNav, Firecrawl, the 1mg sitemap and the pharmacy pages
+themselves (for the direct fetcher, with ETag validation), with configurable
+latency and error injection. Point the services at it with the environment
+returned by ``provider_env``.
+
+Latency and error rates are read from the environment at startup:
+
+    MOCK_LATENCY_MS            mean added latency for every provider (default 0)
+    MOCK_JITTER_MS             uniform jitter added on top (default 0)
+    MOCK_ERROR_RATE            probability of answering 503 / 429 (default 0)
+    MOCK_<PROVIDER>_LATENCY_MS per-provider override, e.g. MOCK_TOGETHER_LATENCY_MS
+    MOCK_<PROVIDER>_ERROR_RATE per-provider override, e.g. MOCK_GROQ_ERROR_RATE
+
+Providers: TOGETHER, OPENAI, GROQ, RXNAV, FIRECRAWL, SITEMAP, PAGES.
+"""
+import asyncio
+import hashlib
+import html
+import json
+import os
+import random
+import re
+import time
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+FIXTURES = Path(__file__).parent / "fixtures"
+LLM_COMPLETIONS = json.loads((FIXTURES / "llm_completions.json").read_text())
+RXNAV = json.loads((FIXTURES / "rxnav.json").read_text())
+FIRECRAWL = json.loads((FIXTURES / "firecrawl.json").read_text())
+
+# Synthetic medicines listed in the sitemap so cold-cache runs can use unique names
+SITEMAP_MEDICINES = int(os.getenv("MOCK_SITEMAP_MEDICINES", "5000"))
+
+app = FastAPI(title="Mock providers")
+stats = {}
+
+
+def provider_env(base_url: str) -> dict:
+    """Environment variables that route every service to the mock server at ``base_url``."""
+    return {
+        "TOGETHER_API_KEY": "mock",
+        "TOGETHER_API_BASE": f"{base_url}/together/v1",
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_API_BASE": f"{base_url}/openai/v1",
+        "GROQ_API_KEY": "mock",
+        "GROQ_BASE_URL": f"{base_url}/groq",
+        "RXNAV_BASE_URL": f"{base_url}/rxnav/REST",
+        "FIRECRAWL_API_KEY": "mock",
+        "FIRECRAWL_API_URL": f"{base_url}/firecrawl",
+        "PRICE_1MG_SEARCH_URL": f"{base_url}/pages/1mg/search/all?name=",
+        "PRICE_PHARMEASY_SEARCH_URL": f"{base_url}/pages/pharmeasy/search/all?name=",
+    }
+
+
+def _setting(provider: str, name: str, default: float) -> float:
+    value = os.getenv(f"MOCK_{provider}_{name}", os.getenv(f"MOCK_{name}"))
+    return float(value) if value is not None else default
+
+
+async def _simulate(provider: str):
+    """Apply configured latency; return an error response when one is injected."""
+    counters = stats.setdefault(provider, {"requests": 0, "errors": 0})
+    counters["requests"] += 1
+    latency = _setting(provider, "LATENCY_MS", 0) + random.uniform(0, _setting(provider, "JITTER_MS", 0))
+    if latency:
+        await asyncio.sleep(latency / 1000)
+    if random.random() < _setting(provider, "ERROR_RATE", 0):
+        counters["errors"] += 1
+        status = random.choice([429, 503])
+        return JSONResponse({"error": {"message": f"Injected {status} from mock {provider.lower()}"}},
+                            status_code=status, headers={"Retry-After": "1"})
+    return None
+
+
+def _completion_for(messages: list, vision: bool) -> str:
+    """Pick the canned completion matching the prompt of a chat request."""
+    if vision:
+        return LLM_COMPLETIONS["ocr"]
+    prompt = " ".join(m["content"] for m in messages if isinstance(m.get("content"), str))
+    if "prescription using OCR" in prompt:
+        return LLM_COMPLETIONS["extraction"]
+    if "generic alternatives" in prompt:
+        return LLM_COMPLETIONS["alternatives"]
+    if "Extract structured information about" in prompt:
+        return LLM_COMPLETIONS["medicine_info"]
+    if "pharmacy website content" in prompt:
+        return LLM_COMPLETIONS["prices"]
+    return "[]"
+
+
+def _chat_response(body: dict, content: str, stream: bool):
+    model = body.get("model", "mock-model")
+    created = int(time.time())
+    if not stream:
+        return JSONResponse({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(content) // 4, "total_tokens": len(content) // 4}
+        })
+
+    token_delay = _setting("GROQ", "TOKEN_MS", 0) / 1000
+
+    async def events():
+        for i in range(0, len(content), 16):
+            chunk = {
+                "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[i:i + 16]}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            if token_delay:
+                await asyncio.sleep(token_delay)
+        done = {
+            "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        }
+        yield f"data: {json.dumps(done)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+async def _chat(provider: str, request: Request, vision: bool):
+    error = await _simulate(provider)
+    if error:
+        return error
+    body = await request.json()
+    return _chat_response(body, _completion_for(body.get("messages", []), vision), body.get("stream", False))
+
+
+@app.post("/together/v1/chat/completions")
+async def together_chat(request: Request):
+    return await _chat("TOGETHER", request, vision=True)
+
+
+@app.post("/openai/v1/chat/completions")
+async def openai_chat(request: Request):
+    return await _chat("OPENAI", request, vision=True)
+
+
+@app.post("/groq/openai/v1/chat/completions")
+async def groq_chat(request: Request):
+    return await _chat("GROQ", request, vision=False)
+
+
+@app.get("/rxnav/REST/rxcui.json")
+async def rxnav_rxcui(name: str = ""):
+    return await _simulate("RXNAV") or RXNAV["rxcui"]
+
+
+@app.get("/rxnav/REST/rxcui/{rxcui}/allrelated.json")
+async def rxnav_allrelated(rxcui: str):
+    return await _simulate("RXNAV") or RXNAV["allrelated"]
+
+
+@app.get("/rxnav/REST/rxcui/{rxcui}/allProperties.json")
+async def rxnav_properties(rxcui: str):
+    return await _simulate("RXNAV") or RXNAV["allProperties"]
+
+
+@app.post("/firecrawl/v0/scrape")
+@app.post("/firecrawl/v1/scrape")
+async def firecrawl_scrape(request: Request):
+    error = await _simulate("FIRECRAWL")
+    if error:
+        return error
+    body = await request.json()
+    page = FIRECRAWL["search_page"] if "/search/" in body.get("url", "") else FIRECRAWL["medicine_page"]
+    return {"success": True, "data": page}
+
+
+def _markdown_to_html(markdown: str) -> str:
+    """Render a fixture page's markdown as the HTML a pharmacy site would serve."""
+    def inline(text):
+        text = html.escape(text, quote=False)
+        text = re.sub(r"!\[([^\]]*)\]\(([^)]*)\)", r'<img alt="\1" src="\2">', text)
+        return re.sub(r"\[([^\]]*)\]\(([^)]*)\)", r'<a href="\2">\1</a>', text)
+
+    body = []
+    for line in markdown.splitlines():
+        heading = re.match(r"(#{1,6})\s+(.*)", line)
+        if heading:
+            level = len(heading.group(1))
+            body.append(f"<h{level}>{inline(heading.group(2))}</h{level}>")
+        elif line.startswith(("- ", "* ")):
+            body.append(f"<ul><li>{inline(line[2:])}</li></ul>")
+        elif line.strip():
+            body.append(f"<p>{inline(line)}</p>")
+    return ("<!DOCTYPE html><html><head><title>Mock pharmacy</title><script>window.__STATE__ = {}</script>"
+            "</head><body><main>" + "".join(body) + "</main></body></html>")
+
+
+PAGES = {name: _markdown_to_html(page["markdown"]) for name, page in FIRECRAWL.items()}
+PAGE_ETAGS = {name: f'"{hashlib.sha1(page.encode()).hexdigest()[:16]}"' for name, page in PAGES.items()}
+
+
+@app.get("/pages/{path:path}")
+async def pharmacy_page(path: str, request: Request):
+    """Pharmacy pages fetched directly; answers 304 when the client's ETag matches."""
+    error = await _simulate("PAGES")
+    if error:
+        return error
+    name = "search_page" if path.split("/")[1:2] == ["search"] else "medicine_page"
+    headers = {"ETag": PAGE_ETAGS[name], "Cache-Control": "max-age=0"}
+    if request.headers.get("if-none-match") == PAGE_ETAGS[name]:
+        stats["PAGES"]["not_modified"] = stats["PAGES"].get("not_modified", 0) + 1
+        return Response(status_code=304, headers=headers)
+    return Response(PAGES[name], media_type="text/html", headers=headers)
+
+
+@app.get("/sitemap.xml")
+async def sitemap(request: Request):
+    error = await _simulate("SITEMAP")
+    if error:
+        return error
+    names = ["paracetamol", "ibuprofen", "atorvastatin", "amlodipine", "pantoprazole", "azithromycin"]
+    names += [f"bench-med-{i}" for i in range(SITEMAP_MEDICINES)]
+    # Medicine pages are served by this mock, so direct fetches stay local
+    base = f"{str(request.base_url).rstrip('/')}/pages/1mg"
+    urls = "".join(
+        f"<url><loc>{base}/generics/{name}-{210000 + i}</loc></url>" for i, name in enumerate(names)
+    )
+    xml = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+    return Response(xml, media_type="application/xml")
+
+
+@app.get("/_stats")
+async def get_stats():
+    """Per-provider request and injected-error counts."""
+    return stats
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("MOCK_PORT", "8900")), log_level="warning")
@@ -0,0 +1,102 @@
+"""
+Cache hit rate of canonical medicine names against the previous lower/strip keys.
+
+Replays a stream of medicine lookups spelled the way prescriptions, OCR output and
+API callers write them ("Crocin 650", "CROCIN-650mg Tab", "Tab. crocin") through
+simulated caches keyed on ``name.lower().strip()``, ``canonical_name`` and
+``medicine_key``. Every first sighting of a key is a miss. Products whose name
+ends in a number ("Vitamin B 12", "Vitamin B 6") are part of the stream, and the
+run fails if two of them share a ``medicine_key``, the key the caches use.
+
+    python -m benchmarks.normalization_hit_rate
+    python -m benchmarks.normalization_hit_rate --lookups 20000 --seed 3
+"""
+import argparse
+import random
+
+from benchmarks.corpus import FORMS, MEDICINES
+from app.utils.normalize import canonical_name, medicine_key, parse_strength
+
+# Products whose name ends in a number that is not their strength
+NUMERIC_NAMED = [("Vitamin B 12", "1500mcg"), ("Vitamin B 6", "10mg"), ("Vitamin D 3", "1000iu")]
+
+
+def spell(rng: random.Random, name: str, strength: str) -> str:
+    """One way of writing a medicine seen in prescriptions and requests."""
+    variants = [
+        name,
+        name.lower(),
+        name.upper(),
+        f"{name} {strength}",
+        f"{name} {strength.replace('mg', '')}",
+        f"{name}-{strength}",
+        f"{rng.choice(FORMS)} {name} {strength}",
+        f"{name.upper()}-{strength.upper()} Tab",
+        f"{name} {strength.replace('mg', ' MG')} tablet",
+        f"  {name.lower()}  ",
+    ]
+    return rng.choice(variants)
+
+
+def simulate(lookups, key_fn) -> dict:
+    seen = set()
+    hits = 0
+    for spelling in lookups:
+        key = key_fn(spelling)
+        if key in seen:
+            hits += 1
+        else:
+            seen.add(key)
+    return {"keys": len(seen), "hits": hits, "hit_rate": hits / len(lookups) if lookups else 0.0}
+
+
+def shared_keys(lookups, truth, key_fn) -> dict:
+    """Keys that distinct medicines collapsed onto, each with the medicines sharing it."""
+    products_per_key = {}
+    for spelling, name in zip(lookups, truth):
+        products_per_key.setdefault(key_fn(spelling), set()).add(name)
+    return {key: names for key, names in products_per_key.items() if len(names) > 1}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cache hit rates of raw and canonical medicine keys")
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # Popularity follows a long tail, like real prescriptions
+    medicines = MEDICINES + NUMERIC_NAMED
+    weights = [1 / (rank + 1) for rank in range(len(medicines))]
+    lookups, truth = [], []
+    for _ in range(args.lookups):
+        name, strength = rng.choices(medicines, weights)[0]
+        lookups.append(spell(rng, name, strength))
+        truth.append(name)
+
+    raw = simulate(lookups, lambda name: name.lower().strip())
+    canonical = simulate(lookups, canonical_name)
+    keyed = simulate(lookups, medicine_key)
+    # Best possible: one miss per distinct medicine
+    ideal = simulate(truth, str)
+
+    # Distinct medicines that collapsed onto the same key would be wrong answers
+    canonical_shared = shared_keys(lookups, truth, canonical_name)
+    key_shared = shared_keys(lookups, truth, medicine_key)
+    strengths_parsed = sum(1 for s in lookups if parse_strength(s)) / len(lookups)
+
+    print(f"{args.lookups} lookups of {len(medicines)} medicines\n")
+    print(f"{'keying':<14}{'keys':>8}{'hits':>8}{'hit rate':>10}")
+    for label, result in (("lower/strip", raw), ("canonical", canonical), ("medicine key", keyed), ("ideal", ideal)):
+        print(f"{label:<14}{result['keys']:>8}{result['hits']:>8}{result['hit_rate']:>10.1%}")
+    print(f"\nMisses avoided: {keyed['hits'] - raw['hits']}")
+    print(f"Canonical names shared by different medicines: {len(canonical_shared)}")
+    print(f"Medicine keys shared by different medicines: {len(key_shared)}")
+    print(f"Lookups with a parsed strength: {strengths_parsed:.1%}")
+    if key_shared:
+        raise SystemExit("Medicine keys shared by different medicines: "
+                         + "; ".join(f"{key!r} <- {sorted(names)}" for key, names in key_shared.items()))
+
+
+if __name__ == "__main__":
+    main()
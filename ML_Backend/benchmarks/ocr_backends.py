@@ -0,0 +1,99 @@
+"""
+Accuracy and latency of the local OCR engines.
+
+Runs each engine on the synthetic corpus, cropped to the document the way the
+pipeline does, and reports model load time, resident memory added by loading,
+per-image latency and accuracy: character error rate against the ground-truth
+text and the share of prescribed medicines whose name was read. Engines that
+cannot load (missing package or models) are reported and skipped.
+
+    python -m benchmarks.ocr_backends
+    python -m benchmarks.ocr_backends --engines easyocr onnx --count 20
+    ONNX_INTRA_OP_THREADS=2 python -m benchmarks.ocr_backends --engines onnx
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import Levenshtein
+
+from benchmarks.corpus import load_corpus
+from benchmarks.run import percentile
+from app.ocr import load_engine, warm_state, warmup_engines
+from app.ocr.preprocessing import crop_to_document
+from app.utils.normalize import canonical_name
+
+
+def rss_mb() -> float:
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/status") as f:
+            return int(next(line.split()[1] for line in f if line.startswith("VmRSS:"))) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def character_error_rate(text: str, truth: str) -> float:
+    text, truth = " ".join(text.split()).lower(), " ".join(truth.split()).lower()
+    return Levenshtein.distance(text, truth) / max(1, len(truth))
+
+
+def medicine_recall(text: str, medicines) -> float:
+    read = canonical_name(text)
+    return sum(1 for name in medicines if canonical_name(name) in read) / max(1, len(medicines))
+
+
+def benchmark_engine(engine: str, samples, images) -> dict:
+    before = rss_mb()
+    started = time.perf_counter()
+    warmup_engines([engine])
+    if warm_state[engine] != "warm":
+        raise RuntimeError("could not load the engine")
+    extract = load_engine(engine)
+    load_seconds = time.perf_counter() - started
+    loaded_mb = rss_mb() - before
+
+    latencies, errors, recalls = [], [], []
+    for sample, image in zip(samples, images):
+        started = time.perf_counter()
+        text = asyncio.run(extract(image))
+        latencies.append(time.perf_counter() - started)
+        errors.append(character_error_rate(text, sample.text))
+        recalls.append(medicine_recall(text, sample.medicines))
+    return {
+        "engine": engine,
+        "load_s": load_seconds,
+        "model_mb": loaded_mb,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "cer": statistics.mean(errors),
+        "recall": statistics.mean(recalls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare accuracy and latency of local OCR engines")
+    parser.add_argument("--engines", nargs="+", default=["easyocr", "onnx"])
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    samples = load_corpus(args.count, args.seed)
+    images = [crop_to_document(sample.image) for sample in samples]
+    results = []
+    for engine in args.engines:
+        try:
+            results.append(benchmark_engine(engine, samples, images))
+        except Exception as e:
+            print(f"Skipping {engine}: {str(e)}")
+
+    print(f"\n{args.count} images\n")
+    print(f"{'engine':<10}{'load s':>8}{'model MB':>10}{'p50 ms':>9}{'p95 ms':>9}{'CER':>8}{'medicines':>11}")
+    for r in results:
+        print(f"{r['engine']:<10}{r['load_s']:>8.1f}{r['model_mb']:>10.0f}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}"
+              f"{r['cer']:>8.1%}{r['recall']:>11.0%}")
+
+
+if __name__ == "__main__":
+    main()
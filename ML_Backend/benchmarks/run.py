@@ -0,0 +1,298 @@
+"""
+End-to-end benchmark of the ML backend services against local provider mocks.
+
+Starts the mock providers and the three FastAPI services as subprocesses,
+replays each scenario and reports p50/p95/p99 latency, requests per second and
+peak RSS of the serving process per scenario. Results are written as JSON so
+runs can be compared:
+
+    python -m benchmarks.run --latency-ms 150 --jitter-ms 50
+    python -m benchmarks.run --only generics --compare benchmarks/results/<previous>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.corpus import load_corpus
+from benchmarks.mock_providers import provider_env
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+SERVICES = {
+    "prescription": {"module": "app.main:app", "port": 8101},
+    "info": {"module": "info_scraper.main:app", "port": 8102},
+    "prices": {"module": "price_comparison.main:app", "port": 8103},
+}
+
+
+@dataclass
+class Scenario:
+    name: str
+    service: str
+    endpoint: str
+    # Builds (method, path, request kwargs) for the i-th request
+    build: Callable[[int], tuple]
+    requests: int
+    concurrency: int
+    # Requests sent (and not measured) before the run, e.g. to warm a cache
+    prime: List[int] = field(default_factory=list)
+
+
+def build_scenarios(corpus, sitemap_url: str) -> List[Scenario]:
+    images = [sample.jpeg_bytes() for sample in corpus]
+
+    def prescription(i):
+        form = aiohttp.FormData()
+        form.add_field("file", images[i % len(images)], filename=f"rx_{i}.jpg", content_type="image/jpeg")
+        return "POST", "/process-prescription/", {"data": form}
+
+    def generics_cold(i):
+        return "POST", "/api/generic-alternatives/", {"json": [{"brand_name": f"coldbrand{i}", "dosage": "20mg"}]}
+
+    def generics_warm(i):
+        return "POST", "/api/generic-alternatives/", {"json": [{"brand_name": "Lipitor", "dosage": "20mg"}]}
+
+    def info_cold(i):
+        return "POST", "/medicine_info", {"json": {"name": f"bench-med-{i}", "sitemap_url": sitemap_url}}
+
+    def info_warm(i):
+        return "POST", "/medicine_info", {"json": {"name": "paracetamol", "sitemap_url": sitemap_url}}
+
+    def info_batch(i):
+        names = [f"bench-med-{1000 + i * 8 + j}" for j in range(8)]
+        return "POST", "/medicine_info/batch", {"json": {"names": names, "sitemap_url": sitemap_url}}
+
+    def prices(i):
+        return "GET", f"/get_prices/{['dolo 650', 'crocin', 'calpol'][i % 3]}", {}
+
+    return [
+        Scenario("prescription-single", "prescription", "/process-prescription/", prescription, 10, 1),
+        Scenario("prescription-concurrent", "prescription", "/process-prescription/", prescription, 40, 8),
+        Scenario("generics-cold", "prescription", "/api/generic-alternatives/", generics_cold, 20, 1),
+        Scenario("generics-warm", "prescription", "/api/generic-alternatives/", generics_warm, 100, 8, prime=[0]),
+        Scenario("medicine-info-cold", "info", "/medicine_info", info_cold, 20, 4),
+        Scenario("medicine-info-warm", "info", "/medicine_info", info_warm, 100, 8, prime=[0]),
+        Scenario("medicine-info-batch", "info", "/medicine_info/batch", info_batch, 5, 1),
+        Scenario("prices-single", "prices", "/get_prices/{medicine}", prices, 10, 1),
+        Scenario("prices-concurrent", "prices", "/get_prices/{medicine}", prices, 30, 6),
+    ]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def read_peak_rss_mb(pid: int) -> Optional[float]:
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss(pid: int) -> bool:
+    """Reset the kernel's high-water mark so the next reading covers one scenario (Linux only)."""
+    try:
+        Path(f"/proc/{pid}/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def start_process(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", *args], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+async def wait_until_up(session: aiohttp.ClientSession, url: str, process: subprocess.Popen, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited during startup:\n{process.stderr.read().decode()[-2000:]}")
+        try:
+            async with session.get(url) as response:
+                if response.status < 500:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+async def send(session, base_url, scenario: Scenario, i: int) -> tuple:
+    method, path, kwargs = scenario.build(i)
+    start = time.perf_counter()
+    try:
+        async with session.request(method, base_url + path, **kwargs) as response:
+            await response.read()
+            ok = response.status < 400
+    except aiohttp.ClientError:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def run_scenario(session, base_url: str, pid: int, scenario: Scenario) -> dict:
+    for i in scenario.prime:
+        await send(session, base_url, scenario, i)
+
+    rss_reset = reset_peak_rss(pid)
+    queue = asyncio.Queue()
+    for i in range(scenario.requests):
+        queue.put_nowait(i)
+    latencies, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            i = queue.get_nowait()
+            latency, ok = await send(session, base_url, scenario, i)
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(scenario.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "scenario": scenario.name,
+        "endpoint": scenario.endpoint,
+        "requests": scenario.requests,
+        "concurrency": scenario.concurrency,
+        "errors": errors,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(statistics.mean(latencies)) if latencies else None,
+        "rps": round(scenario.requests / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": round(read_peak_rss_mb(pid) or 0, 1),
+        "peak_rss_scope": "scenario" if rss_reset else "process",
+    }
+
+
+def print_table(results: List[dict], baseline: Optional[Dict[str, dict]] = None):
+    columns = ["p50_ms", "p95_ms", "p99_ms", "rps", "peak_rss_mb"]
+    print(f"\n{'scenario':<26}{'errors':>7}" + "".join(f"{c:>14}" for c in columns))
+    for result in results:
+        row = f"{result['scenario']:<26}{result['errors']:>7}"
+        previous = (baseline or {}).get(result["scenario"])
+        for column in columns:
+            value = result[column]
+            cell = "-" if value is None else f"{value:g}"
+            if previous and previous.get(column) and value is not None:
+                cell += f" ({(value - previous[column]) / previous[column] * 100:+.0f}%)"
+            row += f"{cell:>14}"
+        print(row)
+
+
+async def main_async(args):
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+
+    workdir = Path(tempfile.mkdtemp(prefix="medgenix-bench-"))
+    env = {**os.environ, **provider_env(mock_url),
+           "MOCK_LATENCY_MS": str(args.latency_ms), "MOCK_JITTER_MS": str(args.jitter_ms),
+           "MOCK_ERROR_RATE": str(args.error_rate),
+           "GENERICS_CACHE_FILE": str(workdir / "generics_cache.json"),
+           "MEDICINE_INFO_CACHE_FILE": str(workdir / "medicine_info_cache.json"),
+           "PRICE_INDEX_FILE": str(workdir / "price_index.sqlite3"),
+           "OCR_METHOD": os.getenv("OCR_METHOD", "llama"),
+           "PYTHONPATH": str(ROOT)}
+
+    scenarios = [s for s in build_scenarios(load_corpus(args.corpus_size), f"{mock_url}/sitemap.xml")
+                 if not args.only or any(pattern in s.name for pattern in args.only)]
+    for scenario in scenarios:
+        scenario.requests = max(1, int(scenario.requests * args.scale))
+    needed = {scenario.service for scenario in scenarios}
+
+    processes = {"mock": start_process(["benchmarks.mock_providers:app", "--host", "127.0.0.1",
+                                        "--port", str(args.mock_port), "--log-level", "warning"], env)}
+    results = []
+    try:
+        timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await wait_until_up(session, f"{mock_url}/_stats", processes["mock"])
+            for name in needed:
+                service = SERVICES[name]
+                processes[name] = start_process([service["module"], "--host", "127.0.0.1", "--port",
+                                                 str(service["port"]), "--log-level", "warning"], env)
+            for name in needed:
+                await wait_until_up(session, f"http://127.0.0.1:{SERVICES[name]['port']}/", processes[name])
+
+            for scenario in scenarios:
+                base_url = f"http://127.0.0.1:{SERVICES[scenario.service]['port']}"
+                print(f"Running {scenario.name} ({scenario.requests} requests, concurrency {scenario.concurrency})")
+                results.append(await run_scenario(session, base_url, processes[scenario.service].pid, scenario))
+
+            async with session.get(f"{mock_url}/_stats") as response:
+                provider_stats = await response.json()
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    baseline = None
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text())
+        baseline = {result["scenario"]: result for result in previous["results"]}
+    print_table(results, baseline)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                           capture_output=True, text=True).stdout.strip(),
+            "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "error_rate": args.error_rate,
+            "scale": args.scale, "provider_stats": provider_stats,
+        },
+        "results": results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ML backend against local provider mocks")
+    parser.add_argument("--only", nargs="*", help="Run scenarios whose name contains any of these strings")
+    parser.add_argument("--latency-ms", type=float, default=100, help="Mean latency added by every mock provider")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="Uniform jitter added on top of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability a provider call fails")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the request count of every scenario")
+    parser.add_argument("--corpus-size", type=int, default=10)
+    parser.add_argument("--mock-port", type=int, default=8900)
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--output", help="Where to write the JSON report")
+    parser.add_argument("--compare", help="Previous JSON report to diff against")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
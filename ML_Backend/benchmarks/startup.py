@@ -0,0 +1,138 @@
+"""
+Cold-start benchmark for the three services.
+
+For each app module, measures in a fresh interpreter:
+
+- import time and resident memory right after ``import <module>``
+- which heavy libraries the import pulled in (torch, easyocr, cv2, openai, groq)
+- time from spawning uvicorn until the service answers HTTP, and for the
+  prescription service until ``/ready`` reports the warmup as finished
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeats 5 --warmup all
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from benchmarks.run import ROOT, SERVICES
+
+HEAVY_MODULES = ["torch", "easyocr", "cv2", "openai", "groq", "firecrawl"]
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+rss_kb = int(next(l.split()[1] for l in open("/proc/self/status") if l.startswith("VmRSS:"))) \\
+    if sys.platform.startswith("linux") else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"import_s": elapsed, "rss_mb": rss_kb / 1024,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module: str, env: dict) -> dict:
+    script = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except OSError:
+        return None, None
+
+
+def measure_serving(app_path: str, port: int, env: dict, ready_path: str = None, timeout: float = 300) -> dict:
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", app_path, "--host", "127.0.0.1",
+                                "--port", str(port), "--log-level", "warning"],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    result = {"first_response_s": None, "ready_s": None}
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{app_path} exited:\n{process.stderr.read().decode()[-2000:]}")
+            status, body = _get(f"http://127.0.0.1:{port}/")
+            if status is not None:
+                result["first_response_s"] = time.perf_counter() - start
+                break
+            time.sleep(0.05)
+        if ready_path and result["first_response_s"] is not None:
+            while time.perf_counter() < deadline:
+                status, body = _get(f"http://127.0.0.1:{port}{ready_path}")
+                if status == 200:
+                    result["ready_s"] = time.perf_counter() - start
+                    result["ready"] = json.loads(body)
+                    break
+                time.sleep(0.1)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time, memory and time-to-ready of each service")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--warmup", default="", help="OCR_WARMUP value for the prescription service")
+    parser.add_argument("--only", nargs="*", choices=list(SERVICES), help="Services to measure")
+    args = parser.parse_args()
+
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "OCR_WARMUP": args.warmup,
+           "GROQ_API_KEY": os.getenv("GROQ_API_KEY", "bench"),
+           "FIRECRAWL_API_KEY": os.getenv("FIRECRAWL_API_KEY", "bench")}
+
+    report = {}
+    for name, service in SERVICES.items():
+        if args.only and name not in args.only:
+            continue
+        module = service["module"].split(":")[0]
+        imports = [measure_import(module, env) for _ in range(args.repeats)]
+        serving = [measure_serving(service["module"], service["port"], env,
+                                   "/ready" if name == "prescription" else None)
+                   for _ in range(args.repeats)]
+
+        def median(values):
+            values = [v for v in values if v is not None]
+            return round(statistics.median(values), 3) if values else None
+
+        report[name] = {
+            "import_s": median([r["import_s"] for r in imports]),
+            "rss_after_import_mb": median([r["rss_mb"] for r in imports]),
+            "heavy_modules": imports[-1]["heavy"],
+            "first_response_s": median([r["first_response_s"] for r in serving]),
+            "ready_s": median([r["ready_s"] for r in serving]),
+            "ready_state": serving[-1].get("ready", {}).get("status"),
+        }
+        row = report[name]
+        ready = f"{row['ready_s']}s" if row["ready_s"] is not None else "-"
+        print(f"{name:<14} import {row['import_s']}s  rss {row['rss_after_import_mb']}MB  "
+              f"first response {row['first_response_s']}s  ready {ready}  "
+              f"heavy modules: {', '.join(row['heavy_modules']) or '-'}")
+
+    output = Path(__file__).resolve().parent / "results" / f"startup-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({"repeats": args.repeats, "warmup": args.warmup, "services": report}, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
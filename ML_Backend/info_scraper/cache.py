@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+# Bump whenever the shape of MedicineResponse or the extraction prompt changes
+# so that entries produced by an older pipeline are ignored instead of served.
+CACHE_SCHEMA_VERSION = 1
+# Bump whenever the key of name -> URL resolutions changes; only the links are dropped
+LINKS_KEY_VERSION = 2
+
+
+def content_hash(content: str) -> str:
+    """Stable fingerprint of the scraped page content."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class MedicineInfoCache:
+    """
+    Persistent cache of structured medicine information.
+
+    Entries are keyed by the resolved 1mg URL and carry the hash of the
+    page content they were extracted from, so a refresh only re-runs the
+    LLM when the page actually changed. Name -> URL resolutions are cached
+    alongside so repeat lookups skip the sitemap download as well.
+    """
+
+    def __init__(self, cache_file: str = "medicine_info_cache.json", ttl_hours: float = 24 * 7):
+        self.cache_file = cache_file
+        self.ttl = timedelta(hours=ttl_hours)
+        self._lock = threading.Lock()
+        self.cache = self._load_cache()
+
+    def _load_cache(self) -> Dict[str, Any]:
+        """Load cache from file if it exists."""
+        empty = {"version": CACHE_SCHEMA_VERSION, "links_version": LINKS_KEY_VERSION, "links": {}, "entries": {}}
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r') as f:
+                    data = json.load(f)
+                if data.get("version") != CACHE_SCHEMA_VERSION:
+                    print(f"Discarding medicine info cache with schema version {data.get('version')}")
+                    return empty
+                if data.get("links_version") != LINKS_KEY_VERSION:
+                    data["links"] = {}
+                    data["links_version"] = LINKS_KEY_VERSION
+                data.setdefault("links", {})
+                data.setdefault("entries", {})
+                return data
+            except Exception as e:
+                print(f"Error loading medicine info cache: {e}")
+        return empty
+
+    def _save_cache(self) -> None:
+        """Save cache to file, replacing it atomically."""
+        tmp_file = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.cache, f)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            print(f"Error saving medicine info cache: {e}")
+
+    @staticmethod
+    def _normalize(medicine_name: str) -> str:
+        # The sitemap slug is matched literally first, so "Vitamin B 6" and
+        # "Vitamin B 12" resolve to different pages and must not share a key
+        return medicine_name.lower().strip()
+
+    def get_link(self, medicine_name: str, sitemap_url: str) -> Optional[str]:
+        """Get the cached sitemap resolution for a medicine name."""
+        return self.cache["links"].get(f"{sitemap_url}|{self._normalize(medicine_name)}")
+
+    def set_link(self, medicine_name: str, sitemap_url: str, url: str) -> None:
+        """Remember which URL a medicine name resolved to."""
+        with self._lock:
+            self.cache["links"][f"{sitemap_url}|{self._normalize(medicine_name)}"] = url
+            self._save_cache()
+
+    def set_links(self, links: Dict[str, str], sitemap_url: str) -> None:
+        """Remember several resolutions with a single write."""
+        with self._lock:
+            for medicine_name, url in links.items():
+                self.cache["links"][f"{sitemap_url}|{self._normalize(medicine_name)}"] = url
+            self._save_cache()
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Get the cached entry for a resolved URL, fresh or stale."""
+        return self.cache["entries"].get(url)
+
+    def is_stale(self, entry: Dict[str, Any]) -> bool:
+        """Check whether an entry is older than the configured TTL."""
+        try:
+            checked_at = datetime.fromisoformat(entry["checked_at"])
+        except (KeyError, ValueError):
+            return True
+        return datetime.now() - checked_at > self.ttl
+
+    def set(self, url: str, data: Dict[str, Any], page_hash: str) -> None:
+        """Store structured data extracted from the page with the given hash."""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self.cache["entries"][url] = {
+                "data": data,
+                "content_hash": page_hash,
+                "extracted_at": now,
+                "checked_at": now
+            }
+            self._save_cache()
+
+    def touch(self, url: str) -> None:
+        """Mark an entry as re-validated without changing its data."""
+        with self._lock:
+            entry = self.cache["entries"].get(url)
+            if entry:
+                entry["checked_at"] = datetime.now().isoformat()
+                self._save_cache()
+
+    def stale_urls(self) -> list:
+        """List URLs whose entries are due for a refresh."""
+        return [url for url, entry in list(self.cache["entries"].items()) if self.is_stale(entry)]
@@ -1,20 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import requests
+import asyncio
 import xml.etree.ElementTree as ET
 import re
-from firecrawl import FirecrawlApp
 import json
 from typing import Optional
-import groq
 from dotenv import load_dotenv
 import os
 from fastapi.middleware.cors import CORSMiddleware
 
-load_dotenv()
+from info_scraper.cache import MedicineInfoCache, content_hash
+from info_scraper.sections import MONOGRAPH_HEADINGS, extract_relevant_sections
+from app.services.clients import get_http_session
+from app.services.fetcher import page_fetcher
+from app.services.llm_cascade import LLMCascade, validate_medicine_info
+from app.utils.profiling import enable_profiling
+from app.utils.metrics import instrument_app, record_cache_lookup, registry, stage
+from app.utils.normalize import canonical_name
 
-groq_api_key = os.getenv("GROQ_API_KEY")
-firecrawl_api_key = os.getenv("FIRECRAWL_API_KEY")
+load_dotenv()
 
 app = FastAPI(title="Medicine Information API")
 
@@ -26,6 +31,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profiling sits inside the metrics middleware so profiles share the request id
+enable_profiling(app, service="info_scraper")
+instrument_app(app, service="info_scraper")
+
 # Add base endpoint
 @app.get("/")
 async def root():
@@ -55,17 +64,43 @@ async def help():
                     "sitemap_url": "string (optional)"
                 },
                 "response": "Structured medicine information"
+            },
+            {
+                "path": "/medicine_info/batch",
+                "method": "POST",
+                "description": "Get information about several medicines at once",
+                "request_body": {
+                    "names": "list of strings (required)",
+                    "sitemap_url": "string (optional)"
+                },
+                "response": "Newline-delimited JSON, one result per medicine as it completes"
             }
         ]
     }
 
-firecrawl_app = FirecrawlApp(api_key=firecrawl_api_key)
-groq_client = groq.Client(api_key=groq_api_key)
+# Groq and Firecrawl clients are shared with the other services when they run in one process
+medicine_info_cascade = LLMCascade("medicine_info")
+
+medicine_cache = MedicineInfoCache(
+    cache_file=os.getenv("MEDICINE_INFO_CACHE_FILE", "medicine_info_cache.json"),
+    ttl_hours=float(os.getenv("MEDICINE_INFO_CACHE_TTL_HOURS", "168"))
+)
+REFRESH_INTERVAL_SECONDS = int(os.getenv("MEDICINE_INFO_REFRESH_INTERVAL", "3600"))
+BATCH_CONCURRENCY = int(os.getenv("MEDICINE_INFO_BATCH_CONCURRENCY", "4"))
+CONTENT_TOKEN_BUDGET = int(os.getenv("MEDICINE_INFO_TOKEN_BUDGET", "3000"))
+TRIM_RATIO = registry.histogram(
+    "medgenix_content_trim_ratio", "Share of a scraped page's tokens kept for the LLM", ["backend"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0))
+_refreshing = set()
 
 class MedicineRequest(BaseModel):
     name: str
     sitemap_url: Optional[str] = "https://www.1mg.com/sitemap_generics_1.xml"
 
+class BatchMedicineRequest(BaseModel):
+    names: list[str]
+    sitemap_url: Optional[str] = "https://www.1mg.com/sitemap_generics_1.xml"
+
 class MedicineResponse(BaseModel):
     medicine_name: str
     uses: list[str]
@@ -76,54 +111,191 @@ class MedicineResponse(BaseModel):
     faqs: list[dict]
 
 @app.post("/medicine_info", response_model=MedicineResponse)
-async def get_medicine_info(request: MedicineRequest):
+async def get_medicine_info(request: MedicineRequest, background_tasks: BackgroundTasks):
     try:
-        # Step 1: Get the exact link from sitemap
-        medicine_link = get_medicine_link(request.name, request.sitemap_url)
+        # Step 1: Get the exact link from sitemap (or a previous resolution)
+        medicine_link = medicine_cache.get_link(request.name, request.sitemap_url)
         if not medicine_link:
-            raise HTTPException(status_code=404, detail=f"No link found for medicine: {request.name}")
-        
-        # Step 2: Scrape the data using FirecrawlApp
-        scraped_data = get_llm_ready_data(medicine_link)
-        
-        # Step 3: Process with LLM to extract structured data
-        structured_data = process_with_llm(scraped_data, request.name)
+            medicine_link = get_medicine_link(request.name, request.sitemap_url)
+            if not medicine_link:
+                raise HTTPException(status_code=404, detail=f"No link found for medicine: {request.name}")
+            await asyncio.to_thread(medicine_cache.set_link, request.name, request.sitemap_url, medicine_link)
         
+        # Step 2: Serve from cache, or scrape and extract structured data on a miss
+        structured_data, needs_refresh = await lookup_medicine_info(medicine_link, request.name)
+        if needs_refresh:
+            background_tasks.add_task(refresh_medicine_info, medicine_link, request.name)
         return structured_data
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/medicine_info/batch")
+async def get_medicine_info_batch(request: BatchMedicineRequest):
+    """
+    Get information about several medicines in one call.
+    
+    Each distinct name is resolved once and each page is looked up once, links
+    coming from a single sitemap pass, with bounded concurrency. Every name sent
+    still gets its own result, streamed as newline-delimited JSON in completion order.
+    """
+    names = [name.strip() for name in request.names]
+    
+    # Resolve every link up front, downloading the sitemap at most once
+    links = {}
+    for name in names:
+        if name and name.lower() not in links:
+            links[name.lower()] = medicine_cache.get_link(name, request.sitemap_url)
+    unresolved = [key for key, link in links.items() if not link]
+    if unresolved:
+        sitemap_links = await asyncio.to_thread(fetch_sitemap_links, request.sitemap_url)
+        for key in unresolved:
+            links[key] = find_medicine_link(key, sitemap_links)
+        found = {key: links[key] for key in unresolved if links[key]}
+        if found:
+            await asyncio.to_thread(medicine_cache.set_links, found, request.sitemap_url)
+    
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    background_tasks = BackgroundTasks()
+    lookups = {}
+    
+    async def lookup(medicine_link: str, name: str) -> MedicineResponse:
+        async with semaphore:
+            structured_data, needs_refresh = await lookup_medicine_info(medicine_link, name)
+        if needs_refresh:
+            background_tasks.add_task(refresh_medicine_info, medicine_link, name)
+        return structured_data
+    
+    async def resolve(name: str) -> dict:
+        if not name:
+            return {"name": name, "status": 400, "error": "Medicine name is required"}
+        medicine_link = links[name.lower()]
+        if not medicine_link:
+            return {"name": name, "status": 404, "error": f"No link found for medicine: {name}"}
+        # Names resolving to the same page share one lookup
+        if medicine_link not in lookups:
+            lookups[medicine_link] = asyncio.ensure_future(lookup(medicine_link, name))
+        try:
+            structured_data = await lookups[medicine_link]
+            return {"name": name, "status": 200, "data": structured_data.model_dump()}
+        except Exception as e:
+            return {"name": name, "status": 500, "error": str(e)}
+    
+    async def stream_results():
+        for next_result in asyncio.as_completed([resolve(name) for name in names]):
+            yield json.dumps(await next_result) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson", background=background_tasks)
+
+async def lookup_medicine_info(medicine_link: str, medicine_name: str) -> tuple:
+    """
+    Get structured data for a resolved link from the cache, scraping on a miss.
+    
+    Returns:
+        Tuple of (MedicineResponse, whether the cached entry needs revalidation)
+    """
+    with stage("cache:medicine_info"):
+        entry = medicine_cache.get(medicine_link)
+    record_cache_lookup("medicine_info", entry is not None)
+    if entry:
+        return MedicineResponse(**entry["data"]), medicine_cache.is_stale(entry)
+    return await scrape_and_extract(medicine_link, medicine_name), False
+
+async def scrape_and_extract(medicine_link: str, medicine_name: str) -> MedicineResponse:
+    """Scrape a medicine page and extract structured data, reusing the cache when the page is unchanged."""
+    scraped_data = await get_llm_ready_data(medicine_link)
+    page_hash = content_hash(scraped_data)
+    
+    entry = medicine_cache.get(medicine_link)
+    if entry and entry.get("content_hash") == page_hash:
+        await asyncio.to_thread(medicine_cache.touch, medicine_link)
+        return MedicineResponse(**entry["data"])
+    
+    structured_data = await asyncio.to_thread(process_with_llm, scraped_data, medicine_name)
+    
+    # Never cache the placeholder produced when extraction fails
+    if structured_data != create_default_response(medicine_name):
+        await asyncio.to_thread(medicine_cache.set, medicine_link, structured_data.model_dump(), page_hash)
+    return structured_data
+
+async def refresh_medicine_info(medicine_link: str, medicine_name: str) -> None:
+    """Re-validate a cached entry against the live page."""
+    if medicine_link in _refreshing:
+        return
+    _refreshing.add(medicine_link)
+    try:
+        await scrape_and_extract(medicine_link, medicine_name)
+    except Exception as e:
+        print(f"Error refreshing medicine info for {medicine_link}: {str(e)}")
+    finally:
+        _refreshing.discard(medicine_link)
+
+async def refresh_stale_entries():
+    """Periodically re-validate every cache entry that has outlived its TTL."""
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL_SECONDS)
+        for url in medicine_cache.stale_urls():
+            entry = medicine_cache.get(url) or {}
+            medicine_name = entry.get("data", {}).get("medicine_name", url)
+            await refresh_medicine_info(url, medicine_name)
+
+@app.on_event("startup")
+async def start_cache_refresher():
+    if REFRESH_INTERVAL_SECONDS > 0:
+        app.state.cache_refresher = asyncio.create_task(refresh_stale_entries())
+
+@app.on_event("shutdown")
+async def close_fetcher():
+    await page_fetcher.close()
+
 def get_medicine_link(medicine_name: str, sitemap_url: str) -> str:
     """Get the exact medicine link from the sitemap."""
-    # Format the medicine name for URL matching
-    formatted_name = medicine_name.lower().replace(' ', '-')
-    partial_link = f"/generics/{formatted_name}"
-    
-    # Fetch the sitemap
-    response = requests.get(sitemap_url)
-    if response.status_code == 200:
-        root = ET.fromstring(response.content)
-        
-        # Extract and filter links
-        links = [elem.text for elem in root.iter() 
-                if elem.text and re.search(rf"{partial_link}-\d+$", elem.text)]
-        
-        # Return the first matching link if found
-        if links:
-            return links[0]
+    return find_medicine_link(medicine_name, fetch_sitemap_links(sitemap_url))
+
+def fetch_sitemap_links(sitemap_url: str) -> list[str]:
+    """Download a sitemap and return every link it lists."""
+    with stage("sitemap:fetch"):
+        response = get_http_session().get(sitemap_url)
+    if response.status_code != 200:
+        return []
+    
+    root = ET.fromstring(response.content)
+    return [elem.text for elem in root.iter() if elem.text]
+
+def find_medicine_link(medicine_name: str, links: list[str]) -> Optional[str]:
+    """Find the exact medicine link among the sitemap links."""
+    # The name as given first, since slugs may contain numbers ("bench-med-3"), then the
+    # canonical name, since most slugs carry no strength or form ("Crocin 650 Tab" -> "crocin")
+    slugs = []
+    for name in (medicine_name.lower().strip(), canonical_name(medicine_name)):
+        slug = name.replace(' ', '-')
+        if slug and slug not in slugs:
+            slugs.append(slug)
+    
+    # Return the first matching link if found
+    for slug in slugs:
+        partial_link = re.escape(f"/generics/{slug}")
+        for link in links:
+            if re.search(rf"{partial_link}-\d+$", link):
+                return link
     
     # Try another sitemap if first one didn't work
     # You might want to implement sitemap discovery logic here
     
     return None
 
-def get_llm_ready_data(url: str) -> str:
-    """Scrape data from the URL and prepare it for LLM processing."""
-    scrape_result = firecrawl_app.scrape_url(url, params={'formats': ['markdown', 'html']})
+async def get_llm_ready_data(url: str) -> str:
+    """Fetch the page (directly, or through Firecrawl when it needs rendering) and prepare it for LLM processing."""
+    page = await page_fetcher.fetch(url, expect=MONOGRAPH_HEADINGS)
     
-    # Return the markdown content which is easier for LLMs to process
-    return scrape_result.get('markdown', '')
+    # Keep only the monograph sections the LLM extracts, within the token budget
+    with stage("content:trim"):
+        content, stats = extract_relevant_sections(page.markdown, CONTENT_TOKEN_BUDGET)
+    if stats["original_tokens"]:
+        TRIM_RATIO.observe(stats["trimmed_tokens"] / stats["original_tokens"], backend=page.backend)
+    return content
 
 def process_with_llm(content: str, medicine_name: str) -> MedicineResponse:
     """Process the scraped content with an LLM to extract structured data."""
@@ -154,39 +326,22 @@ def process_with_llm(content: str, medicine_name: str) -> MedicineResponse:
     """
     
     try:
-        response = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama3-70b-8192",
-            temperature=0.1  # Lower temperature for more consistent outputs
-        )
-        
-        response_content = response.choices[0].message.content.strip()
-        
-        # Try to clean up the response if it contains markdown code blocks
-        if response_content.startswith("```json"):
-            response_content = response_content.replace("```json", "", 1)
-            if response_content.endswith("```"):
-                response_content = response_content[:-3]
-        elif response_content.startswith("```"):
-            response_content = response_content.replace("```", "", 1)
-            if response_content.endswith("```"):
-                response_content = response_content[:-3]
-                
-        # Remove any leading/trailing whitespace
-        response_content = response_content.strip()
-        
-        # Parse the JSON response
-        result = json.loads(response_content)
+        # Try the small model first and escalate when its JSON misses fields;
+        # the response is parsed (and repaired) by the cascade
+        with stage("llm:medicine_info"):
+            result, _ = medicine_info_cascade.complete(
+                [{"role": "user", "content": prompt}],
+                validate_medicine_info,
+                temperature=0.1  # Lower temperature for more consistent outputs
+            )
+        if not isinstance(result, dict):
+            print(f"JSON parsing error for {medicine_name}")
+            # Fall back to a default response
+            return create_default_response(medicine_name)
         
         # Validate that the result contains all required fields
         return MedicineResponse(**result)
         
-    except json.JSONDecodeError as json_err:
-        print(f"JSON parsing error: {json_err}")
-        print(f"Response content: {response_content if 'response_content' in locals() else 'Not available'}")
-        # Fall back to a default response
-        return create_default_response(medicine_name)
-        
     except Exception as e:
         print(f"Error processing LLM response: {str(e)}")
         # If we have a result but it's missing some fields
@@ -0,0 +1,165 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Sections of a 1mg monograph that feed MedicineResponse, in prompt order.
+SECTION_PATTERNS = [
+    ("uses", re.compile(r"\buses?\b|\bbenefits?\b", re.IGNORECASE)),
+    ("side_effects", re.compile(r"side[\s-]?effects?", re.IGNORECASE)),
+    ("how_it_works", re.compile(r"how .{0,60}works?\b|mechanism", re.IGNORECASE)),
+    ("expert_advice", re.compile(r"expert advice|quick tips", re.IGNORECASE)),
+    ("faqs", re.compile(r"\bfaqs?\b|frequently asked", re.IGNORECASE)),
+    ("content_details", re.compile(r"content details|written by|reviewed by|\bauthor", re.IGNORECASE)),
+]
+
+# A rendered monograph has at least one of these headings; an SPA shell has none
+MONOGRAPH_HEADINGS = re.compile(
+    r"^\s{0,3}#{1,6}\s+.*(?:\buses?\b|side[\s-]?effects?|how .{0,60}works?)", re.IGNORECASE | re.MULTILINE)
+MARKDOWN_HEADING = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+BOLD_HEADING = re.compile(r"^\s*\*\*([^*]{2,80})\*\*\s*:?\s*$")
+LINK = re.compile(r"(?<!!)\[([^\]]*)\]\([^)]*\)")
+IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+# Whole lines of site chrome; anchored so "log in" or "designing" inside real text survive
+BOILERPLATE = re.compile(
+    r"^(?:(?:sign|log) ?(?:in|up)(?:\s*(?:/|or)\s*(?:sign|log) ?(?:in|up))?|subscribe(?: now)?|"
+    r"download (?:the )?app(?: now)?|add to cart|privacy policy|terms (?:and|&) conditions|"
+    r"follow us\b.*|disclaimer\b.*|(?:©|copyright\b).*|.*\ball rights reserved\.?|"
+    r"(?:we|this (?:web)?site) uses? cookies\b.*|accept (?:all )?cookies)$",
+    re.IGNORECASE
+)
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for Llama-family tokenizers (~4 characters per token)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _parse_heading(line: str) -> Tuple[Optional[str], int]:
+    """Return the heading text and level of a line, treating bold-only lines as the deepest level."""
+    match = MARKDOWN_HEADING.match(line)
+    if match:
+        return LINK.sub(r"\1", match.group(2)), len(match.group(1))
+    match = BOLD_HEADING.match(line)
+    if match:
+        return match.group(1), 7
+    return None, 0
+
+
+def _classify(heading: str) -> Optional[str]:
+    for section, pattern in SECTION_PATTERNS:
+        if pattern.search(heading):
+            return section
+    return None
+
+
+def _clean_line(line: str, keep_images: bool) -> str:
+    """Strip link targets and images that only cost tokens."""
+    if not keep_images:
+        line = IMAGE.sub("", line)
+    line = LINK.sub(r"\1", line)
+    return line.rstrip()
+
+
+def _is_noise(line: str) -> bool:
+    stripped = line.strip(" -*|>#")
+    if not stripped:
+        return True
+    # Navigation menus and breadcrumbs survive as runs of bare link text
+    if len(stripped) < 3 or BOILERPLATE.match(stripped):
+        return True
+    return False
+
+
+def split_sections(markdown: str) -> Dict[str, List[str]]:
+    """Group page lines under the relevant section headings, dropping everything else."""
+    sections: Dict[str, List[str]] = {}
+    current, current_level = None, 0
+    for raw_line in markdown.splitlines():
+        heading, level = _parse_heading(raw_line)
+        if heading is not None:
+            if current is not None and level > current_level:
+                # Sub-headings such as individual FAQ questions stay in their section
+                sections[current].append(heading)
+                continue
+            section = _classify(heading)
+            if section:
+                current, current_level = section, level
+                sections.setdefault(current, []).append(f"## {heading}")
+                continue
+            # A sibling heading we do not need ends the current section
+            current = None
+            continue
+        if current is None:
+            continue
+        line = _clean_line(raw_line, keep_images=current == "content_details")
+        if not _is_noise(line):
+            sections[current].append(line)
+    return sections
+
+
+def _truncate_lines(lines: List[str], max_tokens: int) -> List[str]:
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            remaining_chars = (max_tokens - used) * CHARS_PER_TOKEN
+            if remaining_chars > 40:
+                kept.append(line[:remaining_chars])
+            break
+        kept.append(line)
+        used += cost
+    return kept
+
+
+def _allocate(sizes: Dict[str, int], budget: int) -> Dict[str, int]:
+    """Split the budget so small sections keep everything and large ones share the rest."""
+    allocation = {}
+    remaining = dict(sizes)
+    while remaining:
+        share = budget // len(remaining)
+        fitting = {name: size for name, size in remaining.items() if size <= share}
+        if not fitting:
+            for name in remaining:
+                allocation[name] = share
+            break
+        for name, size in fitting.items():
+            allocation[name] = size
+            budget -= size
+            del remaining[name]
+    return allocation
+
+
+def extract_relevant_sections(markdown: str, token_budget: int) -> Tuple[str, Dict[str, int]]:
+    """
+    Reduce a scraped monograph to the sections the LLM extracts, within a token budget.
+
+    Args:
+        markdown: Page content as returned by the scraper
+        token_budget: Maximum estimated tokens of content to keep
+
+    Returns:
+        Tuple of (trimmed content, stats with original and trimmed token counts)
+    """
+    original_tokens = estimate_tokens(markdown)
+    sections = split_sections(markdown)
+
+    if not sections:
+        # Unrecognised layout: keep the whole page minus noise, capped to the budget
+        lines = [_clean_line(line, keep_images=True) for line in markdown.splitlines()]
+        kept = _truncate_lines([line for line in lines if not _is_noise(line)], token_budget)
+    else:
+        sizes = {name: sum(estimate_tokens(line) + 1 for line in lines) for name, lines in sections.items()}
+        allocation = _allocate(sizes, token_budget)
+        kept = []
+        for name, _ in SECTION_PATTERNS:
+            if name in sections:
+                kept.extend(_truncate_lines(sections[name], allocation[name]))
+                kept.append("")
+
+    content = "\n".join(kept).strip()
+    return content, {
+        "original_tokens": original_tokens,
+        "trimmed_tokens": estimate_tokens(content),
+        "sections": len(sections)
+    }
@@ -1,11 +1,21 @@
-from firecrawl import FirecrawlApp
-import groq
 from dotenv import load_dotenv
+import asyncio
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query
 import json
 import logging
+import re
 import urllib.parse
+from typing import Optional
+
+from app.services.clients import get_groq_client
+from app.services.fetcher import page_fetcher
+from app.services.rate_limiter import rate_limiter
+from app.utils.llm_json import parse_llm_json
+from app.utils.normalize import search_term
+from app.utils.profiling import enable_profiling
+from app.utils.metrics import instrument_app, record_cache_lookup, stage
+from price_comparison.price_index import PriceIndex, canonical_salt, strength_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -14,23 +24,34 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 app = FastAPI(title="Medicine Price Comparison API")
+# Profiling sits inside the metrics middleware so profiles share the request id
+enable_profiling(app, service="price_comparison")
+instrument_app(app, service="price_comparison")
 
-groq_api_key = os.getenv("GROQ_API_KEY")
-firecrawl_api_key = os.getenv("FIRECRAWL_API_KEY")
+def missing_api_keys():
+    """Names of the API keys this service needs that are not set"""
+    return [name for name in ("GROQ_API_KEY", "FIRECRAWL_API_KEY") if not os.getenv(name)]
 
-# Validate API keys
-if not groq_api_key or not firecrawl_api_key:
-    logger.error("Missing API keys. Please check your .env file.")
-    raise ValueError("Missing required API keys")
+# Keys are checked per request rather than at import, so a combined deployment
+# can still serve the other services when these keys are missing
+if missing_api_keys():
+    logger.error(f"Missing API keys: {', '.join(missing_api_keys())}. Please check your .env file.")
 
-firecrawl_app = FirecrawlApp(api_key=firecrawl_api_key)
-groq_client = groq.Client(api_key=groq_api_key)
+# A rendered search listing shows prices; a page without any is fetched through Firecrawl
+PRICE_LISTING = re.compile(r"(?:₹|Rs\.?|MRP)\s*\d", re.IGNORECASE)
 
 urls = {
-    "1mg_url": "https://www.1mg.com/search/all?name=",
-    "pharmeasy_url": "https://pharmeasy.in/search/all?name="
+    "1mg_url": os.getenv("PRICE_1MG_SEARCH_URL", "https://www.1mg.com/search/all?name="),
+    "pharmeasy_url": os.getenv("PRICE_PHARMEASY_SEARCH_URL", "https://pharmeasy.in/search/all?name=")
 }
 
+# Every successful scrape is indexed; fresh entries are served without scraping
+price_index = PriceIndex()
+
+@app.on_event("shutdown")
+async def close_fetcher():
+    await page_fetcher.close()
+
 @app.get("/")
 def base_url():
     return {"welcome": "Medicine Price Comparison API by Ayyub AB7"}
@@ -40,42 +61,134 @@ async def compare_prices(medicine: str):
     """
     Compare medicine prices across multiple pharmacy websites.
     
+    Pharmacies whose results for this search are in the price index and fresh
+    are answered from it; only the others are scraped. A stale entry is still
+    returned when its refresh fails.
+    
     Args:
         medicine: The name of the medicine to search for
         
     Returns:
         Dictionary containing price information from different sources
     """
+    # Dictionary of pharmacy functions
+    pharmacy_functions = {
+        "1mg": get_1mg,
+        "pharmeasy": get_pharmeasy
+    }
+    
+    # Search with the canonical name and strength ("CROCIN-650mg Tab" -> "crocin 650mg")
+    term = search_term(medicine) or medicine
+    with stage("price_index:lookup"):
+        indexed = {pharmacy: price_index.get_search(term, pharmacy) for pharmacy in pharmacy_functions}
+    stale = [pharmacy for pharmacy, entry in indexed.items() if not (entry and entry["fresh"])]
+    for pharmacy in pharmacy_functions:
+        record_cache_lookup("price_index", pharmacy not in stale)
+    
+    missing = missing_api_keys() if stale else []
+    if missing and not all(indexed[pharmacy] for pharmacy in stale):
+        raise HTTPException(status_code=503, detail=f"Missing required API keys: {', '.join(missing)}")
+    
     results = {}
     
     try:
-        # Dictionary of pharmacy functions
-        pharmacy_functions = {
-            "1mg": get_1mg,
-            "pharmeasy": get_pharmeasy
-        }
-        
-        for pharmacy, func in pharmacy_functions.items():
-            try:
-                results[pharmacy] = func(medicine)
-            except Exception as e:
-                logger.error(f"Error getting prices from {pharmacy}: {str(e)}")
-                results[pharmacy] = {"error": f"Failed to retrieve data: {str(e)}"}
+        if stale and not missing:
+            query = urllib.parse.quote(term)
+            
+            # The pharmacies are scraped at the same time
+            outcomes = await asyncio.gather(*(pharmacy_functions[pharmacy](query) for pharmacy in stale),
+                                            return_exceptions=True)
+            for pharmacy, outcome in zip(stale, outcomes):
+                if isinstance(outcome, Exception):
+                    logger.error(f"Error getting prices from {pharmacy}: {str(outcome)}")
+                    results[pharmacy] = {"error": f"Failed to retrieve data: {str(outcome)}"}
+                else:
+                    results[pharmacy] = outcome
         
         # Format results more cleanly
-        formatted_results = format_comparison_results(results)
+        scraped = format_comparison_results(results)
+        formatted_results = {}
+        for pharmacy in pharmacy_functions:
+            entry = scraped.get(pharmacy)
+            if entry and entry.get("medicines"):
+                await index_search(term, pharmacy, entry)
+                formatted_results[pharmacy] = {**entry, "from_index": False}
+            elif indexed[pharmacy]:
+                formatted_results[pharmacy] = {**indexed[pharmacy], "from_index": True}
+            else:
+                formatted_results[pharmacy] = entry
         return formatted_results
     except Exception as e:
         logger.error(f"Error in compare_prices: {str(e)}")
         return {"error": f"Error getting prices: {str(e)}"}
 
-def get_1mg(medicine_name):
+@app.get("/cheapest/{salt}")
+async def cheapest_equivalents(salt: str, strength: Optional[str] = None, pack_unit: Optional[str] = None,
+                               limit: int = Query(5, ge=1, le=50)):
+    """
+    Cheapest products with this salt and strength, cheapest per unit first.
+    
+    Products are grouped by pack unit (tablet, capsule, ml, ...), since prices per
+    tablet and per ml do not compare. Answered from the index's fresh products;
+    the salt is scraped only when there are none, and stale products are returned
+    only when that fails.
+    
+    Args:
+        salt: Active ingredient(s), e.g. "paracetamol" or "amoxicillin + clavulanic acid";
+            may include the strength, e.g. "paracetamol 650mg"
+        strength: Strength to match, e.g. "650mg"; all strengths when omitted
+        pack_unit: Only list products sold by this unit, e.g. "tablet" or "ml"
+        limit: Number of products to return per pack unit
+        
+    Returns:
+        The products per pack unit with their price per unit, source, and when they were scraped
+    """
+    salt_key = canonical_salt(salt)
+    if not salt_key:
+        raise HTTPException(status_code=400, detail="Salt is required")
+    strength_text = strength_key(strength, salt)
+    
+    with stage("price_index:query"):
+        products = price_index.cheapest(salt_key, strength_text, limit, pack_unit)
+    record_cache_lookup("price_index", bool(products))
+    refreshed = False
+    if not products:
+        error = None
+        try:
+            await compare_prices(f"{salt_key} {strength_text}".strip())
+            refreshed = True
+            products = price_index.cheapest(salt_key, strength_text, limit, pack_unit)
+        except HTTPException as e:
+            error = e
+        if not products:
+            # Without API keys, stale products are the best answer there is
+            products = price_index.cheapest(salt_key, strength_text, limit, pack_unit, fresh_only=False)
+            if not products and error is not None:
+                raise error
+    
+    return {
+        "salt": salt_key,
+        "strength": strength_text or None,
+        "medicines": products,
+        "scraped": refreshed,
+        "ttl_hours": price_index.ttl_seconds / 3600
+    }
+
+async def index_search(term: str, pharmacy: str, entry: dict):
+    """Add a scraped search to the price index; a failure is logged and the results are still returned"""
+    try:
+        await asyncio.to_thread(price_index.record_search, term, pharmacy, entry.get("source_url", ""),
+                                entry["medicines"])
+    except Exception as e:
+        logger.error(f"Error indexing prices from {pharmacy}: {str(e)}")
+
+async def get_1mg(medicine_name):
     """Get medicine prices from 1mg.com"""
     try:
         # Add filter=true to get more relevant results
         url = f"{urls['1mg_url']}{medicine_name}&filter=true&sort=popularity"
-        scraped_data = get_llm_ready_data(url)
-        result = process_with_llm(scraped_data)
+        scraped_data = await get_llm_ready_data(url)
+        result = await asyncio.to_thread(process_with_llm, scraped_data)
         if isinstance(result, str):
             # Try to parse the result if it's a string
             try:
@@ -91,13 +204,13 @@ def get_1mg(medicine_name):
         logger.error(f"Error in get_1mg: {str(e)}")
         return {"error": str(e)}
 
-def get_pharmeasy(medicine_name):
+async def get_pharmeasy(medicine_name):
     """Get medicine prices from pharmeasy.in"""
     try:
         # Use more specific parameters to get only medicines
         url = f"{urls['pharmeasy_url']}{medicine_name}&filter=true&categoryId=1"
-        scraped_data = get_llm_ready_data(url)
-        result = process_with_llm(scraped_data)
+        scraped_data = await get_llm_ready_data(url)
+        result = await asyncio.to_thread(process_with_llm, scraped_data)
         if isinstance(result, str):
             try:
                 result = json.loads(result)
@@ -112,31 +225,23 @@ def get_pharmeasy(medicine_name):
         logger.error(f"Error in get_pharmeasy: {str(e)}")
         return {"error": str(e)}
 
-def get_llm_ready_data(url: str, timeout=None) -> str:
+async def get_llm_ready_data(url: str) -> str:
     """
-    Scrape data from the URL and prepare it for LLM processing.
+    Fetch the page and prepare it for LLM processing.
     
     Args:
         url: The website URL to scrape
-        timeout: Optional timeout in seconds
         
     Returns:
         Filtered content from the website
     """
     try:
-        # Use only the supported parameters for firecrawl
-        params = {'formats': ['markdown', 'html']}
-        if timeout:
-            params['timeout'] = timeout
-            
-        scrape_result = firecrawl_app.scrape_url(
-            url, 
-            params=params
-        )
+        # Fetched directly, or through Firecrawl when the page needs rendering
+        page = await page_fetcher.fetch(url, expect=PRICE_LISTING)
         
         # Get the content
-        markdown_content = scrape_result.get('markdown', '')
-        html_content = scrape_result.get('html', '')
+        markdown_content = page.markdown
+        html_content = page.html
         
         # If markdown is too short, use HTML instead
         content = markdown_content if len(markdown_content) > 500 else html_content
@@ -230,13 +335,14 @@ def process_with_llm(content: str):
     Extract exactly 3 medicines from this pharmacy website content:
     
     1. medicine_name: Full name with brand
-    2. price: Numerical value only
-    3. dosage: Strength (e.g., 500mg)
-    4. quantity: Package amount (e.g., 10 tablets)
+    2. salt: Active ingredient(s), generic name (e.g., paracetamol)
+    3. price: Numerical value only
+    4. dosage: Strength (e.g., 500mg)
+    5. quantity: Package amount (e.g., 10 tablets)
     
     FORMAT: JSON array of objects:
     [
-      {{"medicine_name": "Name", "price": 33.70, "dosage": "650mg", "quantity": "15 tablets"}}
+      {{"medicine_name": "Name", "salt": "paracetamol", "price": 33.70, "dosage": "650mg", "quantity": "15 tablets"}}
     ]
     
     Return [] if no medicines found.
@@ -246,24 +352,27 @@ def process_with_llm(content: str):
     """
     
     try:
-        response = groq_client.chat.completions.create(
-            messages=[{
-                "role": "system", 
-                "content": "Extract medicine data as JSON array. No explanations."
-            },
-            {
-                "role": "user", 
-                "content": prompt
-            }],
-            model="llama3-8b-8192",
-            temperature=0.1,
-            max_tokens=512
-        )
+        rate_limiter.wait("groq")
+        with stage("llm:prices"):
+            response = get_groq_client().chat.completions.create(
+                messages=[{
+                    "role": "system", 
+                    "content": "Extract medicine data as JSON array. No explanations."
+                },
+                {
+                    "role": "user", 
+                    "content": prompt
+                }],
+                model="llama3-8b-8192",
+                temperature=0.1,
+                max_tokens=512
+            )
         
         response_content = response.choices[0].message.content.strip()
         
         # Try to parse and fix JSON if needed
-        return parse_and_fix_json(response_content)
+        with stage("llm:parse"):
+            return parse_and_fix_json(response_content)
             
     except Exception as e:
         logger.error(f"Error in process_with_llm: {str(e)}")
@@ -279,39 +388,11 @@ def parse_and_fix_json(response_content):
     Returns:
         Properly formatted JSON data or error
     """
-    # Try direct parsing first
-    try:
-        # Strip any markdown code blocks if present
-        if response_content.startswith("```json"):
-            response_content = response_content.replace("```json", "", 1)
-        if response_content.startswith("```"):
-            response_content = response_content.replace("```", "", 1)
-        if response_content.endswith("```"):
-            response_content = response_content[:-3]
-            
-        response_content = response_content.strip()
-        return json.loads(response_content)
-    except json.JSONDecodeError:
-        # Handle common malformed JSON issues
-        try:
-            # Check if the content looks like individual JSON objects without the wrapping array
-            if response_content.strip().startswith("{") and not response_content.strip().startswith("["):
-                # Add missing array brackets and fix missing commas between objects
-                fixed_content = "[" + response_content.replace("}\n{", "},{").replace("}\r\n{", "},{") + "]"
-                return json.loads(fixed_content)
-            
-            # Try to extract the JSON part from a potentially larger text
-            import re
-            json_pattern = r'\[[\s\S]*\]'
-            json_match = re.search(json_pattern, response_content)
-            if json_match:
-                return json.loads(json_match.group(0))
-                
-            # If we can't fix it, return the raw response
-            return {"raw_response": response_content, "error": "Malformed JSON"}
-        except Exception as e:
-            logger.error(f"Error fixing JSON: {str(e)}")
-            return {"raw_response": response_content, "error": "Malformed JSON that couldn't be fixed"}
+    result = parse_llm_json(response_content)
+    if result is None:
+        logger.error("Could not repair LLM response into JSON")
+        return {"raw_response": response_content, "error": "Malformed JSON that couldn't be fixed"}
+    return result
 
 def format_comparison_results(results):
     """
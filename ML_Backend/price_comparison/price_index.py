@@ -0,0 +1,217 @@
+"""
+Local index of scraped pharmacy prices.
+
+Every successful scrape is recorded twice in one SQLite file: the search
+(query and pharmacy -> medicines listed, with when they were scraped), so a
+repeated /get_prices call is answered without scraping while it is fresh, and
+one row per product with its canonical name, salt, strength, pack size and
+price per unit, so "cheapest products with this salt and strength" is a single
+indexed query. Rows keep the time they were scraped. A search older than the
+TTL is still returned, marked stale, until the next scrape replaces it; that
+scrape also drops the products the search no longer lists. Anything not
+scraped again within the retention period is deleted.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.utils.normalize import canonical_name, parse_strength
+
+PRICE_INDEX_FILE = os.getenv("PRICE_INDEX_FILE", "price_index.sqlite3")
+PRICE_INDEX_TTL_HOURS = float(os.getenv("PRICE_INDEX_TTL_HOURS", "24"))
+PRICE_INDEX_RETENTION_HOURS = float(os.getenv("PRICE_INDEX_RETENTION_HOURS", "168"))
+
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    query TEXT NOT NULL,
+    source TEXT NOT NULL,
+    source_url TEXT,
+    medicines TEXT NOT NULL,
+    scraped_at REAL NOT NULL,
+    PRIMARY KEY (query, source)
+);
+CREATE TABLE IF NOT EXISTS products (
+    source TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    medicine_name TEXT NOT NULL,
+    salt TEXT,
+    strength TEXT,
+    pack_size REAL,
+    pack_unit TEXT NOT NULL,
+    price REAL NOT NULL,
+    unit_price REAL,
+    source_url TEXT,
+    query TEXT NOT NULL,
+    scraped_at REAL NOT NULL,
+    PRIMARY KEY (source, name_key, strength, pack_unit)
+);
+CREATE INDEX IF NOT EXISTS products_by_search ON products (source, query);
+CREATE INDEX IF NOT EXISTS products_by_salt ON products (salt, strength, unit_price);
+"""
+
+# Pack units and the unit a price is expressed per
+PACK_UNITS = {
+    "tablet": "tablet", "tab": "tablet", "capsule": "capsule", "cap": "capsule", "softgel": "capsule",
+    "sachet": "sachet", "lozenge": "lozenge", "piece": "piece", "unit": "piece",
+    "ml": "ml", "g": "g", "gm": "g",
+}
+# "15 tablets", "strip of 10 capsules", "10 x 10 tablets", "bottle of 100 ml"
+PACK_PATTERN = re.compile(
+    r"(\d+(?:\.\d+)?)(?:\s*[x×*]\s*(\d+(?:\.\d+)?))?\s*(" + "|".join(sorted(PACK_UNITS, key=len, reverse=True))
+    + r")s?\b", re.IGNORECASE)
+PRICE_PATTERN = re.compile(r"\d+(?:,\d{3})*(?:\.\d+)?")
+SALT_SEPARATORS = re.compile(r"\s*(?:\+|,|&|/|\band\b|\bwith\b)\s*", re.IGNORECASE)
+
+
+def canonical_salt(salt: Optional[str]) -> str:
+    """Salt key: the canonical name of each ingredient, sorted, e.g. "Caffeine + Paracetamol" -> "caffeine + paracetamol"."""
+    if not salt:
+        return ""
+    parts = {canonical_name(part) for part in SALT_SEPARATORS.split(salt)}
+    return " + ".join(sorted(part for part in parts if part))
+
+
+def strength_key(*texts: Optional[str]) -> str:
+    """Canonical strength from the first text that has one, e.g. "650mg" -> "650 mg"."""
+    for text in texts:
+        strength = parse_strength(text)
+        if strength is not None:
+            return str(strength)
+    return ""
+
+
+def parse_pack_size(quantity: Optional[str]):
+    """(count, unit) of a pack description, or (None, None) when it does not parse."""
+    match = PACK_PATTERN.search(str(quantity or ""))
+    if not match:
+        return None, None
+    count = float(match.group(1)) * float(match.group(2) or 1)
+    return (count, PACK_UNITS[match.group(3).lower()]) if count > 0 else (None, None)
+
+
+def parse_price(price) -> Optional[float]:
+    """Price as a number, from either a number or text like "₹1,234.50"."""
+    if not isinstance(price, (int, float)):
+        match = PRICE_PATTERN.search(str(price or ""))
+        price = float(match.group(0).replace(",", "")) if match else 0
+    return float(price) if price > 0 else None
+
+
+class PriceIndex:
+    """
+    SQLite-backed price index. Reads and writes share one connection under a
+    lock; the database runs in WAL mode so a write does not block other processes
+    reading it.
+    """
+
+    def __init__(self, path: str = PRICE_INDEX_FILE, ttl_hours: float = PRICE_INDEX_TTL_HOURS,
+                 retention_hours: float = PRICE_INDEX_RETENTION_HOURS):
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.retention_seconds = max(retention_hours * 3600, self.ttl_seconds)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                # Older layouts are rebuilt from scratch; the index refills from scrapes
+                self._db.executescript("DROP TABLE IF EXISTS searches; DROP TABLE IF EXISTS products;")
+                self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._db.executescript(SCHEMA)
+
+    def _freshness(self, scraped_at: float, now: float) -> dict:
+        age = now - scraped_at
+        return {"scraped_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(scraped_at)),
+                "age_hours": round(age / 3600, 2), "fresh": age < self.ttl_seconds}
+
+    def record_search(self, query: str, source: str, source_url: str, medicines: List[dict]) -> int:
+        """
+        Store the medicines a search listed and index each priced product, dropping
+        products this search listed before but no longer does. Returns the products indexed.
+        """
+        now = time.time()
+        rows = []
+        for item in medicines:
+            if not isinstance(item, dict):
+                continue
+            price = parse_price(item.get("price"))
+            name_key = canonical_name(item.get("medicine_name"))
+            if price is None or not name_key:
+                continue
+            pack_size, pack_unit = parse_pack_size(item.get("quantity"))
+            rows.append((
+                source, name_key, item["medicine_name"], canonical_salt(item.get("salt")) or None,
+                strength_key(item.get("dosage"), item.get("medicine_name")), pack_size, pack_unit or "pack", price,
+                round(price / pack_size, 4) if pack_size else None, source_url, query, now
+            ))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO searches (query, source, source_url, medicines, scraped_at) VALUES (?, ?, ?, ?, ?)",
+                (query, source, source_url, json.dumps(medicines), now))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO products (source, name_key, medicine_name, salt, strength, pack_size, "
+                "pack_unit, price, unit_price, source_url, query, scraped_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            # Products that dropped out of this listing
+            self._db.execute("DELETE FROM products WHERE source = ? AND query = ? AND scraped_at < ?",
+                             (source, query, now))
+            cutoff = now - self.retention_seconds
+            self._db.execute("DELETE FROM products WHERE scraped_at < ?", (cutoff,))
+            self._db.execute("DELETE FROM searches WHERE scraped_at < ?", (cutoff,))
+        return len(rows)
+
+    def get_search(self, query: str, source: str) -> Optional[Dict]:
+        """The medicines a search last listed with their freshness, or None if it was never scraped."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT source_url, medicines, scraped_at FROM searches WHERE query = ? AND source = ?",
+                (query, source)).fetchone()
+        if row is None:
+            return None
+        return {"medicines": json.loads(row["medicines"]), "source_url": row["source_url"],
+                **self._freshness(row["scraped_at"], time.time())}
+
+    def cheapest(self, salt: str, strength: str = "", limit: int = 5, pack_unit: Optional[str] = None,
+                 fresh_only: bool = True) -> Dict[str, List[Dict]]:
+        """
+        Products with this salt (and strength, when given), grouped by pack unit and
+        cheapest per unit first within each group, since a price per tablet and a
+        price per ml do not compare. Products without a parsed pack size have the
+        unit "pack" and are ordered by pack price. Stale products are left out unless
+        ``fresh_only`` is False.
+        """
+        query = ("SELECT source, medicine_name, salt, strength, pack_size, pack_unit, price, unit_price, "
+                 "source_url, scraped_at FROM products WHERE salt = ?")
+        params = [canonical_salt(salt)]
+        if strength:
+            query += " AND strength = ?"
+            params.append(strength)
+        if pack_unit:
+            query += " AND pack_unit = ?"
+            params.append(PACK_UNITS.get(pack_unit.lower().rstrip("s"), pack_unit.lower()))
+        now = time.time()
+        if fresh_only:
+            query += " AND scraped_at >= ?"
+            params.append(now - self.ttl_seconds)
+        query += " ORDER BY pack_unit, unit_price IS NULL, unit_price, price"
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        groups: Dict[str, List[Dict]] = {}
+        for row in rows:
+            entry = dict(row)
+            group = groups.setdefault(entry["pack_unit"], [])
+            if len(group) < limit:
+                entry.update(self._freshness(entry.pop("scraped_at"), now))
+                group.append(entry)
+        return groups
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()